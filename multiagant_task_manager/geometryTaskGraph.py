@@ -1,8 +1,21 @@
 
+import collections
+import threading
 import maAgent as ag
 import maEdge as ed
 import maNode as nd # TODO: Implement this class
 import maGraphEngines as ge
+import maLandmarks as lm
+import maCSR as csr
+import maConnectivity as cn
+import maReservation as rs
+import maColumnar as cl
+import maCBS as cbs
+import maConcurrency as cc
+import maPersistence as ps
+import maLogging as lg
+
+logger = lg.get_logger(__name__)
 
 
 # The class for geometry task graph
@@ -11,12 +24,16 @@ class GEOMETRY_TASK_GRAPH(object):
     """
     def __init__(self):
         """
+        Note: The logging level is process-wide, see set_verbosity().
         """
         self.num_nodes = 0
         self.num_edges = 0
         # Adjacent graph, store a list of (to_node_id, edge_id) pair of a from_node_id
         # self.adj_graph = [[] for _ in range(self.num_nodes)]
         self.adj_graph = [] # Empty
+        # Reversed adjacent graph, store a list of (from_node_id, edge_id) pair of a to_node_id
+        # Note: It's updated together with adj_graph for the backward searches.
+        self.adj_graph_reversed = [] # Empty
         # Nodes
         # For searching and inverse searching between node id and the node "name"
         # Note that id and "name" are one to one
@@ -26,6 +43,70 @@ class GEOMETRY_TASK_GRAPH(object):
         self.node_name_id_dict = dict() # Layout: {'name1':0, 'name2':1, 'name3':2, ...}
         # Edges, indexed by the edge_id recorded in adj_graph
         self.edge_list = [] # Dynamically changed, elements are ed.EDGE()
+        # For looking up the edge between two nodes, {(from_node_id, to_node_id):edge_id, ...}
+        # Note: A bidirectional edge is recorded in both directions.
+        self.edge_id_dict = dict()
+        # Where each agent is booked, {agent_id:{task_id:{edge_id:None, ...}, ...}, ...}, see get_agent_reservations()
+        # Note: The T_zones are kept only in the edges, and the innermost dict is used as a set (which is larger).
+        self.agent_reservation_dict = dict()
+        # The way of counting capacity for all edges, see ed.CAPACITY_MODE_*
+        self.capacity_mode = ed.CAPACITY_MODE_INTERVAL
+        # The search engine used by query_path_exist() and book_a_path(), see ge.SEARCH_ENGINE_DICT
+        self.search_engine = ge.SEARCH_ENGINE_ASTAR
+        # Static lower bounds for A*, {(node_id, is_backtrack):[...], ...}, least recently used ones are dropped
+        self.lower_bound_cache_size = 64
+        self._lower_bound_dict = collections.OrderedDict()
+        # ALT landmark table for A*, see build_landmarks()
+        self.landmark_table = None
+        # Frozen CSR views of adj_graph, {is_reversed:csr.CSR_GRAPH(), ...}, re-generated after edges are added
+        self._csr_graph_dict = dict()
+        self.is_using_csr = False # If True, the search engines consume the CSR view instead of adj_graph
+        # Maintained connectivity of time windows, {(T_zone, only_count_activated_agent):cn.CONNECTIVITY_TRACKER(), ...}
+        self.connectivity_tracker_dict = dict()
+        # Space-time reservations of nodes and edges, see set_node_reservation()
+        self.reservation_table = None # "None" means the nodes are not reserved
+        # Columnar copy of the tasks of all the edges for the vectorized queries, see set_columnar_store()
+        self.reservation_columns = None
+        # Callbacks of the state changes of all the edges, see add_state_listener()
+        self.state_listener_list = []
+        # Requests waiting for a path, {pending_id:(request, ge.INCREMENTAL_SEARCH()), ...}, see add_pending_request()
+        self.pending_request_dict = dict()
+        self._pending_id = 0
+        # The version of the states, increased on every change of the topology or of the edges
+        self.state_version = 0
+        # Results of _search_path(), {key:(path, state_version, touched_edge_set), ...}, least recently used ones are dropped
+        self.path_cache_size = 256 # 0 means no cache
+        self._path_cache = collections.OrderedDict()
+        # The keys in _path_cache depending on each edge/node, {edge_id:set(key), ...} and {node_id:set(key), ...}
+        # Note: The results of ge.SEARCH_ENGINE_PRIORITY_QUEUE depend on all the edges, and are kept in _path_cache_global_key_set.
+        self._path_cache_edge_dict = dict()
+        self._path_cache_node_dict = dict()
+        self._path_cache_global_key_set = set()
+        self.path_cache_num_hits = 0
+        self.path_cache_num_misses = 0
+        # Locks for serving the bookings from several threads, see book_a_path_concurrent()
+        # Note: The topology is expected to be built before the concurrent bookings begin.
+        self.rw_lock = cc.READ_WRITE_LOCK() # Shared by the searches, exclusive for the removals
+        self.resource_lock_set = cc.ORDERED_LOCK_SET() # The edges/nodes on the path being booked
+        self._cache_lock = threading.RLock() # The caches and the indexes shared by the (parallel) searches and bookings
+
+    @staticmethod
+    def set_verbosity(verbosity):
+        """
+        Set the logging level of the whole package (graph, edges, agents and engines).
+        Note: The level is process-wide (see maLogging), it applies to all the graphs, not only to one instance.
+        inputs
+            - verbosity: logging.DEBUG/INFO/WARNING/ERROR/CRITICAL
+                         e.g. logging.WARNING for production runs, which emit nothing on the hot path
+        outputs
+            - True/False
+        """
+        try:
+            lg.set_verbosity(verbosity)
+        except (ValueError, TypeError):
+            logger.error('Unknown verbosity <%s>. The verbosity is not changed.', verbosity)
+            return False
+        return True
 
     def _is_edge_in_adj_graph(self, from_node_id, to_node_id, check_dual_direction=True):
         """
@@ -35,14 +116,12 @@ class GEOMETRY_TASK_GRAPH(object):
             return False
         else:
             # Normal direction
-            for node_id, edge_id in self.adj_graph[from_node_id]:
-                if node_id == to_node_id:
-                    return True
+            if (from_node_id, to_node_id) in self.edge_id_dict:
+                return True
             if check_dual_direction:
                 # Reverse direction
-                for node_id, edge_id in self.adj_graph[to_node_id]:
-                    if node_id == from_node_id:
-                        return True
+                if (to_node_id, from_node_id) in self.edge_id_dict:
+                    return True
         #
         return False
 
@@ -64,16 +143,12 @@ class GEOMETRY_TASK_GRAPH(object):
             from_node_id = path[i]
             to_node_id = path[i+1]
             if not self._is_edge_in_adj_graph(from_node_id, to_node_id, check_dual_direction=True):
-                print("ERROR: The edge (%d --> %d) is not in the given path" % (from_node_id, to_node_id) )
+                logger.error("The edge (%d --> %d) is not in the given path", from_node_id, to_node_id)
                 return None
-            edge_id = None
-            for nid, eid in self.adj_graph[from_node_id]:
-                if nid == to_node_id:
-                    edge_id = eid
-                    break
+            edge_id = self.edge_id_dict.get((from_node_id, to_node_id), None)
             if edge_id is None:
                 # Something wrong
-                print("ERROR: The edge (%d --> %d) is not in the given path" % (from_node_id, to_node_id) )
+                logger.error("The edge (%d --> %d) is not in the given path", from_node_id, to_node_id)
                 return None
             # Found edge_id
             path_edges.append(edge_id)
@@ -162,7 +237,7 @@ class GEOMETRY_TASK_GRAPH(object):
         """
         if node_name in self.node_name_id_dict:
             # The node name already exist
-            print('ERROR: The node name <%s> is already exist, the node is not added.' % node_name)
+            logger.error('The node name <%s> is already exist, the node is not added.', node_name)
             return False
         else:
             node_id = len(self.node_id_name_list)
@@ -171,8 +246,19 @@ class GEOMETRY_TASK_GRAPH(object):
             self.node_id_name_list.append(node_name)
             # Update adj_graph
             self.adj_graph.append([])
+            self.adj_graph_reversed.append([])
             # Increase the counter
             self.num_nodes += 1
+            # The topology changed
+            self._lower_bound_dict.clear()
+            self._csr_graph_dict.clear()
+            if not self.landmark_table is None:
+                self.landmark_table.add_node()
+            for tracker in self.connectivity_tracker_dict.values():
+                tracker.add_node()
+            for request, search in self.pending_request_dict.values():
+                search.invalidate()
+            self._on_topology_changed()
 
     #                                 (from_node_id, to_node_id, is_bidirectional, capacity, duration)
     def add_one_edge_by_node_id(self, from_node_id, to_node_id, is_bidirectional=True, capacity=1, duration=(0, None)):
@@ -190,24 +276,43 @@ class GEOMETRY_TASK_GRAPH(object):
         """
         if from_node_id >= self.num_nodes or to_node_id >= self.num_nodes:
             # At least one of the nodes not created!
-            print('WARN: At least one of the node id (%d, %d) does not exist, no new edge created.' % (from_node_id, to_node_id))
+            logger.warning('At least one of the node id (%d, %d) does not exist, no new edge created.', from_node_id, to_node_id)
             return False
 
         # Nodes exist
         edge_id = len(self.edge_list) # Append to the end of the edge_state
         if self._is_edge_in_adj_graph(from_node_id, to_node_id):
-            print('WARN: The edge (%d, %d) already exist, no new edge created.' % (from_node_id, to_node_id))
+            logger.warning('The edge (%d, %d) already exist, no new edge created.', from_node_id, to_node_id)
             return False
         # else, create a new one
         if is_bidirectional:
             self.adj_graph[from_node_id].append((to_node_id, edge_id))
             self.adj_graph[to_node_id].append((from_node_id, edge_id))
+            self.adj_graph_reversed[to_node_id].append((from_node_id, edge_id))
+            self.adj_graph_reversed[from_node_id].append((to_node_id, edge_id))
+            self.edge_id_dict[(from_node_id, to_node_id)] = edge_id
+            self.edge_id_dict[(to_node_id, from_node_id)] = edge_id
         else:
             self.adj_graph[from_node_id].append((to_node_id, edge_id))
+            self.adj_graph_reversed[to_node_id].append((from_node_id, edge_id))
+            self.edge_id_dict[(from_node_id, to_node_id)] = edge_id
         # Edges
-        self.edge_list.append( ed.EDGE(edge_id, from_node_id, to_node_id, is_bidirectional, capacity, duration) )
+        self.edge_list.append( ed.EDGE(edge_id, from_node_id, to_node_id, is_bidirectional, capacity, duration, self.capacity_mode) )
+        self.edge_list[edge_id].add_state_listener(self._on_edge_state_changed)
         # Increase the counter
         self.num_edges += 1
+        # The topology changed
+        self._lower_bound_dict.clear()
+        self._csr_graph_dict.clear()
+        if not self.landmark_table is None:
+            self.landmark_table.add_edge(self.adj_graph, self.edge_list, edge_id)
+        if not self.reservation_columns is None:
+            self.reservation_columns.add_edge(edge_id)
+        for tracker in self.connectivity_tracker_dict.values():
+            tracker.add_edge(edge_id)
+        for request, search in self.pending_request_dict.values():
+            search.invalidate()
+        self._on_topology_changed()
         return True
 
     #                                 (from_node_name, to_node_name, is_bidirectional, capacity, duration)
@@ -228,31 +333,314 @@ class GEOMETRY_TASK_GRAPH(object):
             from_node_id = self.node_name_id_dict[from_node_name]
             to_node_id = self.node_name_id_dict[to_node_name]
         except:
-            print('WARN: At least one of the node name (%s, %s) does not exist, no new edge created.' % (from_node_name, to_node_name))
+            logger.warning('At least one of the node name (%s, %s) does not exist, no new edge created.', from_node_name, to_node_name)
             return False
         #
         return self.add_one_edge_by_node_id(from_node_id, to_node_id, is_bidirectional, capacity, duration)
     #-----------------------------------------#
 
 
+    def set_capacity_mode(self, capacity_mode):
+        """
+        Set the way of counting capacity for all the edges (including the ones added later).
+        inputs
+            - capacity_mode:
+                - ed.CAPACITY_MODE_INTERVAL: every agent touching the time zone counts
+                - ed.CAPACITY_MODE_PROFILE: only the peak number of concurrent agents counts
+        outputs
+            - True/False
+        """
+        if not capacity_mode in (ed.CAPACITY_MODE_INTERVAL, ed.CAPACITY_MODE_PROFILE):
+            logger.error('Unknown capacity_mode <%s>. The capacity_mode is not changed.', capacity_mode)
+            return False
+        self.capacity_mode = capacity_mode
+        for edge in self.edge_list:
+            edge.set_capacity_mode(capacity_mode)
+        if not self.reservation_columns is None:
+            self.reservation_columns.update_edge_properties()
+        # The availability of all the edges may change
+        for tracker in self.connectivity_tracker_dict.values():
+            tracker.build(self.adj_graph, self.edge_list, None, self.adj_graph_reversed)
+        for request, search in self.pending_request_dict.values():
+            search.invalidate()
+        self._on_topology_changed()
+        return True
+
+    # Persistence
+    #---------------------------------------#
+    def save(self, file_path):
+        """
+        Save the nodes, the edges, the reservations and the settings into a binary file, see maPersistence.
+        outputs
+            - True/False
+        """
+        return ps.save_graph(self, file_path)
+
+    def load(self, file_path):
+        """
+        Load a file saved by save() into this (empty) graph.
+        The file is mapped into memory, and the edges are built only when they are accessed.
+        outputs
+            - True/False
+        """
+        return ps.load_graph(self, file_path)
+    #---------------------------------------#
+
+    # Path cache
+    #---------------------------------------#
+    def _on_topology_changed(self):
+        """
+        Every cached result is out-dated.
+        """
+        self.state_version += 1
+        self.clear_path_cache()
+
+    def set_path_cache_size(self, path_cache_size):
+        """
+        Set the maximum number of results cached by _search_path(), 0 means no cache.
+        """
+        self.path_cache_size = max(0, int(path_cache_size))
+        while len(self._path_cache) > self.path_cache_size:
+            self._remove_path_cache(next(iter(self._path_cache)))
+        return True
+
+    def clear_path_cache(self):
+        self._path_cache.clear()
+        self._path_cache_edge_dict.clear()
+        self._path_cache_node_dict.clear()
+        self._path_cache_global_key_set.clear()
+
+    def _remove_path_cache(self, key):
+        """
+        Remove a cached result and its dependencies.
+        """
+        path, state_version, touched_edge_set = self._path_cache.pop(key)
+        if touched_edge_set is None:
+            self._path_cache_global_key_set.discard(key)
+            return
+        for edge_id in touched_edge_set:
+            edge = self.edge_list[edge_id]
+            for key_dict, dep_id in ((self._path_cache_edge_dict, edge_id), (self._path_cache_node_dict, edge.from_node_id), (self._path_cache_node_dict, edge.to_node_id)):
+                key_set = key_dict.get(dep_id, None)
+                if key_set is None:
+                    continue
+                key_set.discard(key)
+                if not key_set:
+                    del key_dict[dep_id]
+
+    def _put_path_cache(self, key, path, touched_edge_set):
+        """
+        Cache a result, touched_edge_set is the edges that the result depends on ("None" means all).
+        """
+        if self.path_cache_size <= 0:
+            return
+        if key in self._path_cache:
+            self._remove_path_cache(key)
+        while len(self._path_cache) >= self.path_cache_size:
+            self._remove_path_cache(next(iter(self._path_cache)))
+        self._path_cache[key] = (path, self.state_version, touched_edge_set)
+        if touched_edge_set is None:
+            self._path_cache_global_key_set.add(key)
+            return
+        for edge_id in touched_edge_set:
+            edge = self.edge_list[edge_id]
+            self._path_cache_edge_dict.setdefault(edge_id, set()).add(key)
+            self._path_cache_node_dict.setdefault(edge.from_node_id, set()).add(key)
+            self._path_cache_node_dict.setdefault(edge.to_node_id, set()).add(key)
+
+    def _invalidate_path_cache(self, edge_id=None, node_id=None):
+        """
+        Remove the cached results depending on the states of an edge or a node (e.g. a node reservation).
+        """
+        key_set_list = [self._path_cache_global_key_set]
+        if not edge_id is None:
+            key_set_list.append(self._path_cache_edge_dict.get(edge_id, ()))
+        if not node_id is None:
+            key_set_list.append(self._path_cache_node_dict.get(node_id, ()))
+        for key_set in key_set_list:
+            # Drain in place, _remove_path_cache() also discards the key from the other sets
+            while key_set:
+                self._remove_path_cache(key_set.pop())
+    #---------------------------------------#
+
+
     # Agent operations
     #---------------------------------------#
+    def add_state_listener(self, callback):
+        """
+        Register a callback called as callback(edge, event, agent_id, task_id)
+        after each state change of any edge (see ed.EDGE_EVENT_*).
+        """
+        if not callback in self.state_listener_list:
+            self.state_listener_list.append(callback)
+        return True
+
+    def remove_state_listener(self, callback):
+        """
+        Un-register a callback.
+        """
+        if callback in self.state_listener_list:
+            self.state_listener_list.remove(callback)
+            return True
+        return False
+
+    def _on_edge_state_changed(self, edge, event, agent_id, task_id):
+        """
+        The state listener registered to every edge,
+        called after an agent/task is put, removed, activated or deactivated on the edge.
+        """
+        # The bookings on other edges may run in parallel (see book_a_path_concurrent())
+        with self._cache_lock:
+            if event == ed.EDGE_EVENT_PUT:
+                self.agent_reservation_dict.setdefault(agent_id, dict()).setdefault(task_id, dict())[edge.edge_id] = None
+            elif event == ed.EDGE_EVENT_REMOVE:
+                self._unindex_agent_reservation(edge.edge_id, agent_id, task_id)
+            if not self.reservation_columns is None:
+                self.reservation_columns.on_edge_state_changed(edge, event, agent_id, task_id)
+            for tracker in self.connectivity_tracker_dict.values():
+                tracker.update_edge(edge.edge_id)
+            if not self.reservation_table is None:
+                if event == ed.EDGE_EVENT_PUT:
+                    self.reservation_table.reserve_edge(edge.edge_id, edge.get_task_T_zone(agent_id, task_id), agent_id, task_id)
+                elif event == ed.EDGE_EVENT_REMOVE:
+                    self.reservation_table.release_edge(edge.edge_id, agent_id, task_id)
+            self.state_version += 1
+            self._invalidate_path_cache(edge.edge_id)
+            if not self.reservation_table is None:
+                # The nodes at both ends may be reserved together
+                self._invalidate_path_cache(node_id=edge.from_node_id)
+                self._invalidate_path_cache(node_id=edge.to_node_id)
+            for callback in self.state_listener_list:
+                callback(edge, event, agent_id, task_id)
+
+    def _unindex_agent_reservation(self, edge_id, agent_id, task_id=None):
+        """
+        Remove the reservations of an agent (with specified/non-specified task_id) at an edge from agent_reservation_dict.
+        """
+        task_edge_dict = self.agent_reservation_dict.get(agent_id, None)
+        if task_edge_dict is None:
+            return
+        for task_id_i in ([task_id] if not task_id is None else list(task_edge_dict)):
+            edge_task_dict = task_edge_dict.get(task_id_i, None)
+            if edge_task_dict is None:
+                continue
+            edge_task_dict.pop(edge_id, None)
+            if not edge_task_dict:
+                del task_edge_dict[task_id_i]
+        if not task_edge_dict:
+            del self.agent_reservation_dict[agent_id]
+
+    def get_agent_reservations(self, agent_id, task_id=None):
+        """
+        Where an agent is booked, without scanning the edges.
+        inputs
+            - agent_id
+            - task_id (default: None): "None" means all the tasks of the agent
+        outputs
+            - a list of (task_id, edge_id, T_zone), sorted by T_zone
+        """
+        task_edge_dict = self.agent_reservation_dict.get(agent_id, dict())
+        reservation_list = []
+        for task_id_i in ([task_id] if not task_id is None else list(task_edge_dict)):
+            for edge_id in task_edge_dict.get(task_id_i, ()):
+                reservation_list.append( (task_id_i, edge_id, self.edge_list[edge_id].get_task_T_zone(agent_id, task_id_i)) )
+        reservation_list.sort(key=lambda reservation: (reservation[2], reservation[1]))
+        return reservation_list
+
+    def set_node_reservation(self, is_enabled=True, bucket_size=1.0, node_capacity=1):
+        """
+        Enable/disable the space-time reservations of nodes.
+        When enabled, the nodes on the booked paths are reserved at the arrival time zones,
+        and the searches do not enter the nodes reserved by other agents.
+        The reservations are re-built from the tasks already on the edges.
+        inputs
+            - is_enabled (default: True)
+            - bucket_size (default: 1.0): the length of time of a bucket of the reservation table
+            - node_capacity (default: 1): the number of agents allowed at a node at the same time
+        outputs
+            - True/False
+        """
+        if not is_enabled:
+            self.reservation_table = None
+            for request, search in self.pending_request_dict.values():
+                search.reservation_table = None
+                search.invalidate()
+            self._on_topology_changed()
+            return True
+        table = rs.RESERVATION_TABLE(bucket_size, node_capacity)
+        for edge in self.edge_list:
+            for agent_id in edge.agent_dict:
+                for task_id in edge.agent_dict[agent_id].task_dict:
+                    T_zone = edge.get_task_T_zone(agent_id, task_id)
+                    table.reserve_edge(edge.edge_id, T_zone, agent_id, task_id)
+                    # The time zones at both ends, see ed.EDGE.get_T_zone_occ_from_start()
+                    T_zone_start = (T_zone[0], T_zone[1] - edge.duration[1])
+                    table.reserve_node(edge.from_node_id, T_zone_start, agent_id, task_id)
+                    table.reserve_node(edge.to_node_id, edge.get_T_zone_end_from_start(T_zone_start), agent_id, task_id)
+        self.reservation_table = table
+        for request, search in self.pending_request_dict.values():
+            search.reservation_table = table
+            search.invalidate()
+        self._on_topology_changed()
+        logger.info('The node reservation is enabled with %d reservations.', len(table))
+        return True
+
     def _remove_agent_from_all_edges(self, agent_id, task_id=None):
         """
         Remove an agent from all edges with specified/non-specified task_id.
+        Only the edges where the agent is booked (see get_agent_reservations()) are visited.
         """
-        for edge in self.edge_list:
-            if edge.is_agent_in_edge(agent_id):
-                # print('INFO: Remove the agent <%d> with task <%d> from edge <%d>.' % (agent_id, edge.agent_dict[agent_id].task_id, edge.edge_id))
-                edge.remove_agent(agent_id, task_id)
+        for edge_id in self._get_agent_edge_id_list(agent_id, task_id):
+            # print('INFO: Remove the agent <%d> with task <%d> from edge <%d>.' % (agent_id, edge.agent_dict[agent_id].task_id, edge.edge_id))
+            self.edge_list[edge_id].remove_agent(agent_id, task_id)
         #
         return True
 
+    def _get_agent_edge_id_list(self, agent_id, task_id=None):
+        """
+        The sorted edge_id where an agent (with specified/non-specified task_id) is booked.
+        """
+        task_edge_dict = self.agent_reservation_dict.get(agent_id, dict())
+        edge_id_set = set()
+        for task_id_i in ([task_id] if not task_id is None else list(task_edge_dict)):
+            edge_id_set.update(task_edge_dict.get(task_id_i, ()))
+        return sorted(edge_id_set)
+
+    def _activate_agent_on_all_edges(self, agent_id, task_id):
+        """
+        Activate a task of an agent on all the edges where it is booked.
+        outputs
+            - True/False: False if the task is not booked
+        """
+        edge_task_dict = self.agent_reservation_dict.get(agent_id, dict()).get(task_id, dict())
+        for edge_id in sorted(edge_task_dict):
+            self.edge_list[edge_id].activate_agent(agent_id, task_id)
+        return (len(edge_task_dict) > 0)
+
+    def _deactivate_agent_on_all_edges(self, agent_id, task_id=None):
+        """
+        Deactivate an agent with specified/non-specified task_id on all the edges where it is booked.
+        outputs
+            - True/False: False if the agent (task) is not booked
+        """
+        task_edge_dict = self.agent_reservation_dict.get(agent_id, dict())
+        edge_id_set = set()
+        for task_id_i in ([task_id] if not task_id is None else list(task_edge_dict)):
+            edge_id_set.update(task_edge_dict.get(task_id_i, ()))
+        for edge_id in sorted(edge_id_set):
+            self.edge_list[edge_id].deactivate_agent(agent_id, task_id)
+        return (len(edge_id_set) > 0)
+
     def _remove_agent_from_all_nodes(self, agent_id, task_id=None):
         """
         Remove an agent from all nodes with specified/non-specified task_id.
         """
-        # TODO: Implement this function.
+        if not self.reservation_table is None:
+            resource_list = self.reservation_table.release(agent_id, task_id, resource_kind=rs.RESOURCE_NODE)
+            if resource_list:
+                self.state_version += 1
+                for node_id in set(resource_id for kind, resource_id in resource_list):
+                    self._invalidate_path_cache(node_id=node_id)
         #
         return True
 
@@ -290,48 +678,410 @@ class GEOMETRY_TASK_GRAPH(object):
                 self.edge_list[edge_id].remove_agent(agent_id, task_id)
         #
         # Remove from nodes
-        # TODO: Remove from nodes on path, too!
+        if not self.reservation_table is None:
+            for node_id in (path[:-1] if is_keeping_agent_on_last_node else path):
+                if self.reservation_table.release_node(node_id, agent_id, task_id):
+                    self.state_version += 1
+                    self._invalidate_path_cache(node_id=node_id)
 
         return True
 
-    def _add_agent_by_path(self, path, T_zone_start, agent_id, task_id, is_activated=True):
+    def _plan_agent_by_path(self, path, T_zone_start, wait_list=None):
+        """
+        The reservations that booking a path would write, without writing them.
+        inputs
+            - path
+            - T_zone_start = (T_min, T_max)
+            - wait_list (default: None): see _add_agent_by_path()
+        outputs
+            - (edge_plan, node_plan)/None
+                - edge_plan: a list of (edge_id, T_zone_occ), one for each distinct edge
+                             (an edge passed several times occupies the time zone covering all the passes)
+                - node_plan: a list of (node_id, T_zone)
+              "None" means the path is invalid
+        """
+        # Check if this is a valid path (it's indeed a path for that edges exist between each node-pair)
+        path_edge = self._get_edge_list_from_path(path)
+        if path_edge is None:
+            # Invalid path
+            return None
+        if (not wait_list is None) and len(wait_list) != len(path):
+            logger.error('The length of wait_list (%d) is not the same as the path (%d).', len(wait_list), len(path))
+            return None
+        edge_plan = []
+        edge_plan_idx_dict = dict() # {edge_id:idx in edge_plan, ...}
+        node_plan = []
+        T_zone_tmp = T_zone_start
+        for idx, edge_id in enumerate(path_edge):
+            # Wait at the node
+            wait = 0 if wait_list is None else wait_list[idx]
+            node_plan.append( (path[idx], (T_zone_tmp[0], T_zone_tmp[1] + wait)) )
+            if wait != 0:
+                T_zone_tmp = (T_zone_tmp[0] + wait, T_zone_tmp[1] + wait)
+            T_zone_occ = self.edge_list[edge_id].get_T_zone_occ_from_start(T_zone_tmp)
+            T_zone_tmp = self.edge_list[edge_id].get_T_zone_end_from_start(T_zone_tmp)
+            if edge_id in edge_plan_idx_dict:
+                # A task is put into an edge only once
+                T_zone_prev = edge_plan[edge_plan_idx_dict[edge_id]][1]
+                T_zone_occ = (min(T_zone_prev[0], T_zone_occ[0]), max(T_zone_prev[1], T_zone_occ[1]))
+                edge_plan[edge_plan_idx_dict[edge_id]] = (edge_id, T_zone_occ)
+            else:
+                edge_plan_idx_dict[edge_id] = len(edge_plan)
+                edge_plan.append( (edge_id, T_zone_occ) )
+        node_plan.append( (path[-1], T_zone_tmp) )
+        return (edge_plan, node_plan)
+
+    def _validate_edge_plan(self, edge_plan, agent_id, task_id):
+        """
+        Check that all the reservations of an edge_plan (see _plan_agent_by_path()) can be written.
+        outputs
+            - True/False
+        """
+        for edge_id, T_zone_occ in edge_plan:
+            edge = self.edge_list[edge_id]
+            if (agent_id in edge.agent_dict) and (task_id in edge.agent_dict[agent_id].task_dict):
+                logger.info('The task <%s> of agent <%d> is already in the edge <%d>.', task_id, agent_id, edge_id)
+                return False
+            # The other tasks of the same agent do not take more capacity
+            if not edge.is_available_for_T_zone(T_zone_occ, False, agent_id):
+                logger.info('No room left for agent <%d> in the edge <%d> within T_zone=%s.', agent_id, edge_id, T_zone_occ)
+                return False
+        return True
+
+    def _add_agent_by_path(self, path, T_zone_start, agent_id, task_id, is_activated=True, wait_list=None):
         """
         Add an agent according to a list of node "path"
         with specified/non-specified task_id.
+        The booking is a transaction: all the edges are validated first,
+        then either all the reservations are written, or none (rolled back).
         inputs
             - path
             - T_zone_start = (T_min, T_max)
             - agent_id
             - task_id
             - is_activated
+            - wait_list (default: None): wait_list[k] is the time waited at path[k] before leaving it,
+                                         "None" means no waiting (e.g. the path from ge.whca_star())
         outputs
             - True/False
         """
-        # Check if this is a valid path (it's indeed a path for that edges exist between each node-pair)
-        path_edge = self._get_edge_list_from_path(path)
-        if path_edge is None:
+        plan = self._plan_agent_by_path(path, T_zone_start, wait_list)
+        if plan is None:
             # Invalid path
             return False
+        if not self._validate_edge_plan(plan[0], agent_id, task_id):
+            return False
+        return self._commit_plan(path, plan, agent_id, task_id, is_activated)
 
-        # Add to edges
-        T_zone_tmp = T_zone_start
-        T_zone_occ = T_zone_start
-        for edge_id in path_edge:
-            # Add agent
-            T_zone_occ = self.edge_list[edge_id].get_T_zone_occ_from_start(T_zone_tmp)
-            T_zone_tmp = self.edge_list[edge_id].get_T_zone_end_from_start(T_zone_tmp)
-            self.edge_list[edge_id].put_agent(agent_id, task_id, is_activated, T_zone_occ)
+    def _commit_plan(self, path, plan, agent_id, task_id, is_activated):
+        """
+        Write all the reservations of a validated plan (see _plan_agent_by_path()), or none of them.
+        outputs
+            - True/False
+        """
+        edge_plan, node_plan = plan
+        # Commit, the capacity was checked once for all the edges
+        for num_done, (edge_id, T_zone_occ) in enumerate(edge_plan):
+            if not self.edge_list[edge_id]._put_agent_unchecked(agent_id, task_id, is_activated, T_zone_occ):
+                # Roll back
+                logger.error('The booking of agent <%d> with task <%s> failed at edge <%d>, %d edges are rolled back.', agent_id, task_id, edge_id, num_done)
+                for edge_id_done, T_zone_done in edge_plan[:num_done]:
+                    self.edge_list[edge_id_done].remove_agent(agent_id, task_id)
+                return False
             # print('INFO: Add agent <%d> with task <%s> from edge <%d>.' % (agent_id, str(self.edge_list[edge_id].agent_dict[agent_id].task_id), self.edge_list[edge_id].edge_id))
             # Note that we have to print this after adding agent
+        if not self.reservation_table is None:
+            with self._cache_lock:
+                for node_id, T_zone in node_plan:
+                    self.reservation_table.reserve_node(node_id, T_zone, agent_id, task_id)
+                if not edge_plan:
+                    # No edge event for the nodes
+                    self.state_version += 1
+                    self._invalidate_path_cache(node_id=path[-1])
+        return True
 
-        # Add to nodes
-        # TODO: Add to nodes on path, too!
+    def _is_node_plan_free(self, node_plan, agent_id):
+        """
+        If the nodes of a plan (see _plan_agent_by_path()) are not reserved by other agents.
+        """
+        if self.reservation_table is None:
+            return True
+        for node_id, T_zone in node_plan:
+            if not self.reservation_table.is_node_free(node_id, T_zone, agent_id):
+                return False
+        return True
 
+    def is_path_available(self, path, T_zone_start, top_priority_for_activated_agent=False, agent_id=None):
+        """
+        Check if all the edges on the path are still possible to pass
+        when starting from start_id within T_zone_start,
+        and the nodes on the path are not reserved by other agents (if the node reservation is enabled).
+        inputs
+            - path
+            - T_zone_start = (T_min, T_max)
+            - top_priority_for_activated_agent
+            - agent_id (default: None): If agent_id is given, ignore this agent in the edges.
+        outputs
+            - True/False
+        """
+        path_edge = self._get_edge_list_from_path(path)
+        if path_edge is None:
+            # Invalid path
+            return False
+        T_zone_tmp = T_zone_start
+        table = self.reservation_table
+        if (not table is None) and (not table.is_node_free(path[0], T_zone_tmp, agent_id)):
+            return False
+        for idx, edge_id in enumerate(path_edge):
+            if not self.edge_list[edge_id].is_possible_to_pass(T_zone_tmp, top_priority_for_activated_agent, agent_id):
+                return False
+            T_zone_tmp = self.edge_list[edge_id].get_T_zone_end_from_start(T_zone_tmp)
+            if (not table is None) and (not table.is_node_free(path[idx+1], T_zone_tmp, agent_id)):
+                return False
         return True
     #---------------------------------------#
 
     # Traversal methods
     #---------------------------------------#
+    def set_search_engine(self, search_engine):
+        """
+        Select the search engine used by query_path_exist() and book_a_path().
+        inputs
+            - search_engine:
+                - ge.SEARCH_ENGINE_ASTAR (default): A* with static lower bounds to the target
+                - ge.SEARCH_ENGINE_HEAPQ: dijkstra with heapq
+                - ge.SEARCH_ENGINE_PRIORITY_QUEUE: the original implementation, for comparison
+        outputs
+            - True/False
+        """
+        if not search_engine in ge.SEARCH_ENGINE_DICT:
+            logger.error('Unknown search_engine <%s>. The search_engine is not changed.', search_engine)
+            return False
+        self.search_engine = search_engine
+        return True
+
+    def get_csr_graph(self, is_reversed=False):
+        """
+        Get the frozen CSR view (contiguous arrays) of adj_graph and the static edge properties.
+        The view is generated on demand and kept until the topology changes.
+        inputs
+            - is_reversed (default: False): If True, get the view with all the directed edges reversed
+        outputs
+            - csr.CSR_GRAPH
+        """
+        with self._cache_lock:
+            if not is_reversed in self._csr_graph_dict:
+                adj = self.adj_graph_reversed if is_reversed else self.adj_graph
+                self._csr_graph_dict[is_reversed] = csr.CSR_GRAPH.from_adj(adj, self.edge_list)
+                self._csr_graph_dict[is_reversed].is_reversed = is_reversed
+            return self._csr_graph_dict[is_reversed]
+
+    def set_using_csr(self, is_using_csr=True):
+        """
+        Decide if the search engines consume the CSR view instead of adj_graph.
+        """
+        self.is_using_csr = bool(is_using_csr)
+        return True
+
+    def get_lower_bound_to_node(self, node_id, is_backtrack=False):
+        """
+        Get the static (no capacity) shortest duration_max from every node to node_id,
+        or from node_id to every node if is_backtrack. The results are cached until the topology changes.
+        outputs
+            - a list of lower bounds indexed by node_id
+        """
+        key = (node_id, is_backtrack)
+        with self._cache_lock:
+            if key in self._lower_bound_dict:
+                lower_bound = self._lower_bound_dict.pop(key)
+            else:
+                if self.is_using_csr or ((not is_backtrack) in self._csr_graph_dict):
+                    # The existing CSR view gives the same bounds, e.g. the one of a loaded graph
+                    # reads the duration_max in place, without building every edge (see load())
+                    adj = self.get_csr_graph(is_reversed=(not is_backtrack))
+                else:
+                    adj = self.adj_graph if is_backtrack else self.adj_graph_reversed
+                lower_bound = ge.dijkstras_static(adj, self.edge_list, node_id)
+                while len(self._lower_bound_dict) >= max(self.lower_bound_cache_size, 1):
+                    self._lower_bound_dict.popitem(last=False)
+            # Mark as the most recently used
+            self._lower_bound_dict[key] = lower_bound
+            return lower_bound
+
+    def build_landmarks(self, num_landmarks=8, selection=lm.LANDMARK_SELECTION_FARTHEST, typecode='d', seed=None):
+        """
+        Build the ALT landmark table, after which A* uses the landmark bounds
+        instead of a static backward search for each target.
+        The table is repaired incrementally when nodes or edges are added.
+        inputs
+            - num_landmarks     (default: 8)
+            - selection         (default: lm.LANDMARK_SELECTION_FARTHEST), or lm.LANDMARK_SELECTION_AVOID
+            - typecode          (default: 'd'): 'd' for 8 bytes or 'f' for 4 bytes per node per landmark per direction
+            - seed              (default: None)
+        outputs
+            - True/False
+        """
+        landmark_table = lm.LANDMARK_TABLE(num_landmarks, selection, typecode, seed)
+        if not landmark_table.build(self.adj_graph, self.edge_list, self.adj_graph_reversed):
+            return False
+        self.landmark_table = landmark_table
+        # The ties of A* may be broken differently
+        self.clear_path_cache()
+        return True
+
+    def remove_landmarks(self):
+        """
+        Drop the landmark table, A* goes back to the static backward search for each target.
+        """
+        self.landmark_table = None
+        self.clear_path_cache()
+        return True
+
+    def _get_heuristic(self, target_id, is_backtrack=False):
+        """
+        The lower bounds for A* toward target_id (or from target_id if is_backtrack).
+        """
+        if not self.landmark_table is None:
+            return self.landmark_table.get_heuristic(target_id, is_backtrack)
+        return self.get_lower_bound_to_node(target_id, is_backtrack)
+
+    def _search_path(self, T_zone_start, start_id, end_id, top_priority_for_activated_agent=False, agent_id=None, is_backtrack=False):
+        """
+        Find the path with the selected search engine.
+        inputs
+            - T_zone_start: the time zone at start_id, or at end_id if is_backtrack
+        """
+        key = (self.search_engine, tuple(T_zone_start), start_id, end_id, top_priority_for_activated_agent, agent_id, is_backtrack)
+        with self._cache_lock:
+            if key in self._path_cache:
+                # Mark as the most recently used
+                entry = self._path_cache.pop(key)
+                self._path_cache[key] = entry
+                self.path_cache_num_hits += 1
+                return (None if entry[0] is None else list(entry[0]))
+            self.path_cache_num_misses += 1
+            state_version = self.state_version
+        search_func = ge.SEARCH_ENGINE_DICT[self.search_engine][1 if is_backtrack else 0]
+        if self.is_using_csr:
+            adj, adj_reversed = self.get_csr_graph(), self.get_csr_graph(is_reversed=True)
+        else:
+            adj, adj_reversed = self.adj_graph, self.adj_graph_reversed
+        table = self.reservation_table
+        # The edges that the result depends on, "None" means all (not traced by the engine)
+        touched_edge_set = None if self.search_engine == ge.SEARCH_ENGINE_PRIORITY_QUEUE else set()
+        if self.search_engine == ge.SEARCH_ENGINE_ASTAR:
+            heuristic = self._get_heuristic((start_id if is_backtrack else end_id), is_backtrack)
+            path = search_func(adj, self.edge_list, T_zone_start, start_id, end_id, top_priority_for_activated_agent, agent_id, heuristic, adj_reversed, reservation_table=table, touched_edge_set=touched_edge_set)
+        elif self.search_engine == ge.SEARCH_ENGINE_HEAPQ:
+            if is_backtrack:
+                path = search_func(adj, self.edge_list, T_zone_start, start_id, end_id, top_priority_for_activated_agent, agent_id, adj_reversed, reservation_table=table, touched_edge_set=touched_edge_set)
+            else:
+                path = search_func(adj, self.edge_list, T_zone_start, start_id, end_id, top_priority_for_activated_agent, agent_id, reservation_table=table, touched_edge_set=touched_edge_set)
+        elif is_backtrack:
+            path = search_func(adj, self.edge_list, T_zone_start, start_id, end_id, top_priority_for_activated_agent, agent_id, adj_reversed, reservation_table=table)
+        else:
+            path = search_func(adj, self.edge_list, T_zone_start, start_id, end_id, top_priority_for_activated_agent, agent_id, reservation_table=table)
+        with self._cache_lock:
+            # Not cached if the states were written during the search (see book_a_path_concurrent())
+            if self.state_version == state_version:
+                self._put_path_cache(key, (None if path is None else list(path)), touched_edge_set)
+        return path
+
+    def track_connectivity(self, T_zone, only_count_activated_agent=False):
+        """
+        Start maintaining the connectivity of the time window T_zone, which is
+        updated incrementally when the availability of edges flips, so that
+        is_reachable() and number_of_connected_components() become look-ups.
+        outputs
+            - cn.CONNECTIVITY_TRACKER
+        """
+        key = (tuple(T_zone), only_count_activated_agent)
+        if not key in self.connectivity_tracker_dict:
+            tracker = cn.CONNECTIVITY_TRACKER(T_zone, only_count_activated_agent)
+            tracker.build(self.adj_graph, self.edge_list, self._get_edge_mask(T_zone, only_count_activated_agent), self.adj_graph_reversed)
+            self.connectivity_tracker_dict[key] = tracker
+        return self.connectivity_tracker_dict[key]
+
+    def untrack_connectivity(self, T_zone, only_count_activated_agent=False):
+        """
+        Stop maintaining the connectivity of the time window T_zone.
+        outputs
+            - True/False
+        """
+        key = (tuple(T_zone), only_count_activated_agent)
+        if key in self.connectivity_tracker_dict:
+            del self.connectivity_tracker_dict[key]
+            return True
+        return False
+
+    def is_reachable(self, x, y, T_zone=(0,None), only_count_activated_agent=False):
+        """
+        If node_id:y is reachable from node_id:x through the edges available in T_zone.
+        The tracked connectivity is used if T_zone is tracked (see track_connectivity()).
+        outputs
+            - True/False
+        """
+        key = (tuple(T_zone), only_count_activated_agent)
+        if key in self.connectivity_tracker_dict:
+            return self.connectivity_tracker_dict[key].is_reachable(x, y)
+        return ge.reachability(x, y, self.adj_graph, self.edge_list, True, T_zone, only_count_activated_agent, self._get_edge_mask(T_zone, only_count_activated_agent))
+
+    def number_of_connected_components(self, T_zone=(0,None), only_count_activated_agent=False):
+        """
+        The number of (weakly) connected components through the edges available in T_zone.
+        The tracked connectivity is used if T_zone is tracked (see track_connectivity()).
+        """
+        key = (tuple(T_zone), only_count_activated_agent)
+        if key in self.connectivity_tracker_dict:
+            return self.connectivity_tracker_dict[key].number_of_connected_components()
+        return ge.number_of_connected_components(self.adj_graph, self.edge_list, True, T_zone, only_count_activated_agent, self._get_edge_mask(T_zone, only_count_activated_agent))
+
+    def set_columnar_store(self, is_enabled=True):
+        """
+        Enable/disable the columnar copy of the tasks of all the edges (cl.RESERVATION_COLUMNS),
+        with which the availability of all the edges in a time window is evaluated at once,
+        e.g. by is_reachable(), number_of_connected_components() and get_edge_availability_mask().
+        outputs
+            - True/False
+        """
+        if not is_enabled:
+            self.reservation_columns = None
+            return True
+        columns = cl.RESERVATION_COLUMNS()
+        columns.build(self.edge_list)
+        self.reservation_columns = columns
+        logger.info('The columnar store is enabled with %d tasks (numpy: %s).', len(columns), (not cl.np is None))
+        return True
+
+    def _get_edge_mask(self, T_zone, only_count_activated_agent=False):
+        """
+        The availability mask from the columnar store, "None" if the store is not enabled.
+        """
+        if self.reservation_columns is None:
+            return None
+        return self.reservation_columns.get_availability_mask(T_zone, only_count_activated_agent)
+
+    def get_edge_remained_capacity(self, T_zone, only_count_activated_agent=False, agent_id=None):
+        """
+        The remained capacity of all the edges within T_zone, indexed by edge_id.
+        outputs
+            - a numpy array (with the columnar store and numpy) or a list
+        """
+        if self.reservation_columns is None:
+            return [edge.get_remained_capacity_for_T_zone(T_zone, only_count_activated_agent, agent_id) for edge in self.edge_list]
+        return self.reservation_columns.get_remained_capacity_vector(T_zone, only_count_activated_agent, agent_id)
+
+    def get_edge_availability_mask(self, T_zone, only_count_activated_agent=False, agent_id=None):
+        """
+        If each edge is available within T_zone, indexed by edge_id,
+        which can be passed to ge.reachability() and ge.number_of_connected_components() as edge_mask.
+        outputs
+            - a numpy array (with the columnar store and numpy) or a list
+        """
+        if self.reservation_columns is None:
+            return [edge.is_available_for_T_zone(T_zone, only_count_activated_agent, agent_id) for edge in self.edge_list]
+        return self.reservation_columns.get_availability_mask(T_zone, only_count_activated_agent, agent_id)
+
     def query_path_exist(self, T_zone_start, start_id, end_id, top_priority_for_activated_agent=False):
         """
         This method ues dijkstra alogorithm to find out the best path
@@ -346,8 +1096,8 @@ class GEOMETRY_TASK_GRAPH(object):
         outputs
             - True/False
         """
-        # TODO: Decide if also need to check the nodes on path??
-        return ( not (ge.dijkstras(self.adj_graph, self.edge_list, T_zone_start, start_id, end_id, top_priority_for_activated_agent) is None) )
+        # Note: The nodes reserved by any agent are avoided if the node reservation is enabled.
+        return ( not (self._search_path(T_zone_start, start_id, end_id, top_priority_for_activated_agent) is None) )
 
     def book_a_path(self, T_zone_start, start_id, end_id, agent_id, task_id):
         """
@@ -366,19 +1116,391 @@ class GEOMETRY_TASK_GRAPH(object):
             - list of (node_id, agent_list) that obstruct the path (may be some agents idle/stop/waiting at those places)
             - T_zone_total: Total occupation time (stamp) for this path, from start to end
         """
+        if (not self.reservation_table is None) and (not self.reservation_table.is_node_free(start_id, T_zone_start, agent_id)):
+            # The start node is reserved by other agents
+            logger.info('The start_id <%d> is reserved by agents %s within T_zone=%s.', start_id, self.reservation_table.get_agent_list((rs.RESOURCE_NODE, start_id), T_zone_start, agent_id), T_zone_start)
+            return None
         # Note that top_priority_for_activated_agent is set to False
-        path = ge.dijkstras(self.adj_graph, self.edge_list, T_zone_start, start_id, end_id, False)
+        # The nodes reserved by "other" agents are avoided by the search (if the node reservation is enabled)
+        path = self._search_path(T_zone_start, start_id, end_id, False, agent_id)
         if path is None:
             # Non-reachable
             return None
-        # TODO: Check if any node on the path is occupied by "other" agents!! (maybe it's no need to check the start node?)
         # TODO: return the path, list of (node_id, agent_list) pairs for post process, T_zone_total with "None"
-        # TODO: If there were any node occupied, don't book the path!
 
         # Else
         # Note that the activation of the agent is set to False
-        self._add_agent_by_path(path, T_zone_start, agent_id, task_id, False)
+        if not self._add_agent_by_path(path, T_zone_start, agent_id, task_id, False):
+            # Nothing is booked
+            return None
         # TODO: retrun a variable indicating that there is no node being occupied by agent.
         # TODO: return T_zone_total
         return path
+
+    def book_a_path_concurrent(self, T_zone_start, start_id, end_id, agent_id, task_id, max_num_retries=8):
+        """
+        The thread-safe book_a_path(), for serving the requests from several threads.
+            1. Search under the shared lock (in parallel with other searches and commits).
+            2. Lock the edges (and the nodes, if reserved) on the path, in the sorted order.
+            3. Validate the path under the shared lock, and note the versions of the edges,
+               a path invalidated since the search is searched again (optimistic retry).
+            4. Commit under the locks of step 2 only, where only the edges whose versions changed are validated again,
+               so the bookings on disjoint paths commit in parallel. The caches and the indexes of the graph are
+               updated in a short critical section (see _on_edge_state_changed()).
+        Note: Removing agents (e.g. remove_agent_concurrent()) only frees capacity, which never invalidates a path.
+        inputs
+            - T_zone_start, start_id, end_id, agent_id, task_id: see book_a_path()
+            - max_num_retries (default: 8)
+        outputs
+            - path/None
+        """
+        for num_tries in range(max_num_retries + 1):
+            # Search against the current states
+            with self.rw_lock.read_locked():
+                if (not self.reservation_table is None) and (not self.reservation_table.is_node_free(start_id, T_zone_start, agent_id)):
+                    return None
+                path = self._search_path(T_zone_start, start_id, end_id, False, agent_id)
+                if path is None:
+                    return None
+                plan = self._plan_agent_by_path(path, T_zone_start)
+                if plan is None:
+                    return None
+            resource_list = [('edge', edge_id) for edge_id, T_zone_occ in plan[0]]
+            if not self.reservation_table is None:
+                resource_list += [('node', node_id) for node_id, T_zone in plan[1]]
+            with self.resource_lock_set.locked(resource_list):
+                # Validate in parallel with other searches/validations
+                with self.rw_lock.read_locked():
+                    is_valid = self._validate_edge_plan(plan[0], agent_id, task_id) and self._is_node_plan_free(plan[1], agent_id)
+                    version_list = [self.edge_list[edge_id].version for edge_id, T_zone_occ in plan[0]]
+                if not is_valid:
+                    logger.info('The path of agent <%d> with task <%s> was invalidated before the commit, retry (%d).', agent_id, task_id, num_tries)
+                    continue
+                # Only the writers bypassing resource_lock_set (e.g. book_paths()) can change the edges here
+                if self._validate_plan_since(plan, version_list, agent_id, task_id) and self._commit_plan(path, plan, agent_id, task_id, False):
+                    return path
+        logger.warning('The booking of agent <%d> with task <%s> gave up after %d retries.', agent_id, task_id, max_num_retries)
+        return None
+
+    def _validate_plan_since(self, plan, version_list, agent_id, task_id):
+        """
+        Validate a plan (see _plan_agent_by_path()) again, where the edges whose versions
+        are still the same as version_list are not checked again.
+        outputs
+            - True/False
+        """
+        edge_plan, node_plan = plan
+        changed_edge_plan = [(edge_id, T_zone_occ) for (edge_id, T_zone_occ), version in zip(edge_plan, version_list) if self.edge_list[edge_id].version != version]
+        if changed_edge_plan and not self._validate_edge_plan(changed_edge_plan, agent_id, task_id):
+            return False
+        # The nodes have no versions
+        return self._is_node_plan_free(node_plan, agent_id)
+
+    def remove_agent_concurrent(self, agent_id, task_id=None):
+        """
+        The thread-safe removal of an agent (with specified/non-specified task_id) from all the edges and the nodes.
+        The edges where it is booked are locked as in book_a_path_concurrent(), and the searches wait for the removal.
+        """
+        with self._cache_lock:
+            edge_id_list = self._get_agent_edge_id_list(agent_id, task_id)
+        with self.resource_lock_set.locked([('edge', edge_id) for edge_id in edge_id_list]):
+            with self.rw_lock.write_locked():
+                for edge_id in edge_id_list:
+                    self.edge_list[edge_id].remove_agent(agent_id, task_id)
+                with self._cache_lock:
+                    self._remove_agent_from_all_nodes(agent_id, task_id)
+        return True
+
+    def add_pending_request(self, T_zone_start, start_id, end_id, agent_id, task_id):
+        """
+        Keep a request (e.g. the one that got "None" from book_a_path()) waiting for a path.
+        Its search states are kept and repaired incrementally when the states of the edges change,
+        see get_pending_path() and book_pending_requests().
+        inputs
+            - T_zone_start = (T_min, T_max)
+            - start_id
+            - end_id
+            - agent_id
+            - task_id
+        outputs
+            - pending_id/None
+        """
+        if not (0 <= start_id < self.num_nodes and 0 <= end_id < self.num_nodes):
+            logger.error('At least one of the node id (%d, %d) does not exist.', start_id, end_id)
+            return None
+        search = ge.INCREMENTAL_SEARCH(self.adj_graph, self.adj_graph_reversed, self.edge_list, T_zone_start, start_id, end_id,
+                                       False, agent_id, self._get_heuristic(end_id), self.reservation_table)
+        pending_id = self._pending_id
+        self._pending_id += 1
+        self.pending_request_dict[pending_id] = ((T_zone_start, start_id, end_id, agent_id, task_id), search)
+        self.add_state_listener(search.on_edge_state_changed)
+        return pending_id
+
+    def remove_pending_request(self, pending_id):
+        """
+        Stop waiting for a path.
+        outputs
+            - True/False
+        """
+        if not pending_id in self.pending_request_dict:
+            return False
+        request, search = self.pending_request_dict.pop(pending_id)
+        self.remove_state_listener(search.on_edge_state_changed)
+        return True
+
+    def get_pending_path(self, pending_id):
+        """
+        The current best path of a pending request, repaired from its last search.
+        outputs
+            - path/None
+        """
+        if not pending_id in self.pending_request_dict:
+            logger.error('The pending request <%s> does not exist.', pending_id)
+            return None
+        request, search = self.pending_request_dict[pending_id]
+        if search.is_invalidated:
+            # The topology changed
+            search.reset(self._get_heuristic(request[2]))
+        return search.get_path()
+
+    def book_pending_requests(self):
+        """
+        Book the pending requests that have a path now, in the order they were added.
+        The booked ones are no longer pending.
+        outputs
+            - booked_dict: {pending_id:path, ...}
+        """
+        booked_dict = dict()
+        for pending_id in sorted(self.pending_request_dict):
+            path = self.get_pending_path(pending_id)
+            if path is None:
+                continue
+            T_zone_start, start_id, end_id, agent_id, task_id = self.pending_request_dict[pending_id][0]
+            if (not self.reservation_table is None) and (not self.reservation_table.is_node_free(start_id, T_zone_start, agent_id)):
+                # The start node is reserved by other agents
+                continue
+            # Note that the activation of the agent is set to False
+            if self._add_agent_by_path(path, T_zone_start, agent_id, task_id, False):
+                self.remove_pending_request(pending_id)
+                booked_dict[pending_id] = path
+        logger.info('%d of %d pending requests are booked.', len(booked_dict), len(booked_dict) + len(self.pending_request_dict))
+        return booked_dict
+
+    def query_single_source(self, T_zone_start, start_id, top_priority_for_activated_agent=False, agent_id=None):
+        """
+        Search from start_id to all the nodes at once.
+        inputs
+            - T_zone_start = (T_min, T_max)
+            - start_id
+            - top_priority_for_activated_agent
+            - agent_id (default: None): If agent_id is given, ignore this agent in the edges.
+        outputs
+            - ge.SEARCH_RESULT: use get_path(end_id), get_distance(end_id) and get_T_zone(end_id) for each end_id
+        """
+        adj = self.get_csr_graph() if self.is_using_csr else self.adj_graph
+        return ge.dijkstras_single_source(adj, self.edge_list, T_zone_start, start_id, top_priority_for_activated_agent, agent_id, self.reservation_table)
+
+    def query_distance_matrix(self, source_list, target_list, top_priority_for_activated_agent=False, num_workers=None):
+        """
+        Build the table of the total duration_max (and the T_zone at arrival) between many sources and targets,
+        with one single-source search per source.
+        inputs
+            - source_list: a list of (T_zone_start, start_id), e.g. robots
+            - target_list: a list of node_id, e.g. stations
+            - top_priority_for_activated_agent
+            - num_workers (default: None): If larger than 1, the searches run on a pool of processes
+        outputs
+            - dist_matrix: dist_matrix[i][j] from source i to target j, float('inf') means not reachable
+            - T_zone_matrix: T_zone_matrix[i][j] at target j from source i, "None" means not reachable
+        """
+        adj = self.get_csr_graph() if self.is_using_csr else self.adj_graph
+        return ge.distance_matrix(adj, self.edge_list, source_list, target_list, top_priority_for_activated_agent, None, num_workers)
+
+    def _get_request_order(self, request_list):
+        """
+        Validate the requests of book_paths*() and sort them by priority.
+        outputs
+            - order_list: a list of (priority, idx) of the valid requests, in the order of booking
+        """
+        order_list = []
+        for idx, request in enumerate(request_list):
+            if not len(request) in (5, 6):
+                logger.error('The request #%d should be (T_zone_start, start_id, end_id, agent_id, task_id[, priority]).', idx)
+                continue
+            start_id, end_id = request[1], request[2]
+            if not (0 <= start_id < self.num_nodes and 0 <= end_id < self.num_nodes):
+                logger.error('At least one of the node id (%d, %d) of the request #%d does not exist.', start_id, end_id, idx)
+                continue
+            priority = request[5] if len(request) == 6 else 0
+            order_list.append( (priority, idx) )
+        order_list.sort()
+        return order_list
+
+    def book_paths(self, request_list):
+        """
+        Book paths for many requests at once.
+        The requests with the same (start_id, T_zone_start) share one one-to-many search,
+        and the reservations are committed in a deterministic priority order.
+        A shared search is re-run only when it was done before some commits
+        and the path it gives for a request is no longer available (or not found).
+
+        inputs
+            - request_list: a list of (T_zone_start, start_id, end_id, agent_id, task_id)
+                            or (T_zone_start, start_id, end_id, agent_id, task_id, priority),
+                            smaller priority is booked first (default: 0), ties are kept in the given order
+
+        outputs
+            - result_list: one dict per request, in the same order as request_list
+                - 'path': a sequence (list) of node_id from start_id to end_id, or "None"
+                - 'is_booked': True/False
+                - 'reason': "None" if booked, otherwise one of
+                    - 'invalid_request': malformed request or non-existing node
+                    - 'no_path': end_id is not reachable in the sense of "valid" edge traversal
+                    - 'booking_failed': the reservation could not be committed
+        """
+        result_list = [{'path':None, 'is_booked':False, 'reason':'invalid_request'} for _ in request_list]
+        # Decide the priority order
+        order_list = self._get_request_order(request_list)
+
+        # Shared one-to-many searches, {(start_id, T_zone_start):(num_commit, ge.SEARCH_RESULT()), ...}
+        # Note: With the node reservation, the agent_id is also in the key, since its own reservations are ignored.
+        search_dict = dict()
+        num_commit = 0 # The number of commits so far, for knowing if a search is out-dated
+        adj = self.get_csr_graph() if self.is_using_csr else self.adj_graph
+        for priority, idx in order_list:
+            T_zone_start, start_id, end_id, agent_id, task_id = request_list[idx][:5]
+            search_agent_id = None if self.reservation_table is None else agent_id
+            key = (start_id, tuple(T_zone_start)) if self.reservation_table is None else (start_id, tuple(T_zone_start), agent_id)
+            if not key in search_dict:
+                search_dict[key] = (num_commit, ge.dijkstras_single_source(adj, self.edge_list, T_zone_start, start_id, False, search_agent_id, self.reservation_table))
+            path = search_dict[key][1].get_path(end_id)
+            if (not path is None) and (not self.reservation_table is None) and (not self.reservation_table.is_node_free(start_id, T_zone_start, agent_id)):
+                # The start node is reserved by other agents
+                path = None
+            if search_dict[key][0] != num_commit and ((path is None) or (not self.is_path_available(path, T_zone_start, False, search_agent_id))):
+                # The search was out-dated by the previous commits, search again
+                search_dict[key] = (num_commit, ge.dijkstras_single_source(adj, self.edge_list, T_zone_start, start_id, False, search_agent_id, self.reservation_table))
+                path = search_dict[key][1].get_path(end_id)
+            #
+            if path is None:
+                result_list[idx]['reason'] = 'no_path'
+                continue
+            result_list[idx]['path'] = path
+            # Note that the activation of the agent is set to False
+            num_commit += 1
+            if self._add_agent_by_path(path, T_zone_start, agent_id, task_id, False):
+                result_list[idx]['is_booked'] = True
+                result_list[idx]['reason'] = None
+            else:
+                result_list[idx]['reason'] = 'booking_failed'
+        logger.info('%d of %d requests are booked.', sum(1 for result in result_list if result['is_booked']), len(request_list))
+        return result_list
+
+    def book_paths_prioritized(self, request_list, window=10, wait_step=1, max_num_windows=32, max_num_expansions=None):
+        """
+        Plan and book paths for many agents one by one in priority order with ge.whca_star(),
+        i.e. searching in (node, time) space with wait moves, where each agent respects
+        the reservations of the agents booked before.
+        Enable the node reservation (see set_node_reservation()) to avoid the agents meeting at the nodes.
+
+        inputs
+            - request_list: a list of (T_zone_start, start_id, end_id, agent_id, task_id)
+                            or (T_zone_start, start_id, end_id, agent_id, task_id, priority),
+                            smaller priority is booked first (default: 0), ties are kept in the given order
+            - window, wait_step, max_num_windows, max_num_expansions: see ge.whca_star()
+
+        outputs
+            - result_list: one dict per request, in the same order as request_list
+                - 'path': a sequence (list) of node_id from start_id to end_id, or "None"
+                - 'wait_list': wait_list[k] is the time waited at path[k] before leaving it, or "None"
+                - 'is_booked': True/False
+                - 'reason': the same as book_paths()
+        """
+        result_list = [{'path':None, 'wait_list':None, 'is_booked':False, 'reason':'invalid_request'} for _ in request_list]
+        # Decide the priority order
+        order_list = self._get_request_order(request_list)
+
+        adj = self.get_csr_graph() if self.is_using_csr else self.adj_graph
+        table = self.reservation_table
+        for priority, idx in order_list:
+            T_zone_start, start_id, end_id, agent_id, task_id = request_list[idx][:5]
+            if (not table is None) and (not table.is_node_free(start_id, T_zone_start, agent_id)):
+                # The start node is reserved by other agents
+                result_list[idx]['reason'] = 'no_path'
+                continue
+            result = ge.whca_star(adj, self.edge_list, T_zone_start, start_id, end_id, False, agent_id, self._get_heuristic(end_id), None, table,
+                                  window, wait_step, max_num_windows, max_num_expansions)
+            if result is None:
+                result_list[idx]['reason'] = 'no_path'
+                continue
+            path, wait_list = result
+            result_list[idx]['path'] = path
+            result_list[idx]['wait_list'] = wait_list
+            # Note that the activation of the agent is set to False
+            if self._add_agent_by_path(path, T_zone_start, agent_id, task_id, False, wait_list):
+                result_list[idx]['is_booked'] = True
+                result_list[idx]['reason'] = None
+            else:
+                result_list[idx]['reason'] = 'booking_failed'
+        logger.info('%d of %d requests are booked.', sum(1 for result in result_list if result['is_booked']), len(request_list))
+        return result_list
+
+    def book_paths_cbs(self, request_list, suboptimality=1.0, horizon=100, wait_step=1, max_num_expansions=1000, max_num_low_level_expansions=None, num_workers=None):
+        """
+        Plan the paths of many agents together with conflict-based search (see cbs.CBS_SOLVER),
+        then book them. Agents meeting at the nodes are conflicts only if the node reservation is enabled.
+        If the budget of expansions is exceeded (or no solution is found), the agents without conflicts
+        in the best plan are booked, and the others are booked by book_paths_prioritized().
+
+        inputs
+            - request_list: the same as book_paths_prioritized(),
+                            the priority is only used by the fallback
+            - suboptimality, horizon, wait_step, max_num_expansions, max_num_low_level_expansions, num_workers: see cbs.CBS_SOLVER
+
+        outputs
+            - result_list: the same as book_paths_prioritized()
+        """
+        result_list = [{'path':None, 'wait_list':None, 'is_booked':False, 'reason':'invalid_request'} for _ in request_list]
+        order_list = self._get_request_order(request_list)
+        request_dict = dict()
+        for priority, idx in order_list:
+            T_zone_start, start_id, end_id, agent_id, task_id = request_list[idx][:5]
+            if (not self.reservation_table is None) and (not self.reservation_table.is_node_free(start_id, T_zone_start, agent_id)):
+                # The start node is reserved by other agents
+                result_list[idx]['reason'] = 'no_path'
+                continue
+            request_dict[idx] = (T_zone_start, start_id, end_id, agent_id)
+
+        solver = cbs.CBS_SOLVER(self, suboptimality, horizon, wait_step, max_num_expansions, max_num_low_level_expansions, num_workers)
+        status, solution_dict, conflict_list = solver.solve(request_dict)
+        conflict_idx_set = set()
+        for conflict in conflict_list:
+            conflict_idx_set.update(conflict[3])
+        # Book the conflict-free ones
+        for priority, idx in order_list:
+            if not idx in request_dict:
+                continue
+            if not idx in solution_dict:
+                result_list[idx]['reason'] = 'no_path'
+                continue
+            if idx in conflict_idx_set:
+                continue
+            path, wait_list, cost = solution_dict[idx]
+            result_list[idx]['path'] = path
+            result_list[idx]['wait_list'] = wait_list
+            # Note that the activation of the agent is set to False
+            if self._add_agent_by_path(path, request_list[idx][0], request_list[idx][3], request_list[idx][4], False, wait_list):
+                result_list[idx]['is_booked'] = True
+                result_list[idx]['reason'] = None
+            else:
+                result_list[idx]['reason'] = 'booking_failed'
+        # Fall back to the prioritized booking
+        fallback_idx_list = sorted(idx for idx in conflict_idx_set if idx in solution_dict)
+        if fallback_idx_list:
+            logger.info('CBS status: %s, %d requests fall back to the prioritized booking.', status, len(fallback_idx_list))
+            fallback_result_list = self.book_paths_prioritized([request_list[idx] for idx in fallback_idx_list], horizon, wait_step, 1, max_num_low_level_expansions)
+            for idx, result in zip(fallback_idx_list, fallback_result_list):
+                result_list[idx] = result
+        logger.info('%d of %d requests are booked.', sum(1 for result in result_list if result['is_booked']), len(request_list))
+        return result_list
     #---------------------------------------#
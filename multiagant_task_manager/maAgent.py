@@ -1,6 +1,40 @@
+import maLogging as lg
+
+logger = lg.get_logger(__name__)
+
+# The infinity shared by all the T_zone ('None' means infinity),
+# so that no float object is allocated for each eternal task
+INF = float('inf')
+
 # TODO: Add a data structure for tasks
 # TODO: Add data structure (dictionary - container_name:task_id) and operation method for agent
 
+def normalize_T_zone(T_zone, task_id=None):
+    """
+    The T_zone of a task as stored in the interval index of EDGE.
+    inputs
+        - T_zone = (min_pass_stamp, max_pass_stamp)
+            - min_pass_stamp    (type: int)
+            - max_pass_stamp    (None means infinity or eternal)
+        - task_id (default: None): for the warning only
+    outputs
+        - (T_min, T_max)
+    """
+    min_pass_stamp, max_pass_stamp = T_zone
+    T_min = int(min_pass_stamp)
+    if max_pass_stamp is None:
+        T_max = INF # 'None' means infinity (no maximum)
+    else:
+        max_pass_stamp = int(max_pass_stamp)
+        # If the max_pass_stamp is smaller than the min_pass_stamp
+        # give warning and set the max_pass_stamp equals to min_pass_stamp
+        if max_pass_stamp < T_min:
+            T_max = T_min
+            logger.warning('The max_pass_stamp is smaller than min_pass_stamp at task <%s>', task_id)
+        else:
+            T_max = max_pass_stamp
+    return (T_min, T_max)
+
 # The structure for task (in AGENT)
 class TASK(object):
     """
@@ -9,8 +43,13 @@ class TASK(object):
                     (there is no connection about this parameter and estimated pass time)
     - T_zone = (min_pass_stamp, max_pass_stamp)
         - min_pass_stamp (int): estimated earliest time (unix stamp) for passing the edge
-        - max_pass_stamp (int): estimated latest time (unix stamp) for passing the edge
+        - max_pass_stamp (int): estimated latest time (unix stamp) for passing the edge, INF means eternal
+
+    Note: A TASK is created for every reservation on every edge, so no per-instance __dict__ is kept,
+          and the T_zone is normalized (see normalize_T_zone()) into ints and the shared INF.
     """
+    __slots__ = ('task_id', 'is_activated', 'T_zone')
+
     def __init__(self, task_id, is_activated=False, T_zone=(0,None)):
         """
         * task_id
@@ -24,21 +63,7 @@ class TASK(object):
         # The states
         self.is_activated = bool(is_activated)
         #
-        min_pass_stamp, max_pass_stamp = T_zone
-        T_min = int(min_pass_stamp)
-        if max_pass_stamp is None:
-            T_max = float('inf') # 'None' means infinity (no maximum)
-        else:
-            max_pass_stamp = int(max_pass_stamp)
-            # If the max_pass_stamp is smaller than the min_pass_stamp
-            # give warning and set the max_pass_stamp equals to min_pass_stamp
-            if max_pass_stamp < T_min:
-                T_max = T_min
-                print('WARN: The max_pass_stamp is smaller than min_pass_stamp at agent <%d>' % self.agent_id)
-            else:
-                T_max = max_pass_stamp
-            # T_max = (max_pass_stamp if max_pass_stamp >= min_pass_stamp else min_pass_stamp)
-        self.T_zone = (T_min, T_max)
+        self.T_zone = normalize_T_zone(T_zone, task_id)
 
     def __str__(self):
         ret = "<{ACTI}T#{TID}, Tz({TMIN},{TMAX})>".format(TID=(self.task_id if not self.task_id is None else "--"), ACTI=("+" if self.is_activated else "-" ), TMIN=self.T_zone[0], TMAX=self.T_zone[1] )
@@ -61,7 +86,7 @@ class TASK(object):
             # 'None' means infinity
             return (T_zone[0] <= self.T_zone[1])
         if T_zone[1] < T_zone[0]:
-            print('WARN: the max_pass_stamp is smaller than min_pass_stamp in T_zone.')
+            logger.warning('The max_pass_stamp is smaller than min_pass_stamp in T_zone.')
         return (T_zone[1] >= self.T_zone[0]) and (T_zone[0] <= self.T_zone[1])
 
 
@@ -73,7 +98,11 @@ class AGENT(object):
     - task_dict: contains all the tasks this agent got
     - is_activated (bool): If this agent is "currently" working
                     (there is no connection about this parameter and estimated pass time)
+
+    Note: An AGENT is created for every agent on every edge, so no per-instance __dict__ is kept.
     """
+    __slots__ = ('agent_id', 'task_dict', 'num_activated_task', 'is_activated')
+
     def __init__(self, agent_id):
         """
         inputs (* denote the "must-have"(mandatory) )
@@ -114,12 +143,12 @@ class AGENT(object):
         Give a task to this agent.
         """
         if task_id is None:
-            print('ERROR: task_id cannot be "None".')
+            logger.error('task_id cannot be "None".')
             return False
 
         if task_id in self.task_dict:
             # The task already exist, overwrite it
-            print("WARN: The task <%s> already exists in this agent <%d>. Skip this requirement on put_task()." % (str(task_id), self.agent_id))
+            logger.warning("The task <%s> already exists in this agent <%d>. Skip this requirement on put_task().", task_id, self.agent_id)
             return False
         else:
             """
@@ -156,7 +185,7 @@ class AGENT(object):
             return True
         else:
             # Something wrong, agent was not in the dict
-            print('ERROR: The task <%s> is not in the task_dict at agent <%d>.' % (str(task_id), self.agent_id))
+            logger.error('The task <%s> is not in the task_dict at agent <%d>.', task_id, self.agent_id)
             return False
 
     def activate_task(self, task_id):
@@ -164,7 +193,7 @@ class AGENT(object):
         This method activates the specified task
         """
         if task_id is None:
-            print('ERROR: task_id cannot be "None".')
+            logger.error('task_id cannot be "None".')
             return False
         # Else, the task was specified
         if task_id in self.task_dict:
@@ -174,7 +203,7 @@ class AGENT(object):
             return True
         else:
             # Something wrong, agent was not in the dict
-            print('ERROR: The task <%s> is not in the task_dict at agent <%d>.' % (str(task_id), self.agent_id))
+            logger.error('The task <%s> is not in the task_dict at agent <%d>.', task_id, self.agent_id)
             return False
 
     def deactivate_task(self, task_id=None):
@@ -195,7 +224,7 @@ class AGENT(object):
             return True
         else:
             # Something wrong, agent was not in the dict
-            print('ERROR: The task <%s> is not in the task_dict at agent <%d>.' % (str(task_id), self.agent_id))
+            logger.error('The task <%s> is not in the task_dict at agent <%d>.', task_id, self.agent_id)
             return False
 
     def number_task(self, only_count_activated_task=False):
@@ -0,0 +1,304 @@
+"""
+Conflict-based search
+This module provides the CBS solver (and its focal-search variant) for planning
+many agents at once on GEOMETRY_TASK_GRAPH, for the hard cases where the prioritized
+booking (see GEOMETRY_TASK_GRAPH.book_paths_prioritized()) fails.
+
+The constraints are checked only by the low-level search of the constrained agent
+(see the constraint_dict of ge.whca_star()), the graph itself is never modified by the solver:
+    - an edge constraint closes the edge at a time stamp, or
+    - a node constraint closes the node at a time stamp (if the node reservation is enabled).
+The low-level search is ge.whca_star() with a single window of "horizon" duration (A* in
+(node, time) space with wait moves, where an edge may be passed again), and the low-level
+searches of the children of a constraint-tree node run on a process pool.
+"""
+import maGraphEngines as ge
+import maReservation as rs
+import maLogging as lg
+
+logger = lg.get_logger(__name__)
+
+
+# Status of CBS_SOLVER.solve()
+CBS_STATUS_SOLVED = 'solved'
+CBS_STATUS_NO_SOLUTION = 'no_solution'
+CBS_STATUS_BUDGET_EXCEEDED = 'budget_exceeded'
+
+
+# The low-level search
+#-------------------------------#
+# The graph shared with the worker processes, (adj, edges, reservation_table, heuristic_dict, search_param)
+_worker_graph = None
+
+def _init_low_level_worker(adj, edges, reservation_table, heuristic_dict, search_param):
+    global _worker_graph
+    _worker_graph = (adj, edges, reservation_table, heuristic_dict, search_param)
+
+def _low_level_search_in_worker(args):
+    request, constraint_list = args
+    adj, edges, reservation_table, heuristic_dict, search_param = _worker_graph
+    return _low_level_search(adj, edges, reservation_table, heuristic_dict[request[2]], request, constraint_list, search_param)
+
+def _get_constraint_dict(reservation_table, constraint_list):
+    """
+    The constraints in the form of the constraint_dict of ge.whca_star().
+    inputs
+        - constraint_list: a list of (kind, resource_id, T_zone), kind is rs.RESOURCE_EDGE or rs.RESOURCE_NODE
+    """
+    constraint_dict = dict()
+    for kind, resource_id, T_zone in constraint_list:
+        if kind == rs.RESOURCE_NODE and reservation_table is None:
+            # The nodes are not constrained without the node reservation
+            continue
+        constraint_dict.setdefault((kind, resource_id), []).append(T_zone)
+    return constraint_dict
+
+def _low_level_search(adj, edges, reservation_table, heuristic, request, constraint_list, search_param):
+    """
+    Plan a single agent under its constraints.
+    inputs
+        - request: (T_zone_start, start_id, end_id, agent_id)
+        - search_param: (horizon, wait_step, max_num_expansions)
+    outputs
+        - (path, wait_list, cost)/None: cost is the total duration_max plus the waits
+    """
+    T_zone_start, start_id, end_id, agent_id = request
+    horizon, wait_step, max_num_expansions = search_param
+    result = ge.whca_star(adj, edges, T_zone_start, start_id, end_id, False, agent_id, heuristic, None, reservation_table,
+                          horizon, wait_step, 1, max_num_expansions, _get_constraint_dict(reservation_table, constraint_list))
+    if result is None:
+        return None
+    path, wait_list = result
+    cost = sum(wait_list)
+    for nid_u, nid_v in zip(path[:-1], path[1:]):
+        cost += edges[_get_edge_id(adj, nid_u, nid_v)].duration[1]
+    return (path, wait_list, cost)
+
+def _get_edge_id(adj, from_node_id, to_node_id):
+    """
+    The edge between two nodes, the same as GEOMETRY_TASK_GRAPH._get_edge_list_from_path().
+    """
+    for nid, eid in adj[from_node_id]:
+        if nid == to_node_id:
+            return eid
+    return None
+#-------------------------------#
+
+
+# The constraint tree
+#-------------------------------#
+class CT_NODE(object):
+    """
+    A node of the constraint tree
+        - constraint_dict: {agent_key:[(kind, resource_id, T_zone), ...], ...}
+        - solution_dict: {agent_key:(path, wait_list, cost), ...}
+        - cost: the sum of the costs of all the agents
+        - conflict_list: see CBS_SOLVER.find_conflicts()
+    """
+    def __init__(self, constraint_dict, solution_dict):
+        self.constraint_dict = constraint_dict
+        self.solution_dict = solution_dict
+        self.cost = sum(solution[2] for solution in solution_dict.values())
+        self.conflict_list = []
+
+
+class CBS_SOLVER(object):
+    """
+    Conflict-based search over the current states of a GEOMETRY_TASK_GRAPH.
+    The agents already booked in the graph are obstacles, and the planned agents
+    are not booked by the solver (see GEOMETRY_TASK_GRAPH.book_paths_cbs()).
+
+    With suboptimality w > 1, the constraint-tree node with the fewest conflicts among
+    the ones whose cost is within w times the lowest is expanded (focal search),
+    which usually takes fewer expansions for a higher cost.
+    Note: The cost is not guaranteed to be optimal, since the low-level search keeps
+          one path per (node, time) state (see ge.whca_star()).
+    """
+    def __init__(self, graph, suboptimality=1.0, horizon=100, wait_step=1, max_num_expansions=1000, max_num_low_level_expansions=None, num_workers=None):
+        """
+        inputs
+            - graph: GEOMETRY_TASK_GRAPH
+            - suboptimality (default: 1.0): w >= 1.0, 1.0 means always expanding the lowest cost
+            - horizon (default: 100): the maximum cost (duration_max plus waits) of a single agent
+            - wait_step (default: 1): the duration of a wait move
+            - max_num_expansions (default: 1000): the budget of the constraint-tree nodes to be expanded
+            - max_num_low_level_expansions (default: None): the budget of each low-level search, "None" means no limit
+            - num_workers (default: None): If larger than 1, the low-level searches run on a pool of processes
+        """
+        self.graph = graph
+        self.suboptimality = max(1.0, suboptimality)
+        self.search_param = (horizon, wait_step, max_num_low_level_expansions)
+        self.max_num_expansions = max_num_expansions
+        self.num_workers = num_workers
+        #
+        self.num_expansions = 0
+        self._pool = None
+        self._heuristic_dict = dict()
+
+    # Low-level searches
+    #-------------------------------#
+    def _search(self, job_list):
+        """
+        Run the low-level searches.
+        inputs
+            - job_list: a list of (request, constraint_list)
+        outputs
+            - a list of (path, wait_list, cost)/None
+        """
+        if self._pool is None or len(job_list) <= 1:
+            graph = self.graph
+            return [_low_level_search(graph.adj_graph, graph.edge_list, graph.reservation_table, self._heuristic_dict[request[2]],
+                                      request, constraint_list, self.search_param) for request, constraint_list in job_list]
+        return self._pool.map(_low_level_search_in_worker, job_list)
+    #-------------------------------#
+
+    # Conflicts
+    #-------------------------------#
+    def get_occupancy_list(self, T_zone_start, path, wait_list):
+        """
+        The resources occupied by a planned agent, the same as GEOMETRY_TASK_GRAPH._add_agent_by_path()
+        (an edge passed several times is occupied over the time zone covering all the passes).
+        outputs
+            - a list of (kind, resource_id, T_zone)
+        """
+        edge_plan, node_plan = self.graph._plan_agent_by_path(path, T_zone_start, wait_list)
+        occupancy_list = [(rs.RESOURCE_NODE, node_id, T_zone) for node_id, T_zone in node_plan]
+        occupancy_list += [(rs.RESOURCE_EDGE, edge_id, T_zone_occ) for edge_id, T_zone_occ in edge_plan]
+        return occupancy_list
+
+    def _get_remained_capacity(self, kind, resource_id, T):
+        """
+        The capacity left by the booked agents at time stamp T.
+        """
+        if kind == rs.RESOURCE_EDGE:
+            return self.graph.edge_list[resource_id].get_remained_capacity_for_T_zone((T, T))
+        table = self.graph.reservation_table
+        return (table.node_capacity - len(table.get_agent_list((kind, resource_id), (T, T))))
+
+    def find_conflicts(self, request_dict, solution_dict):
+        """
+        Find the first conflict of each resource among the planned agents.
+        The nodes are considered only if the node reservation of the graph is enabled.
+        outputs
+            - a list of (kind, resource_id, T, agent_key_list), sorted by T,
+              where more agents in agent_key_list than the remained capacity occupy the resource at time stamp T
+        """
+        occupancy_dict = dict() # {(kind, resource_id):[(T_min, T_max, agent_key), ...], ...}
+        for agent_key in sorted(solution_dict):
+            path, wait_list, cost = solution_dict[agent_key]
+            for kind, resource_id, T_zone in self.get_occupancy_list(request_dict[agent_key][0], path, wait_list):
+                if kind == rs.RESOURCE_NODE and self.graph.reservation_table is None:
+                    continue
+                occupancy_dict.setdefault((kind, resource_id), []).append( (T_zone[0], T_zone[1], agent_key) )
+        conflict_list = []
+        for (kind, resource_id), interval_list in occupancy_dict.items():
+            if len(interval_list) < 2:
+                continue
+            interval_list.sort()
+            active_list = []
+            for T_min, T_max, agent_key in interval_list:
+                # The agents still there at T_min
+                active_list = [interval for interval in active_list if interval[1] >= T_min and interval[2] != agent_key]
+                active_list.append( (T_min, T_max, agent_key) )
+                if len(active_list) > 1 and len(active_list) > self._get_remained_capacity(kind, resource_id, T_min):
+                    conflict_list.append( (kind, resource_id, T_min, sorted(interval[2] for interval in active_list)) )
+                    break
+        conflict_list.sort(key=lambda conflict: (conflict[2], conflict[0], conflict[1]))
+        return conflict_list
+    #-------------------------------#
+
+    # High-level search
+    #-------------------------------#
+    def _pop_ct_node(self, open_list):
+        """
+        Pop the next constraint-tree node, among the ones within suboptimality times the lowest cost,
+        the one with the fewest conflicts.
+        """
+        min_cost = min(ct_node.cost for seq, ct_node in open_list)
+        bound = min_cost * self.suboptimality
+        best_idx = None
+        for idx, (seq, ct_node) in enumerate(open_list):
+            if ct_node.cost > bound:
+                continue
+            if best_idx is None or (len(ct_node.conflict_list), ct_node.cost, seq) < (len(open_list[best_idx][1].conflict_list), open_list[best_idx][1].cost, open_list[best_idx][0]):
+                best_idx = idx
+        return open_list.pop(best_idx)[1]
+
+    def solve(self, request_dict):
+        """
+        inputs
+            - request_dict: {agent_key:(T_zone_start, start_id, end_id, agent_id), ...}
+        outputs
+            - status: CBS_STATUS_*
+            - solution_dict: {agent_key:(path, wait_list, cost), ...} of the solution,
+                             or of the best constraint-tree node found (the fewest conflicts) if not solved;
+                             the agents without any path are not in it
+            - conflict_list: the remaining conflicts, see find_conflicts()
+        """
+        self.num_expansions = 0
+        self._heuristic_dict = dict()
+        for request in request_dict.values():
+            if not request[2] in self._heuristic_dict:
+                self._heuristic_dict[request[2]] = self.graph._get_heuristic(request[2])
+        if not self.num_workers is None and self.num_workers > 1:
+            import multiprocessing
+            graph = self.graph
+            self._pool = multiprocessing.Pool(self.num_workers, _init_low_level_worker,
+                                              (graph.adj_graph, graph.edge_list, graph.reservation_table, self._heuristic_dict, self.search_param))
+        try:
+            return self._solve(request_dict)
+        finally:
+            if not self._pool is None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+    def _solve(self, request_dict):
+        # The root
+        agent_key_list = sorted(request_dict)
+        result_list = self._search([(request_dict[agent_key], []) for agent_key in agent_key_list])
+        solution_dict = dict()
+        for agent_key, result in zip(agent_key_list, result_list):
+            if result is None:
+                logger.info('No path for agent <%s> even without constraints.', request_dict[agent_key][3])
+            else:
+                solution_dict[agent_key] = result
+        root = CT_NODE(dict(), solution_dict)
+        root.conflict_list = self.find_conflicts(request_dict, solution_dict)
+        open_list = [(0, root)] # Elements are (seq, CT_NODE)
+        seq = 1
+        best_ct_node = root
+        while open_list:
+            ct_node = self._pop_ct_node(open_list)
+            if (len(ct_node.conflict_list), ct_node.cost) < (len(best_ct_node.conflict_list), best_ct_node.cost):
+                best_ct_node = ct_node
+            if not ct_node.conflict_list:
+                logger.info('CBS solved with cost %s after %d expansions.', ct_node.cost, self.num_expansions)
+                return (CBS_STATUS_SOLVED, ct_node.solution_dict, [])
+            if self.num_expansions >= self.max_num_expansions:
+                logger.warning('CBS exceeded the budget of %d expansions with %d conflicts left.', self.max_num_expansions, len(best_ct_node.conflict_list))
+                return (CBS_STATUS_BUDGET_EXCEEDED, best_ct_node.solution_dict, best_ct_node.conflict_list)
+            self.num_expansions += 1
+            # Branch on the earliest conflict, one child per agent in the conflict
+            kind, resource_id, T, conflict_agent_key_list = ct_node.conflict_list[0]
+            job_list = []
+            for agent_key in conflict_agent_key_list:
+                constraint_list = ct_node.constraint_dict.get(agent_key, []) + [(kind, resource_id, (T, T))]
+                job_list.append( (request_dict[agent_key], constraint_list) )
+            result_list = self._search(job_list)
+            for agent_key, (request, constraint_list), result in zip(conflict_agent_key_list, job_list, result_list):
+                if result is None:
+                    # No path under the constraints
+                    continue
+                constraint_dict = dict(ct_node.constraint_dict)
+                constraint_dict[agent_key] = constraint_list
+                solution_dict = dict(ct_node.solution_dict)
+                solution_dict[agent_key] = result
+                child = CT_NODE(constraint_dict, solution_dict)
+                child.conflict_list = self.find_conflicts(request_dict, solution_dict)
+                open_list.append( (seq, child) )
+                seq += 1
+        logger.info('CBS found no solution after %d expansions.', self.num_expansions)
+        return (CBS_STATUS_NO_SOLUTION, best_ct_node.solution_dict, best_ct_node.conflict_list)
+    #-------------------------------#
+#-------------------------------#
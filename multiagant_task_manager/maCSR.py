@@ -0,0 +1,118 @@
+"""
+Compact graph representation
+This module provides a frozen CSR (compressed sparse row) view of the
+adj_graph and the static properties of edge_list in GEOMETRY_TASK_GRAPH.
+
+All the data are stored in contiguous array.array, and the view can be
+consumed by the engines in maGraphEngines in place of adj.
+"""
+import array
+
+
+# The CSR view of a graph
+#-------------------------------#
+class CSR_GRAPH(object):
+    """
+    Topology (the neighbors of node u are at [offsets[u], offsets[u+1]) )
+        - offsets: array of num_nodes+1 offsets
+        - targets: array of to_node_id
+        - edge_ids: array of edge_id
+
+    Edge properties (indexed by edge_id)
+        - from_node_id, to_node_id
+        - duration_min, duration_max: float('inf') means infinity
+        - capacity
+    """
+    def __init__(self, offsets, targets, edge_ids, from_node_id, to_node_id, duration_min, duration_max, capacity, is_reversed=False):
+        """
+        Use CSR_GRAPH.from_adj() to build one from the adjacent graph.
+        """
+        self.offsets = offsets
+        self.targets = targets
+        self.edge_ids = edge_ids
+        #
+        self.from_node_id = from_node_id
+        self.to_node_id = to_node_id
+        self.duration_min = duration_min
+        self.duration_max = duration_max
+        self.capacity = capacity
+        #
+        self.is_reversed = is_reversed
+        self.num_nodes = len(offsets) - 1
+        self.num_edges = len(duration_max)
+
+    @classmethod
+    def from_adj(cls, adj, edges):
+        """
+        Build the CSR view.
+        inputs
+            - adj: adjacent graph, a list of lists of (to_node_id, edge_id)
+            - edges: list of ed.EDGE()
+        outputs
+            - CSR_GRAPH
+        """
+        offset_list = [0]
+        target_list = []
+        edge_id_list = []
+        for neighbor_list in adj:
+            for to_node_id, edge_id in neighbor_list:
+                target_list.append(to_node_id)
+                edge_id_list.append(edge_id)
+            offset_list.append(len(target_list))
+        return cls(
+            array.array('l', offset_list),
+            array.array('l', target_list),
+            array.array('l', edge_id_list),
+            array.array('l', [edge.from_node_id for edge in edges]),
+            array.array('l', [edge.to_node_id for edge in edges]),
+            array.array('d', [edge.duration[0] for edge in edges]),
+            array.array('d', [edge.duration[1] for edge in edges]),
+            array.array('l', [edge.capacity for edge in edges]),
+        )
+
+    def get_reversed(self):
+        """
+        The CSR view with all the directed edges reversed (sharing the edge properties).
+        """
+        count_list = [0] * (self.num_nodes + 1)
+        for to_node_id in self.targets:
+            count_list[to_node_id + 1] += 1
+        for nid in range(self.num_nodes):
+            count_list[nid + 1] += count_list[nid]
+        offsets = array.array('l', count_list)
+        targets = array.array('l', [0]) * len(self.targets)
+        edge_ids = array.array('l', [0]) * len(self.edge_ids)
+        cursor_list = count_list[:-1]
+        for from_node_id in range(self.num_nodes):
+            for k in range(self.offsets[from_node_id], self.offsets[from_node_id + 1]):
+                to_node_id = self.targets[k]
+                pos = cursor_list[to_node_id]
+                targets[pos] = from_node_id
+                edge_ids[pos] = self.edge_ids[k]
+                cursor_list[to_node_id] += 1
+        return CSR_GRAPH(offsets, targets, edge_ids,
+                         self.from_node_id, self.to_node_id, self.duration_min, self.duration_max, self.capacity,
+                         is_reversed=(not self.is_reversed))
+
+    def get_memory_size(self):
+        """
+        The number of bytes of all the arrays.
+        """
+        array_list = [self.offsets, self.targets, self.edge_ids, self.from_node_id, self.to_node_id, self.duration_min, self.duration_max, self.capacity]
+        return sum(data.itemsize * len(data) for data in array_list)
+
+    # Interface of adj (list of lists of (to_node_id, edge_id))
+    #-------------------------------#
+    def __len__(self):
+        return self.num_nodes
+
+    def __getitem__(self, node_id):
+        begin = self.offsets[node_id]
+        end = self.offsets[node_id + 1]
+        return list(zip(self.targets[begin:end], self.edge_ids[begin:end]))
+
+    def __iter__(self):
+        for node_id in range(self.num_nodes):
+            yield self[node_id]
+    #-------------------------------#
+#-------------------------------#
@@ -0,0 +1,276 @@
+"""
+Columnar reservation store
+This module provides a columnar copy of the reservations (the tasks) of all the
+edges in GEOMETRY_TASK_GRAPH, so that the remained
+capacity (or the availability) of every edge in a time window is evaluated
+by one vectorized pass over the columns instead of one
+EDGE.is_available_for_T_zone() call per edge.
+
+The columns are contiguous array.array, kept in sync through the state
+listeners of the edges (see EDGE.add_state_listener()). If numpy is installed,
+the queries run on zero-copy numpy views of the columns; otherwise, they fall
+back to plain python loops with the same results.
+"""
+import array
+import maEdge as ed
+import maLogging as lg
+
+try:
+    import numpy as np
+except ImportError:
+    np = None # The queries fall back to python loops
+
+logger = lg.get_logger(__name__)
+
+
+# The columnar reservation store
+#-------------------------------#
+class RESERVATION_COLUMNS(object):
+    """
+    Columns of the tasks (one row for each (edge_id, agent_id, task_id))
+        - edge_id: array of edge_id
+        - agent_code: array of the dense code of agent_id (see agent_code_dict)
+        - T_min, T_max: array of float, float('inf') means infinity
+        - is_activated: array of 0/1
+        - key_list: [(agent_id, task_id), ...]
+
+    Columns of the edges (indexed by edge_id)
+        - capacity
+        - is_profile_mode: 1 if the edge counts with ed.CAPACITY_MODE_PROFILE
+
+    Note: A removed row is filled by the last row, so the rows are not in any order.
+    """
+    def __init__(self):
+        self.edges = []
+        #
+        self.edge_id = array.array('l')
+        self.agent_code = array.array('l')
+        self.T_min = array.array('d')
+        self.T_max = array.array('d')
+        self.is_activated = array.array('b')
+        self.key_list = []
+        self.row_dict = dict() # {(edge_id, agent_id):{task_id:row, ...}, ...}
+        self.agent_code_dict = dict() # {agent_id:agent_code, ...}
+        #
+        self.capacity = array.array('l')
+        self.is_profile_mode = array.array('b')
+
+    def __len__(self):
+        return len(self.key_list)
+
+    def build(self, edges):
+        """
+        Copy all the tasks of the edges into the columns.
+        inputs
+            - edges: edge list (kept by reference, the caller appends to it)
+        """
+        self.__init__()
+        self.edges = edges
+        for edge in edges:
+            self._append_edge(edge)
+        return True
+
+    def _append_edge(self, edge):
+        self.capacity.append(edge.capacity)
+        self.is_profile_mode.append(1 if edge.capacity_mode == ed.CAPACITY_MODE_PROFILE else 0)
+        for agent_id in edge.agent_dict:
+            self._sync_agent(edge, agent_id)
+
+    def _get_agent_code(self, agent_id):
+        if not agent_id in self.agent_code_dict:
+            self.agent_code_dict[agent_id] = len(self.agent_code_dict)
+        return self.agent_code_dict[agent_id]
+
+    # Rows
+    #-------------------------------#
+    def _append_row(self, edge_id, agent_id, task_id, T_zone, is_activated):
+        row = len(self.key_list)
+        self.edge_id.append(edge_id)
+        self.agent_code.append(self._get_agent_code(agent_id))
+        self.T_min.append(T_zone[0])
+        self.T_max.append(T_zone[1])
+        self.is_activated.append(1 if is_activated else 0)
+        self.key_list.append( (agent_id, task_id) )
+        self.row_dict.setdefault((edge_id, agent_id), dict())[task_id] = row
+
+    def _remove_row(self, row):
+        """
+        Move the last row into the removed one.
+        """
+        last = len(self.key_list) - 1
+        if row != last:
+            self.edge_id[row] = self.edge_id[last]
+            self.agent_code[row] = self.agent_code[last]
+            self.T_min[row] = self.T_min[last]
+            self.T_max[row] = self.T_max[last]
+            self.is_activated[row] = self.is_activated[last]
+            self.key_list[row] = self.key_list[last]
+            agent_id, task_id = self.key_list[row]
+            self.row_dict[(self.edge_id[row], agent_id)][task_id] = row
+        for column in (self.edge_id, self.agent_code, self.T_min, self.T_max, self.is_activated, self.key_list):
+            column.pop()
+
+    def _sync_agent(self, edge, agent_id):
+        """
+        Re-copy the rows of an agent at an edge from the states of the edge.
+        """
+        edge_id = edge.edge_id
+        task_row_dict = self.row_dict.pop((edge_id, agent_id), dict())
+        # Remove from the largest row, so that no row to be removed is moved
+        for row in sorted(task_row_dict.values(), reverse=True):
+            self._remove_row(row)
+        if not agent_id in edge.agent_dict:
+            return
+        for task_id in edge.agent_dict[agent_id].task_dict:
+            key = (agent_id, task_id)
+            T_zone = edge.task_index.get_T_zone(key)
+            if T_zone is None:
+                continue
+            self._append_row(edge_id, agent_id, task_id, T_zone, (key in edge.activated_task_index))
+    #-------------------------------#
+
+    # Updates
+    #-------------------------------#
+    def add_edge(self, edge_id):
+        """
+        An edge is appended to the edge list.
+        """
+        self._append_edge(self.edges[edge_id])
+
+    def update_edge_properties(self):
+        """
+        Re-copy the capacity and the capacity_mode of all the edges, which are not notified.
+        """
+        self.capacity = array.array('l', [edge.capacity for edge in self.edges])
+        self.is_profile_mode = array.array('b', [(1 if edge.capacity_mode == ed.CAPACITY_MODE_PROFILE else 0) for edge in self.edges])
+        return True
+
+    def on_edge_state_changed(self, edge, event, agent_id, task_id):
+        """
+        The state listener of the edges, see EDGE.add_state_listener().
+        """
+        self._sync_agent(edge, agent_id)
+    #-------------------------------#
+
+    # Queries
+    #-------------------------------#
+    def get_remained_capacity_vector(self, T_zone, only_count_activated_agent=False, agent_id=None):
+        """
+        The remained capacity of all the edges within T_zone,
+        the same as EDGE.get_remained_capacity_for_T_zone() of each edge.
+        inputs
+            - T_zone = (min_pass_stamp, max_pass_stamp)
+            - only_count_activated_agent (default: False)
+            - agent_id (default: None): If agent_id is given, ignore this agent.
+        outputs
+            - numpy array of int indexed by edge_id (a list if numpy is not installed)
+        """
+        T_a, T_b = T_zone
+        if T_b is None:
+            T_b = float('inf')
+        if np is None:
+            return self._get_remained_capacity_list(T_a, T_b, only_count_activated_agent, agent_id)
+        num_edges = len(self.capacity)
+        remained = self._as_numpy(self.capacity).astype(np.int64)
+        if T_b < T_a:
+            return remained
+        edge_id = self._as_numpy(self.edge_id)
+        agent_code = self._as_numpy(self.agent_code)
+        T_min = self._as_numpy(self.T_min)
+        T_max = self._as_numpy(self.T_max)
+        # The tasks intersected with the time window
+        is_counted = (T_min <= T_b) & (T_max >= T_a)
+        if only_count_activated_agent:
+            is_counted &= (self._as_numpy(self.is_activated) != 0)
+        if (not agent_id is None) and (agent_id in self.agent_code_dict):
+            is_counted &= (agent_code != self.agent_code_dict[agent_id])
+        edge_id = edge_id[is_counted]
+        agent_code = agent_code[is_counted]
+        # An agent with several tasks at an edge counts once
+        num_codes = max(len(self.agent_code_dict), 1)
+        pair, pair_count = np.unique(edge_id * num_codes + agent_code, return_counts=True)
+        remained -= np.bincount(pair // num_codes, minlength=num_edges)[:num_edges]
+        # The peak number of concurrent agents for the edges of ed.CAPACITY_MODE_PROFILE
+        is_profile_mode = self._as_numpy(self.is_profile_mode) != 0
+        if is_profile_mode.any() and len(edge_id) > 0:
+            is_profile_row = is_profile_mode[edge_id]
+            # The edges where an agent has overlapped tasks are left to the edge itself
+            fallback_edge_id_set = set((pair[pair_count > 1] // num_codes).tolist())
+            fallback_edge_id_set.intersection_update(np.nonzero(is_profile_mode)[0].tolist())
+            if fallback_edge_id_set:
+                is_profile_row &= ~np.isin(edge_id, list(fallback_edge_id_set))
+            profile_edge_id = edge_id[is_profile_row]
+            remained[np.unique(profile_edge_id)] = self._as_numpy(self.capacity)[np.unique(profile_edge_id)]
+            remained -= self._get_peak_load(profile_edge_id, T_min[is_counted][is_profile_row], T_max[is_counted][is_profile_row], T_a, T_b, num_edges)
+            for eid in fallback_edge_id_set:
+                remained[eid] = self.edges[eid].get_remained_capacity_for_T_zone((T_a, T_b), only_count_activated_agent, agent_id)
+        return remained
+
+    def get_availability_mask(self, T_zone, only_count_activated_agent=False, agent_id=None):
+        """
+        If each edge is available within T_zone, the same as EDGE.is_available_for_T_zone() of each edge,
+        which can be passed to the engines in maGraphEngines as edge_mask.
+        outputs
+            - numpy array of bool indexed by edge_id (a list if numpy is not installed)
+        """
+        remained = self.get_remained_capacity_vector(T_zone, only_count_activated_agent, agent_id)
+        if np is None:
+            return [(0 < _remained) for _remained in remained]
+        return (remained > 0)
+
+    @staticmethod
+    def _as_numpy(column):
+        """
+        A zero-copy numpy view of an array.array column.
+        """
+        if len(column) == 0:
+            return np.zeros(0, dtype=column.typecode)
+        return np.frombuffer(column, dtype=column.typecode)
+
+    @staticmethod
+    def _get_peak_load(edge_id, T_min, T_max, T_a, T_b, num_edges):
+        """
+        Sweep over the entering/leaving events (clipped into [T_a, T_b]) of all the edges at once.
+        The entering events go first at the same stamp, since the periods are closed sets.
+        """
+        peak = np.zeros(num_edges, dtype=np.int64)
+        if len(edge_id) == 0:
+            return peak
+        num_rows = len(edge_id)
+        event_edge_id = np.concatenate((edge_id, edge_id))
+        event_stamp = np.concatenate((np.maximum(T_min, T_a), np.minimum(T_max, T_b)))
+        is_leaving = np.concatenate((np.zeros(num_rows, dtype=np.int64), np.ones(num_rows, dtype=np.int64)))
+        order = np.lexsort((is_leaving, event_stamp, event_edge_id))
+        # The load of each edge returns to zero at the end of its events,
+        # so the running sum over all the events is the load of each edge.
+        load = np.cumsum(1 - 2 * is_leaving[order])
+        np.maximum.at(peak, event_edge_id[order], load)
+        return peak
+
+    def _get_remained_capacity_list(self, T_a, T_b, only_count_activated_agent, agent_id):
+        """
+        get_remained_capacity_vector() without numpy.
+        """
+        remained = list(self.capacity)
+        if T_b < T_a:
+            return remained
+        pair_set = set()
+        for row in range(len(self.key_list)):
+            if self.T_min[row] <= T_b and self.T_max[row] >= T_a:
+                if only_count_activated_agent and not self.is_activated[row]:
+                    continue
+                agent_id_i = self.key_list[row][0]
+                if (not agent_id is None) and agent_id_i == agent_id:
+                    continue
+                pair_set.add( (self.edge_id[row], agent_id_i) )
+        profile_edge_id_set = set()
+        for eid, agent_id_i in pair_set:
+            if self.is_profile_mode[eid]:
+                profile_edge_id_set.add(eid)
+            else:
+                remained[eid] -= 1
+        for eid in profile_edge_id_set:
+            remained[eid] = self.edges[eid].get_remained_capacity_for_T_zone((T_a, T_b), only_count_activated_agent, agent_id)
+        return remained
+    #-------------------------------#
+#-------------------------------#
@@ -0,0 +1,123 @@
+"""
+Concurrency primitives
+This module provides the locks used by GEOMETRY_TASK_GRAPH for serving
+the bookings from several threads (see book_a_path_concurrent()).
+
+The concurrency model
+    - The searches (readers) run in parallel under the shared side of READ_WRITE_LOCK,
+      possibly while some bookings are being committed (the paths are validated before the commit).
+    - A booking locks only the edges (and the nodes, if reserved) on its path,
+      always in the order of ORDERED_LOCK_SET, so that two bookings never deadlock.
+      It is validated and committed under these locks, so the bookings on disjoint paths commit in parallel.
+    - The caches and the indexes shared by the whole graph (e.g. the path cache and the reservation table)
+      are updated in a short critical section of the graph for each state change.
+    - The exclusive side of READ_WRITE_LOCK is taken only by the removals of agents.
+"""
+import contextlib
+import threading
+
+
+# Readers-writer lock
+#-------------------------------#
+class READ_WRITE_LOCK(object):
+    """
+    Many readers or one writer at a time. The waiting writers go first,
+    so that the writers are not starved by a stream of readers.
+    Note: The lock is not reentrant, a thread should not acquire it again while holding it.
+
+    States
+        - num_readers: the number of the threads holding the shared side
+        - num_waiting_writers
+        - is_writing: if a thread is holding the exclusive side
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self.num_readers = 0
+        self.num_waiting_writers = 0
+        self.is_writing = False
+
+    def acquire_read(self):
+        with self._condition:
+            while self.is_writing or self.num_waiting_writers > 0:
+                self._condition.wait()
+            self.num_readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self.num_readers -= 1
+            if self.num_readers == 0:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            self.num_waiting_writers += 1
+            while self.is_writing or self.num_readers > 0:
+                self._condition.wait()
+            self.num_waiting_writers -= 1
+            self.is_writing = True
+
+    def release_write(self):
+        with self._condition:
+            self.is_writing = False
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
+#-------------------------------#
+
+
+# Locks of resources
+#-------------------------------#
+class ORDERED_LOCK_SET(object):
+    """
+    One lock for each resource, e.g. ('edge', edge_id) or ('node', node_id),
+    created on demand. A group of locks is always acquired in the sorted order of
+    the resources (and released in the reversed order), which avoids deadlocks.
+    """
+    def __init__(self):
+        self._lock_dict = dict() # {resource:threading.Lock(), ...}
+        self._dict_lock = threading.Lock()
+
+    def _get_lock(self, resource):
+        with self._dict_lock:
+            if not resource in self._lock_dict:
+                self._lock_dict[resource] = threading.Lock()
+            return self._lock_dict[resource]
+
+    def acquire(self, resource_list):
+        """
+        inputs
+            - resource_list: the resources to be locked (duplicates are allowed)
+        outputs
+            - the sorted list of the distinct resources, to be passed to release()
+        """
+        resource_list = sorted(set(resource_list))
+        for resource in resource_list:
+            self._get_lock(resource).acquire()
+        return resource_list
+
+    def release(self, resource_list):
+        for resource in reversed(resource_list):
+            self._get_lock(resource).release()
+
+    @contextlib.contextmanager
+    def locked(self, resource_list):
+        resource_list = self.acquire(resource_list)
+        try:
+            yield resource_list
+        finally:
+            self.release(resource_list)
+#-------------------------------#
@@ -0,0 +1,237 @@
+"""
+Connectivity tracking
+This module provides the connectivity structure of GEOMETRY_TASK_GRAPH
+maintained for a specific time window (T_zone), so that the reachability
+and the number of connected components can be looked up without
+re-traversing the graph with capacity checks.
+
+The availability of each edge in the window is cached and only re-evaluated
+for the edges whose states changed (see EDGE.add_state_listener()).
+"""
+import maGraphEngines as ge
+import maLogging as lg
+
+logger = lg.get_logger(__name__)
+
+
+# The connectivity of a time window
+#-------------------------------#
+class CONNECTIVITY_TRACKER(object):
+    """
+    Properties
+        - T_zone: the time window, a tuple of (min_pass_stamp, max_pass_stamp)
+        - only_count_activated_agent
+
+    States
+        - is_available: is_available[edge_id] is True if the edge is available in T_zone
+        - component_id: component_id[node_id] is the id of the (weakly) connected component
+                        of the node through the available edges
+        - component_dict: {component_id:set(node_id), ...}
+        - num_directed_edges: the number of the edges that are not bidirectional
+
+    When an edge becomes available, the smaller component is merged into the larger one.
+    When an edge becomes full, two searches run alternately from its end nodes through the available edges:
+    they usually meet soon (nothing changes), otherwise the side exhausted first is split off as a new component.
+    So an update costs about the smaller side, not the whole graph.
+    """
+    def __init__(self, T_zone, only_count_activated_agent=False):
+        """
+        inputs
+            - T_zone = (min_pass_stamp, max_pass_stamp)
+            - only_count_activated_agent (default: False)
+        """
+        self.T_zone = tuple(T_zone)
+        self.only_count_activated_agent = only_count_activated_agent
+        #
+        self.adj = []
+        self.adj_reversed = []
+        self._is_own_adj_reversed = False
+        self.edges = []
+        self.is_available = []
+        self.component_id = []
+        self.component_dict = dict()
+        self._next_component_id = 0
+        self.num_directed_edges = 0
+
+    def build(self, adj, edges, edge_mask=None, adj_reversed=None):
+        """
+        Evaluate the availability of all the edges and build the components.
+        inputs
+            - adj: adjacent graph (kept by reference, the caller appends to it)
+            - edges: edge list (kept by reference, the caller appends to it)
+            - edge_mask (default: None): the availability of all the edges in T_zone if already evaluated,
+                                         e.g. by maColumnar.RESERVATION_COLUMNS.get_availability_mask()
+            - adj_reversed (default: None): the reversed adjacent graph (kept by reference, the caller appends to it),
+                                            "None" means generating one and maintaining it in add_node()/add_edge()
+        """
+        self.adj = adj
+        self.edges = edges
+        if adj_reversed is None:
+            self.adj_reversed = ge.generate_reverse_graph(adj)
+            self._is_own_adj_reversed = True
+        else:
+            self.adj_reversed = adj_reversed
+            self._is_own_adj_reversed = False
+        if edge_mask is None:
+            self.is_available = [edge.is_available_for_T_zone(self.T_zone, self.only_count_activated_agent) for edge in edges]
+        else:
+            self.is_available = [bool(is_available) for is_available in edge_mask]
+        self.num_directed_edges = sum(1 for edge in edges if not edge.is_bidirectional)
+        self._rebuild_components()
+        return True
+
+    def _rebuild_components(self):
+        """
+        Re-build the components from the cached availability by union-find, no capacity is checked.
+        """
+        disjoint_set = ge.DISJOINT_SET(len(self.adj))
+        for eid, edge in enumerate(self.edges):
+            if self.is_available[eid]:
+                disjoint_set.union(edge.from_node_id, edge.to_node_id)
+        self.component_id = [disjoint_set.find(nid) for nid in range(len(self.adj))]
+        self.component_dict = dict()
+        for nid, cid in enumerate(self.component_id):
+            self.component_dict.setdefault(cid, set()).add(nid)
+        self._next_component_id = len(self.adj)
+
+    def _new_component_id(self):
+        cid = self._next_component_id
+        self._next_component_id += 1
+        return cid
+
+    def _merge(self, x, y):
+        """
+        Merge the components of node_id:x and node_id:y, the smaller one is re-labeled.
+        """
+        cid_x, cid_y = self.component_id[x], self.component_id[y]
+        if cid_x == cid_y:
+            return False
+        if len(self.component_dict[cid_x]) < len(self.component_dict[cid_y]):
+            cid_x, cid_y = cid_y, cid_x
+        member_set = self.component_dict.pop(cid_y)
+        for nid in member_set:
+            self.component_id[nid] = cid_x
+        self.component_dict[cid_x].update(member_set)
+        return True
+
+    def _split(self, x, y):
+        """
+        After an edge between node_id:x and node_id:y became full, split their component if they are disconnected.
+        Two searches (through the available edges, as undirected) are expanded alternately,
+        until they meet, or one of them is exhausted, which is then the new component.
+        """
+        if x == y:
+            return False
+        adj, adj_reversed, is_available = self.adj, self.adj_reversed, self.is_available
+        visited_list = [set([x]), set([y])]
+        stack_list = [[x], [y]]
+        side = 0
+        while True:
+            visited, stack = visited_list[side], stack_list[side]
+            if not stack:
+                break
+            nid = stack.pop()
+            for neighbor_list in (adj[nid], adj_reversed[nid]):
+                for to_nid, eid in neighbor_list:
+                    if (not is_available[eid]) or (to_nid in visited):
+                        continue
+                    if to_nid in visited_list[1 - side]:
+                        # The two searches meet, still connected
+                        return False
+                    visited.add(to_nid)
+                    stack.append(to_nid)
+            side = 1 - side
+        # The side exhausted first is a whole component
+        member_set = visited_list[side]
+        cid_old = self.component_id[x]
+        cid_new = self._new_component_id()
+        for nid in member_set:
+            self.component_id[nid] = cid_new
+        self.component_dict[cid_old].difference_update(member_set)
+        self.component_dict[cid_new] = member_set
+        return True
+
+    # Updates
+    #-------------------------------#
+    def add_node(self):
+        """
+        A node is appended to the graph.
+        """
+        if self._is_own_adj_reversed:
+            self.adj_reversed.append([])
+        cid = self._new_component_id()
+        self.component_id.append(cid)
+        self.component_dict[cid] = set([len(self.component_id) - 1])
+
+    def add_edge(self, edge_id):
+        """
+        An edge is appended to the graph.
+        """
+        edge = self.edges[edge_id]
+        if self._is_own_adj_reversed:
+            self.adj_reversed[edge.to_node_id].append((edge.from_node_id, edge_id))
+            if edge.is_bidirectional:
+                self.adj_reversed[edge.from_node_id].append((edge.to_node_id, edge_id))
+        self.is_available.append(False)
+        if not edge.is_bidirectional:
+            self.num_directed_edges += 1
+        self.update_edge(edge_id)
+
+    def update_edge(self, edge_id):
+        """
+        Re-evaluate the availability of an edge whose states changed.
+        outputs
+            - True: the availability flipped
+              False: nothing changed
+        """
+        edge = self.edges[edge_id]
+        is_available = edge.is_available_for_T_zone(self.T_zone, self.only_count_activated_agent)
+        if is_available == self.is_available[edge_id]:
+            return False
+        self.is_available[edge_id] = is_available
+        if is_available:
+            # Full --> available, an edge is added
+            self._merge(edge.from_node_id, edge.to_node_id)
+        else:
+            # Available --> full, an edge is removed
+            self._split(edge.from_node_id, edge.to_node_id)
+        logger.debug('Edge <%d> became %s in T_zone=%s.', edge_id, ('available' if is_available else 'full'), self.T_zone)
+        return True
+    #-------------------------------#
+
+    # Queries
+    #-------------------------------#
+    def is_reachable(self, x, y):
+        """
+        If node_id:y is reachable from node_id:x through the edges available in T_zone.
+        With only bidirectional edges, this is a look-up of the components;
+        otherwise, it traverses the cached available edges (no capacity checks).
+        """
+        if x == y:
+            return True
+        if self.component_id[x] != self.component_id[y]:
+            # Not even weakly connected
+            return False
+        if self.num_directed_edges == 0:
+            return True
+        # Directed edges exist, traverse inside the component
+        visited = [False] * len(self.adj)
+        visited[x] = True
+        stack = [x]
+        is_available = self.is_available
+        while stack:
+            for to_nid, eid in self.adj[stack.pop()]:
+                if not visited[to_nid] and is_available[eid]:
+                    if to_nid == y:
+                        return True
+                    visited[to_nid] = True
+                    stack.append(to_nid)
+        return False
+
+    def number_of_connected_components(self):
+        """
+        The number of (weakly) connected components through the edges available in T_zone.
+        """
+        return len(self.component_dict)
+    #-------------------------------#
+#-------------------------------#
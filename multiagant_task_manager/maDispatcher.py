@@ -0,0 +1,300 @@
+"""
+Asynchronous dispatcher
+This module provides an asyncio front-end of GEOMETRY_TASK_GRAPH, so that an
+event loop can submit the booking, cancellation and (de)activation requests
+without being blocked by the searches.
+
+    - The requests are queued in the order of their deadlines (earliest first).
+    - Once per tick, up to max_batch_size requests are taken as a batch,
+      and the batch is processed on an executor (a thread), where the bookings
+      of a batch share the searches through GEOMETRY_TASK_GRAPH.book_paths().
+      The requests of the same agent take effect in the order they were submitted.
+    - Every request gets an asyncio.Future, resolved with a result dict.
+    - At most max_num_pending requests are queued (backpressure). A request
+      submitted to a full queue waits for room, unless its deadline is earlier
+      than the latest deadline in the queue, which is then dropped instead.
+
+Note: This module requires Python 3.5+ (asyncio), it is not imported by the other modules.
+"""
+import asyncio
+import heapq
+import itertools
+import maLogging as lg
+
+logger = lg.get_logger(__name__)
+
+
+# Kinds of requests
+#-------------------------------#
+REQUEST_BOOK = 'book' # args: (T_zone_start, start_id, end_id, agent_id, task_id)
+REQUEST_CANCEL = 'cancel' # args: (agent_id, task_id), task_id can be "None" (all the tasks)
+REQUEST_ACTIVATE = 'activate' # args: (agent_id, task_id)
+REQUEST_DEACTIVATE = 'deactivate' # args: (agent_id, task_id), task_id can be "None" (all the tasks)
+#-------------------------------#
+
+# The order of processing the kinds in a batch, the ones freeing capacity go first
+# (but never before an earlier request of the same agent, see DISPATCHER._get_round_list())
+_KIND_ORDER_LIST = [REQUEST_CANCEL, REQUEST_DEACTIVATE, REQUEST_ACTIVATE, REQUEST_BOOK]
+
+
+# The dispatcher
+#-------------------------------#
+class DISPATCHER(object):
+    """
+    Properties
+        - graph: GEOMETRY_TASK_GRAPH
+        - tick: the time (sec.) of collecting a batch after the first request arrives
+        - max_batch_size
+        - max_num_pending: the capacity of the queue
+        - executor: the executor of the batches, "None" means the default executor of the event loop
+
+    States
+        - _heap: [(deadline, seq, kind, args, future), ...], deadline is float('inf') if not given
+        - num_batches, num_dropped, num_expired
+
+    The result dict of each request
+        - 'is_done': True/False
+        - 'reason': "None" if done, otherwise one of
+            - 'deadline_exceeded': the deadline passed before the request was processed
+            - 'dropped': pushed out of the full queue by a more urgent request
+            - 'stopped': the dispatcher was stopped
+            - the reasons of GEOMETRY_TASK_GRAPH.book_paths() for bookings, or 'not_booked'
+        - 'path': the booked path (bookings only)
+    """
+    def __init__(self, graph, tick=0.01, max_batch_size=64, max_num_pending=1024, executor=None):
+        """
+        inputs
+            - graph: GEOMETRY_TASK_GRAPH
+            - tick              (default: 0.01 sec.)
+            - max_batch_size    (default: 64)
+            - max_num_pending   (default: 1024)
+            - executor          (default: None)
+        """
+        self.graph = graph
+        self.tick = tick
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_num_pending = max(1, int(max_num_pending))
+        self.executor = executor
+        #
+        self._heap = []
+        self._seq = itertools.count()
+        self._has_request = None # asyncio.Event(), created in start()
+        self._has_room = None # asyncio.Event(), created in start()
+        self._task = None
+        self.num_batches = 0
+        self.num_dropped = 0
+        self.num_expired = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    # Life cycle
+    #-------------------------------#
+    async def start(self):
+        """
+        Start the dispatching loop in the running event loop.
+        """
+        if not self._task is None:
+            logger.warning('The dispatcher is already started.')
+            return False
+        self._has_request = asyncio.Event()
+        self._has_room = asyncio.Event()
+        self._has_room.set()
+        self._task = asyncio.ensure_future(self._run())
+        return True
+
+    async def stop(self):
+        """
+        Stop the dispatching loop, the queued requests are resolved with 'stopped'.
+        """
+        if self._task is None:
+            return False
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        while self._heap:
+            self._resolve(heapq.heappop(self._heap)[4], self._get_result(False, 'stopped'))
+        self._has_room.set()
+        return True
+    #-------------------------------#
+
+    # Requests
+    #-------------------------------#
+    async def submit(self, kind, args, timeout=None):
+        """
+        Queue a request.
+        inputs
+            - kind: REQUEST_BOOK, REQUEST_CANCEL, REQUEST_ACTIVATE or REQUEST_DEACTIVATE
+            - args: see REQUEST_*
+            - timeout (default: None): the deadline (sec.) from now, "None" means no deadline
+        outputs
+            - asyncio.Future of the result dict
+        """
+        if self._task is None:
+            logger.error('The dispatcher is not started, the request <%s> is not queued.', kind)
+            return None
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        deadline = float('inf') if timeout is None else (loop.time() + timeout)
+        # Backpressure
+        while len(self._heap) >= self.max_num_pending:
+            latest = max(self._heap)
+            if deadline < latest[0]:
+                # Drop the least urgent one
+                self._heap.remove(latest)
+                heapq.heapify(self._heap)
+                self.num_dropped += 1
+                self._resolve(latest[4], self._get_result(False, 'dropped'))
+                break
+            self._has_room.clear()
+            try:
+                await asyncio.wait_for(self._has_room.wait(), (None if timeout is None else max(0.0, deadline - loop.time())))
+            except asyncio.TimeoutError:
+                self.num_expired += 1
+                self._resolve(future, self._get_result(False, 'deadline_exceeded'))
+                return future
+        heapq.heappush(self._heap, (deadline, next(self._seq), kind, tuple(args), future))
+        self._has_request.set()
+        return future
+
+    async def book(self, T_zone_start, start_id, end_id, agent_id, task_id, timeout=None):
+        return await self.submit(REQUEST_BOOK, (T_zone_start, start_id, end_id, agent_id, task_id), timeout)
+
+    async def cancel(self, agent_id, task_id=None, timeout=None):
+        return await self.submit(REQUEST_CANCEL, (agent_id, task_id), timeout)
+
+    async def activate(self, agent_id, task_id, timeout=None):
+        return await self.submit(REQUEST_ACTIVATE, (agent_id, task_id), timeout)
+
+    async def deactivate(self, agent_id, task_id=None, timeout=None):
+        return await self.submit(REQUEST_DEACTIVATE, (agent_id, task_id), timeout)
+    #-------------------------------#
+
+    # Dispatching
+    #-------------------------------#
+    @staticmethod
+    def _get_result(is_done, reason, path=None):
+        return {'is_done':is_done, 'reason':reason, 'path':path}
+
+    @staticmethod
+    def _resolve(future, result):
+        if not future.done():
+            future.set_result(result)
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await self._has_request.wait()
+            # Collect the requests arriving within a tick
+            await asyncio.sleep(self.tick)
+            now = loop.time()
+            batch = []
+            while self._heap and len(batch) < self.max_batch_size:
+                deadline, seq, kind, args, future = heapq.heappop(self._heap)
+                if future.done():
+                    # Cancelled by the caller
+                    continue
+                if deadline < now:
+                    self.num_expired += 1
+                    self._resolve(future, self._get_result(False, 'deadline_exceeded'))
+                    continue
+                batch.append( (kind, args, future, seq) )
+            if not self._heap:
+                self._has_request.clear()
+            self._has_room.set()
+            if not batch:
+                continue
+            self.num_batches += 1
+            try:
+                result_list = await loop.run_in_executor(self.executor, self._process_batch, [(kind, args, seq) for kind, args, future, seq in batch])
+            except Exception as e:
+                logger.exception('Failed to process a batch of %d requests.', len(batch))
+                for kind, args, future, seq in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (kind, args, future, seq), result in zip(batch, result_list):
+                self._resolve(future, result)
+
+    @staticmethod
+    def _get_round_list(request_list):
+        """
+        Split a batch into rounds, processed one after another.
+        In a round, the kinds are processed in the order of _KIND_ORDER_LIST, so a request
+        goes to a later round than the earlier (submitted) requests of the same agent
+        that would be processed after it, e.g. a cancellation following a booking of the same agent.
+        inputs
+            - request_list: a list of (kind, args, seq), seq is the order of submission
+        outputs
+            - round_list: a list of rounds, each is a list of the indexes in request_list (in the same order)
+        """
+        kind_order_dict = dict((kind, order) for order, kind in enumerate(_KIND_ORDER_LIST))
+        state_dict = dict() # The last (round, kind order) of each agent, {agent_id:(round, order), ...}
+        round_of_idx = [0] * len(request_list)
+        for idx in sorted(range(len(request_list)), key=lambda idx: request_list[idx][2]):
+            kind, args, seq = request_list[idx]
+            agent_id = args[3] if kind == REQUEST_BOOK else args[0]
+            order = kind_order_dict[kind]
+            round_idx, last_order = state_dict.get(agent_id, (0, order))
+            if order < last_order:
+                # Would be processed before the earlier request of the same agent
+                round_idx += 1
+            state_dict[agent_id] = (round_idx, order)
+            round_of_idx[idx] = round_idx
+        round_list = [[] for _ in range(max(round_of_idx) + 1 if round_of_idx else 0)]
+        for idx, round_idx in enumerate(round_of_idx):
+            round_list[round_idx].append(idx)
+        return round_list
+
+    def _process_batch(self, request_list):
+        """
+        Process a batch on the executor, the requests are in the order of their deadlines.
+        The cancellations and the deactivations go first to free the capacity,
+        then the bookings are committed by one GEOMETRY_TASK_GRAPH.book_paths(), in the order of their deadlines.
+        The requests of the same agent are never re-ordered, the ones that would be go to the next round
+        (see _get_round_list()), which is processed the same way.
+        inputs
+            - request_list: a list of (kind, args, seq), seq is the order of submission
+        outputs
+            - result_list, in the same order as request_list
+        """
+        result_list = [None] * len(request_list)
+        for idx_round_list in self._get_round_list(request_list):
+            self._process_round(request_list, idx_round_list, result_list)
+        logger.info('A batch of %d requests is processed.', len(request_list))
+        return result_list
+
+    def _process_round(self, request_list, idx_round_list, result_list):
+        """
+        Process the requests of a round (see _get_round_list()), the results are put into result_list.
+        """
+        graph = self.graph
+        for kind_i in _KIND_ORDER_LIST:
+            idx_list = [idx for idx in idx_round_list if request_list[idx][0] == kind_i]
+            if not idx_list:
+                continue
+            if kind_i == REQUEST_BOOK:
+                # The rank of the deadline is the priority of book_paths()
+                book_request_list = [tuple(request_list[idx][1]) + (rank,) for rank, idx in enumerate(idx_list)]
+                with graph.rw_lock.write_locked():
+                    book_result_list = graph.book_paths(book_request_list)
+                for idx, result in zip(idx_list, book_result_list):
+                    result_list[idx] = self._get_result(result['is_booked'], result['reason'], result['path'])
+                continue
+            with graph.rw_lock.write_locked():
+                for idx in idx_list:
+                    agent_id, task_id = request_list[idx][1]
+                    if kind_i == REQUEST_CANCEL:
+                        graph._remove_agent_from_all_edges(agent_id, task_id)
+                        graph._remove_agent_from_all_nodes(agent_id, task_id)
+                        is_done = True
+                    elif kind_i == REQUEST_ACTIVATE:
+                        is_done = graph._activate_agent_on_all_edges(agent_id, task_id)
+                    else:
+                        is_done = graph._deactivate_agent_on_all_edges(agent_id, task_id)
+                    result_list[idx] = self._get_result(is_done, (None if is_done else 'not_booked'))
+    #-------------------------------#
+#-------------------------------#
@@ -1,5 +1,24 @@
 import maAgent as ag
+import maIntervalTree as it
+import maLogging as lg
 
+logger = lg.get_logger(__name__)
+
+# Capacity modes of EDGE
+#-------------------------------#
+# Count every agent whose tasks touch the queried T_zone (conservative)
+CAPACITY_MODE_INTERVAL = 'interval'
+# Count the peak number of concurrent agents within the queried T_zone (occupancy profile)
+CAPACITY_MODE_PROFILE = 'profile'
+#-------------------------------#
+
+# Events of the state changes of EDGE, passed to the state listeners
+#-------------------------------#
+EDGE_EVENT_PUT = 'put'
+EDGE_EVENT_REMOVE = 'remove'
+EDGE_EVENT_ACTIVATE = 'activate'
+EDGE_EVENT_DEACTIVATE = 'deactivate'
+#-------------------------------#
 # The class for edge and its states
 #-------------------------------#
 class EDGE(object):
@@ -14,13 +33,20 @@ class EDGE(object):
             - min_pass_time (int): estimated minimum required time period for passing the edge
             - max_pass_time (int): estimated maximum required time period for passing the edge
                                   (should not be smaller than min_pass_time)
+        - capacity_mode: CAPACITY_MODE_INTERVAL or CAPACITY_MODE_PROFILE,
+                         the way of counting the occupied capacity in a time period
 
     States (dynamically changed)
         - agent_dict: dictionary of agent that map from agent_id to ag.AGENT() object
         - num_activated_agent: The agent that marked is_activated=True
+        - task_index: interval index of T_zone of all the tasks, keyed by (agent_id, task_id)
+        - activated_task_index: interval index of T_zone of the activated tasks only
+        - state_listener_list: callbacks called as callback(edge, event, agent_id, task_id)
+                               after each successful put/remove/activate/deactivate (see EDGE_EVENT_*)
+        - version (int): increased on every state change, for detecting the changes since a search
     """
-    #       EDGE(edge_id, from_node_id, to_node_id, is_bidirectional, capacity, duration)
-    def __init__(self, edge_id, from_node_id, to_node_id, is_bidirectional=True, capacity=1, duration=(0,0)):
+    #       EDGE(edge_id, from_node_id, to_node_id, is_bidirectional, capacity, duration, capacity_mode)
+    def __init__(self, edge_id, from_node_id, to_node_id, is_bidirectional=True, capacity=1, duration=(0,0), capacity_mode=CAPACITY_MODE_INTERVAL):
         """
         inputs (* denote the "must-have"(mandatory) )
         * edge_id
@@ -29,6 +55,7 @@ class EDGE(object):
         - is_bidirectional  (default: True)
         - capacity          (default: 1 unit)
         - duration          (default: (0,0), type: int, None means infinity. dT)
+        - capacity_mode     (default: CAPACITY_MODE_INTERVAL)
         """
         # Properties of the edge
         #--------------------------------------#
@@ -45,17 +72,20 @@ class EDGE(object):
         dT_min = int(min_pass_time)
         if max_pass_time is None:
             # If there is no max_pass_time supplied, set it to be the same as min_pass_time
-            dT_max = float('inf') # 'None' means infinity (no maximum)
+            dT_max = ag.INF # 'None' means infinity (no maximum)
         else:
             max_pass_time = int(max_pass_time)
             if max_pass_time < dT_min:
                 # We don't allow the max_pass_time to be smaller than the min_pass_time
                 dT_max = dT_min
-                print('WARN: The max_pass_time is smaller than min_pass_time at edge of (%d, %d)' % (self.from_node_id, self.to_node_id))
+                logger.warning('The max_pass_time is smaller than min_pass_time at edge of (%d, %d)', self.from_node_id, self.to_node_id)
             else:
                 dT_max = max_pass_time
         #
         self.duration = (dT_min, dT_max)
+        #
+        self.capacity_mode = CAPACITY_MODE_INTERVAL
+        self.set_capacity_mode(capacity_mode)
         #--------------------------------------#
 
         # States of the edge
@@ -68,7 +98,14 @@ class EDGE(object):
         #-------------------------------------#
         # The total number of activated agent
         self.num_activated_agent = 0 # current running agent
+        # Interval indexes of the T_zone of tasks, keyed by (agent_id, task_id)
+        self.task_index = it.INTERVAL_TREE() # All tasks
+        self.activated_task_index = it.INTERVAL_TREE() # Activated tasks only
         #-------------------------------------#
+        # Callbacks for the state changes
+        self.state_listener_list = []
+        # Increased on every state change
+        self.version = 0
         #-------------------------------#
 
     def _sync_agent_dict(self):
@@ -83,6 +120,85 @@ class EDGE(object):
         self.num_activated_agent = num_activated_agent
         return True
 
+    def add_state_listener(self, callback):
+        """
+        Register a callback called as callback(edge, event, agent_id, task_id) after each state change.
+        """
+        if not callback in self.state_listener_list:
+            self.state_listener_list.append(callback)
+        return True
+
+    def remove_state_listener(self, callback):
+        """
+        Un-register a callback.
+        """
+        if callback in self.state_listener_list:
+            self.state_listener_list.remove(callback)
+            return True
+        return False
+
+    def __getstate__(self):
+        # The callbacks are bound to the objects of this process (e.g. the graph and its locks),
+        # so the edge is pickled without them, e.g. for the worker processes
+        state = self.__dict__.copy()
+        state['state_listener_list'] = []
+        return state
+
+    def _notify_state_changed(self, event, agent_id, task_id):
+        self.version += 1
+        for callback in self.state_listener_list:
+            callback(self, event, agent_id, task_id)
+
+    def _rebuild_task_index(self):
+        """
+        In case there might be something wrong, re-build the interval indexes from agent_dict().
+        outputs
+            - True/False
+        """
+        self.task_index = it.INTERVAL_TREE()
+        self.activated_task_index = it.INTERVAL_TREE()
+        for agent_id in self.agent_dict:
+            for task_id in self.agent_dict[agent_id].task_dict:
+                self._index_task(agent_id, task_id)
+        return True
+
+    def _index_task(self, agent_id, task_id):
+        """
+        Put the T_zone of a task (already in agent_dict) into the interval indexes.
+        """
+        _task = self.agent_dict[agent_id].task_dict[task_id]
+        key = (agent_id, task_id)
+        self.task_index.insert(_task.T_zone, key)
+        if _task.is_activated:
+            self.activated_task_index.insert(_task.T_zone, key)
+        else:
+            self.activated_task_index.remove(key)
+
+    def _unindex_task(self, agent_id, task_id):
+        """
+        Remove the T_zone of a task from the interval indexes.
+        """
+        key = (agent_id, task_id)
+        self.task_index.remove(key)
+        self.activated_task_index.remove(key)
+
+    def get_task_T_zone(self, agent_id, task_id):
+        """
+        The T_zone of a task of an agent in this edge, "None" if the task is not in this edge.
+        """
+        _agent = self.agent_dict.get(agent_id, None)
+        if (_agent is None) or (not task_id in _agent.task_dict):
+            return None
+        return _agent.task_dict[task_id].T_zone
+
+    def _get_affected_task_id_list(self, agent_id, task_id=None):
+        """
+        The task_id(s) of the agent that an operation with (possibly "None") task_id applies to.
+        """
+        if task_id is None:
+            return list(self.agent_dict[agent_id].task_dict)
+        return [task_id]
+
     #             (agent_id, task_id, is_activated, min_pass_stamp, max_pass_stamp)
     def put_agent(self, agent_id, task_id, is_activated=False, T_zone=(0,None)):
         """
@@ -90,24 +206,38 @@ class EDGE(object):
         outputs
             - True/False
         """
-        if not agent_id in self.agent_dict:
+        if self.is_available_for_T_zone(T_zone, only_count_activated_agent=False):
+            return self._put_agent_unchecked(agent_id, task_id, is_activated, T_zone)
+        else:
+            # Something wrong, no room left for this activated agent!!
+            logger.error('No room left for an agent in the edge<%d> within T_zone=%s. The agent <%d> was not added.', self.edge_id, T_zone, agent_id)
+            return False
+
+    def _put_agent_unchecked(self, agent_id, task_id, is_activated=False, T_zone=(0,None)):
+        """
+        The insertion part of put_agent(), for the callers that already checked the capacity,
+        e.g. the booking transaction of GEOMETRY_TASK_GRAPH (see _add_agent_by_path()).
+        outputs
+            - True/False
+        """
+        is_new_agent = not agent_id in self.agent_dict
+        if is_new_agent:
             self.agent_dict[agent_id] = ag.AGENT(agent_id)
         # else
-        if self.is_available_for_T_zone(T_zone, only_count_activated_agent=False):
-            if self.agent_dict[agent_id].put_task(task_id, is_activated, T_zone):
-                if is_activated:
-                    self.num_activated_agent += 1
-                    print('INFO: An activated agent <%d> with task <%s> is put into the edge<%d>, activated/total = %d/%d' % (agent_id, str(task_id), self.edge_id, self.num_activated_agent, len(self.agent_dict)) )
-                else:
-                    print('INFO: A non-activated agent <%d> with task <%s> is put into the edge<%d>, activated/total = %d/%d' % (agent_id, str(task_id), self.edge_id, self.num_activated_agent, len(self.agent_dict)) )
-                return True
+        if self.agent_dict[agent_id].put_task(task_id, is_activated, T_zone):
+            self._index_task(agent_id, task_id)
+            if is_activated:
+                self.num_activated_agent += 1
+                logger.info('An activated agent <%d> with task <%s> is put into the edge<%d>, activated/total = %d/%d', agent_id, task_id, self.edge_id, self.num_activated_agent, len(self.agent_dict))
             else:
-                # Somthing wrong
-                print('ERROR: Somthing wrong in put_task() for agent <%d> with task <%s> in the edge<%d> within T_zone=%s. The agent was not added.' % (agent_id, str(task_id), self.edge_id , str(T_zone) ) )
-                return False
+                logger.info('A non-activated agent <%d> with task <%s> is put into the edge<%d>, activated/total = %d/%d', agent_id, task_id, self.edge_id, self.num_activated_agent, len(self.agent_dict))
+            self._notify_state_changed(EDGE_EVENT_PUT, agent_id, task_id)
+            return True
         else:
-            # Something wrong, no room left for this activated agent!!
-            print('ERROR: No room left for an agent in the edge<%d> within T_zone=%s. The agent <%d> was not added.' % (self.edge_id, agent_id, str(T_zone) ) )
+            # Somthing wrong
+            if is_new_agent:
+                del self.agent_dict[agent_id]
+            logger.error('Somthing wrong in put_task() for agent <%d> with task <%s> in the edge<%d> within T_zone=%s. The agent was not added.', agent_id, task_id, self.edge_id, T_zone)
             return False
 
 
@@ -119,28 +249,32 @@ class EDGE(object):
         """
         if agent_id in self.agent_dict:
             was_activated = self.agent_dict[agent_id].is_activated
+            task_id_list = self._get_affected_task_id_list(agent_id, task_id)
             if self.agent_dict[agent_id].remove_task(task_id):
+                for task_id_i in task_id_list:
+                    self._unindex_task(agent_id, task_id_i)
                 if was_activated and (not self.agent_dict[agent_id].is_activated):
                     # No more being activated
                     self.num_activated_agent -= 1
                     if self.num_activated_agent < 0:
                         self.num_activated_agent = 0
-                        print('ERROR: The num_activated_agent < 0 after removal of an agent at edge <%d>.' % self.edge_id)
+                        logger.error('The num_activated_agent < 0 after removal of an agent at edge <%d>.', self.edge_id)
                 #
                 if self.agent_dict[agent_id].number_task(only_count_activated_task=False) == 0:
                     # Remove this agent
                     del self.agent_dict[agent_id]
-                    print('INFO: Agent <%d> was totally removed from edge <%d>. Then, activated/total becomes %d/%d.' % (agent_id, self.edge_id, self.num_activated_agent, len(self.agent_dict) ))
+                    logger.info('Agent <%d> was totally removed from edge <%d>. Then, activated/total becomes %d/%d.', agent_id, self.edge_id, self.num_activated_agent, len(self.agent_dict))
                 else:
-                    print('INFO: Agent <%d> with task <%s> was removed from edge <%d>. Then, activated/total becomes %d/%d.' % (agent_id, str(task_id), self.edge_id, self.num_activated_agent, len(self.agent_dict)) )
+                    logger.info('Agent <%d> with task <%s> was removed from edge <%d>. Then, activated/total becomes %d/%d.', agent_id, task_id, self.edge_id, self.num_activated_agent, len(self.agent_dict))
+                self._notify_state_changed(EDGE_EVENT_REMOVE, agent_id, task_id)
                 return True
             else:
                 # Something wrong, task was not in the task_dict
-                print('ERROR: The task <%s> is not in the task_dict of agent <%d> at edge <%d>.' % (str(task_id), agent_id, self.edge_id))
+                logger.error('The task <%s> is not in the task_dict of agent <%d> at edge <%d>.', task_id, agent_id, self.edge_id)
                 return False
         else:
             # Something wrong, agent was not in the agent_dict
-            print('ERROR: The agent <%d> is not in the agent_dict at edge <%d>.' % (agent_id, self.edge_id))
+            logger.error('The agent <%d> is not in the agent_dict at edge <%d>.', agent_id, self.edge_id)
             return False
 
     def is_agent_in_edge(self, agent_id):
@@ -155,15 +289,17 @@ class EDGE(object):
         """
         if agent_id in self.agent_dict:
             if self.agent_dict[agent_id].activate_task(task_id):
+                self._index_task(agent_id, task_id)
                 self._sync_agent_dict()
+                self._notify_state_changed(EDGE_EVENT_ACTIVATE, agent_id, task_id)
                 return True
             else:
-                print('ERROR: The agent <%d> with task <%s> is not activated at edge <%d>.' % (agent_id, str(task_id), self.edge_id))
+                logger.error('The agent <%d> with task <%s> is not activated at edge <%d>.', agent_id, task_id, self.edge_id)
                 return False
         else:
             # Something wrong
             # Something wrong, agent was not in the dict
-            print('ERROR: The agent <%d> is not in the agent_dict at edge <%d>.' % (agent_id, self.edge_id))
+            logger.error('The agent <%d> is not in the agent_dict at edge <%d>.', agent_id, self.edge_id)
             return False
 
     def deactivate_agent(self, agent_id, task_id=None):
@@ -172,17 +308,73 @@ class EDGE(object):
         """
         if agent_id in self.agent_dict:
             if self.agent_dict[agent_id].deactivate_task(task_id):
+                for task_id_i in self._get_affected_task_id_list(agent_id, task_id):
+                    self._index_task(agent_id, task_id_i)
                 self._sync_agent_dict()
+                self._notify_state_changed(EDGE_EVENT_DEACTIVATE, agent_id, task_id)
                 return True
             else:
-                print('ERROR: The agent <%d> with task <%s> is not de-activated at edge <%d>.' % (agent_id, str(task_id), self.edge_id))
+                logger.error('The agent <%d> with task <%s> is not de-activated at edge <%d>.', agent_id, task_id, self.edge_id)
                 return False
         else:
             # Something wrong
             # Something wrong, agent was not in the dict
-            print('ERROR: The agent <%d> is not in the agent_dict at edge <%d>.' % (agent_id, self.edge_id))
+            logger.error('The agent <%d> is not in the agent_dict at edge <%d>.', agent_id, self.edge_id)
             return False
 
+    def set_capacity_mode(self, capacity_mode):
+        """
+        Set the way of counting the occupied capacity in a time period
+        inputs
+            - capacity_mode: CAPACITY_MODE_INTERVAL or CAPACITY_MODE_PROFILE
+        outputs
+            - True/False
+        """
+        if not capacity_mode in (CAPACITY_MODE_INTERVAL, CAPACITY_MODE_PROFILE):
+            logger.error('Unknown capacity_mode <%s> at edge <%d>. The capacity_mode is not changed.', capacity_mode, self.edge_id)
+            return False
+        self.capacity_mode = capacity_mode
+        return True
+
+    def get_max_load_for_T_zone(self, T_zone_occ, only_count_activated_agent=False, agent_id=None):
+        """
+        Get the peak number of agents occupying the edge "at the same time" within
+        the given time period (unix stamp), by sweeping over the occupancy profile.
+        inputs
+            - T_zone_occ: a tuple of (min_pass_stamp, max_pass_stamp)
+            - only_count_activated_agent: required to only count the currently activated (running) agents
+            - agent_id (default: None): If agent_id is given, ignore this agent in this edge.
+        outputs
+            - The maximum concurrent load within the time zone
+        """
+        task_index = self.activated_task_index if only_count_activated_agent else self.task_index
+        T_a, T_b = task_index._normalize(T_zone_occ)
+        # Events clipped into the time zone, (stamp, 0:enter/1:leave, agent_id)
+        # Note: the entering events go first at the same stamp, since the periods are closed sets.
+        event_list = []
+        for T_min, T_max, (agent_id_i, task_id_i) in task_index.query_intervals(T_zone_occ):
+            if agent_id_i == agent_id:
+                continue
+            event_list.append( (max(T_min, T_a), 0, agent_id_i) )
+            event_list.append( (min(T_max, T_b), 1, agent_id_i) )
+        event_list.sort(key=lambda event: event[:2])
+        # Sweep, an agent with several overlapped tasks is counted once
+        agent_task_count = dict()
+        load = 0
+        max_load = 0
+        for stamp, is_leaving, agent_id_i in event_list:
+            if is_leaving:
+                agent_task_count[agent_id_i] -= 1
+                if agent_task_count[agent_id_i] == 0:
+                    load -= 1
+            else:
+                agent_task_count[agent_id_i] = agent_task_count.get(agent_id_i, 0) + 1
+                if agent_task_count[agent_id_i] == 1:
+                    load += 1
+                    if load > max_load:
+                        max_load = load
+        return max_load
+
     def get_remained_capacity_for_T_zone(self, T_zone_occ, only_count_activated_agent=False, agent_id=None):
         """
         Get the remained capacity of the edge at given time period (unix stamp)
@@ -193,15 +385,20 @@ class EDGE(object):
         outputs
             - The remained capacity at specific time zone
         """
-        # Go through all the agent, no matter the current one or future one
-        agent_count = 0
-        for agent_id_i in self.agent_dict:
+        if self.capacity_mode == CAPACITY_MODE_PROFILE:
+            # Only the agents at the same time count
+            return (self.capacity - self.get_max_load_for_T_zone(T_zone_occ, only_count_activated_agent, agent_id))
+        # else, every agent touching the time zone counts
+        # Only the tasks intersected with T_zone_occ are visited through the interval index
+        task_index = self.activated_task_index if only_count_activated_agent else self.task_index
+        if task_index.count(T_zone_occ) == 0:
+            return self.capacity
+        agent_id_set = set()
+        for agent_id_i, task_id_i in task_index.query(T_zone_occ):
             if agent_id_i == agent_id:
                 continue
-            if only_count_activated_agent and (not self.agent_dict[agent_id_i].is_activated):
-                continue # Pass this non-activated agent
-            agent_count += (1 if self.agent_dict[agent_id_i].is_period_intersected(T_zone_occ) else 0)
-        return (self.capacity - agent_count)
+            agent_id_set.add(agent_id_i)
+        return (self.capacity - len(agent_id_set))
 
     def is_available_for_T_zone(self, T_zone_occ, only_count_activated_agent=False, agent_id=None):
         """
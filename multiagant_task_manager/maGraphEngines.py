@@ -4,104 +4,194 @@ These function are graph engins apecifically for useing with
 the graph data structure defined by GEOMETRY_TASK_GRAPH
 and its following sub-class.
 """
-import Queue
+try:
+    import Queue
+except ImportError:
+    import queue as Queue # Python 3
+import heapq
 # import sys
+import maLogging as lg
+import maCSR as csr
+import maReservation as rs
+
+logger = lg.get_logger(__name__)
 
 
 # Kernel function for finding reachability
-def Explore(nid, adj, visited):
+def Explore(nid, adj, visited, target_id=None):
     """
-    Recursive function for depth-first search.
+    Iterative depth-first search.
+    The search stops as soon as target_id (if given) is visited.
     """
     visited[nid] = True
-    for to_nid, eid in adj[nid]:
-        if not visited[to_nid]:
-            Explore(to_nid, adj, visited)
+    stack = [nid]
+    while stack:
+        for to_nid, eid in adj[stack.pop()]:
+            if not visited[to_nid]:
+                visited[to_nid] = True
+                if to_nid == target_id:
+                    return
+                stack.append(to_nid)
     # the end
 
 # Kernel function for finding reachability
-def Explore_capacity(nid, adj, edges, visited, T_zone, only_count_activated_agent=False):
+def Explore_capacity(nid, adj, edges, visited, T_zone, only_count_activated_agent=False, target_id=None, edge_mask=None):
     """
-    Recursive function for depth-first search.
+    Iterative depth-first search through the edges available in T_zone.
+    The search stops as soon as target_id (if given) is visited.
+    If edge_mask is given, edge_mask[edge_id] is used as the availability instead.
     """
     visited[nid] = True
-    for to_nid, eid in adj[nid]:
-        if not visited[to_nid] and edges[eid].is_available_for_T_zone(T_zone, only_count_activated_agent):
-            Explore_capacity(to_nid, adj, edges, visited, T_zone, only_count_activated_agent)
+    stack = [nid]
+    while stack:
+        for to_nid, eid in adj[stack.pop()]:
+            if visited[to_nid]:
+                continue
+            if (edge_mask[eid] if not edge_mask is None else edges[eid].is_available_for_T_zone(T_zone, only_count_activated_agent)):
+                visited[to_nid] = True
+                if to_nid == target_id:
+                    return
+                stack.append(to_nid)
     # the end
 
 # Kernel function for finding connected components
 def Explore_cc(nid, adj, visited, cc, CCnum):
     """
-    Recursive function for depth-first search.
+    Iterative depth-first search.
     """
     visited[nid] = True
     CCnum[nid] = cc
-    for to_nid, eid in adj[nid]:
-        if not visited[to_nid]:
-            Explore_cc(to_nid, adj, visited, cc, CCnum)
+    stack = [nid]
+    while stack:
+        for to_nid, eid in adj[stack.pop()]:
+            if not visited[to_nid]:
+                visited[to_nid] = True
+                CCnum[to_nid] = cc
+                stack.append(to_nid)
     # the end
 
 # Kernel function for finding connected components
 def Explore_cc_capcity(nid, adj, edges, visited, cc, CCnum, T_zone, only_count_activated_agent=False):
     """
-    Recursive function for depth-first search.
+    Iterative depth-first search through the edges available in T_zone.
     """
     visited[nid] = True
     CCnum[nid] = cc
-    for to_nid, eid in adj[nid]:
-        if not visited[to_nid] and edges[eid].is_available_for_T_zone(T_zone, only_count_activated_agent):
-            Explore_cc_capcity(to_nid, adj, edges, visited, cc, CCnum, T_zone, only_count_activated_agent)
+    stack = [nid]
+    while stack:
+        for to_nid, eid in adj[stack.pop()]:
+            if not visited[to_nid] and edges[eid].is_available_for_T_zone(T_zone, only_count_activated_agent):
+                visited[to_nid] = True
+                CCnum[to_nid] = cc
+                stack.append(to_nid)
     # the end
 
 
+# Union-find
+#------------------------------------------------#
+class DISJOINT_SET(object):
+    """
+    Union-find of node_id, with union by size and path halving.
+    - parent: parent[node_id] is the parent in the tree of its set
+    - size: size[root] is the number of elements in the set
+    - num_sets: the number of disjoint sets
+    """
+    def __init__(self, num_elements):
+        self.parent = list(range(num_elements))
+        self.size = [1] * num_elements
+        self.num_sets = num_elements
+
+    @classmethod
+    def from_adj(cls, adj, edges=None, count_capacity=True, T_zone=(0,None), only_count_activated_agent=False, edge_mask=None):
+        """
+        Bulk build from the adjacent graph, each edge is treated as undirected.
+        If count_capacity, only the edges available in T_zone are united,
+        and the capacity of each edge is checked once.
+        If edge_mask is given, edge_mask[edge_id] is used as the availability instead.
+        """
+        disjoint_set = cls(len(adj))
+        is_available = dict() if edge_mask is None else edge_mask # {edge_id:True/False, ...}
+        for nid in range(len(adj)):
+            for to_nid, eid in adj[nid]:
+                if count_capacity:
+                    if edge_mask is None and not eid in is_available:
+                        is_available[eid] = edges[eid].is_available_for_T_zone(T_zone, only_count_activated_agent)
+                    if not is_available[eid]:
+                        continue
+                disjoint_set.union(nid, to_nid)
+        return disjoint_set
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
 
+    def union(self, x, y):
+        """
+        outputs
+            - True: two sets are merged
+              False: x and y are already in the same set
+        """
+        root_x = self.find(x)
+        root_y = self.find(y)
+        if root_x == root_y:
+            return False
+        if self.size[root_x] < self.size[root_y]:
+            root_x, root_y = root_y, root_x
+        self.parent[root_y] = root_x
+        self.size[root_x] += self.size[root_y]
+        self.num_sets -= 1
+        return True
 
+    def is_connected(self, x, y):
+        return (self.find(x) == self.find(y))
 
+    def add_element(self):
+        """
+        Append a new element (as a new set), outputs its id.
+        """
+        self.parent.append(len(self.parent))
+        self.size.append(1)
+        self.num_sets += 1
+        return (len(self.parent) - 1)
+#------------------------------------------------#
 
 
 #------------------------------------------------#
-def reachability(x, y, adj, edges=None, count_capacity=True, T_zone=(0,None), only_count_activated_agent=False):
+def reachability(x, y, adj, edges=None, count_capacity=True, T_zone=(0,None), only_count_activated_agent=False, edge_mask=None):
     """
     Finding the reachiability from node_id:x to node_id:y
+    The traversal stops as soon as y is reached.
+    If edge_mask is given (e.g. maColumnar.RESERVATION_COLUMNS.get_availability_mask()),
+    edge_mask[edge_id] is used as the availability of each edge in T_zone.
 
     Important: This method only consider the current
                (a specific time instant) topological state.
 
     """
-    visited = [False for _ in range(len(adj))]
+    visited = [False] * len(adj)
     if count_capacity:
-        Explore_capacity(x, adj, edges, visited, T_zone, only_count_activated_agent)
+        Explore_capacity(x, adj, edges, visited, T_zone, only_count_activated_agent, target_id=y, edge_mask=edge_mask)
     else:
         # Simply traverse through the topology of graph,
         # not counting capacity of edges
-        Explore(x, adj, visited)
+        Explore(x, adj, visited, target_id=y)
     return visited[y]
 
-def number_of_connected_components(adj, edges=None, count_capacity=True, T_zone=(0,None), only_count_activated_agent=False):
+def number_of_connected_components(adj, edges=None, count_capacity=True, T_zone=(0,None), only_count_activated_agent=False, edge_mask=None):
     """
     Find the total number of connected components
+    by union-find, where the directed edges are treated as undirected
+    (i.e. the weakly connected components).
+    If edge_mask is given, edge_mask[edge_id] is used as the availability of each edge in T_zone.
 
     Important: This method only consider the current
                (a specific time instant) topological state.
 
     """
-    visited = [False for _ in range(len(adj))]
-    CCnum =   [0 for _ in range(len(adj))]
-    cc = 1
-    if count_capacity:
-        for nid in range(len(adj)):
-            if not visited[nid]:
-                Explore_cc_capcity(nid, adj, edges, visited, cc, CCnum, T_zone, only_count_activated_agent)
-                cc += 1
-    else:
-        # Simply traverse through the topology of graph,
-        # not counting capacity of edges
-        for nid in range(len(adj)):
-            if not visited[nid]:
-                Explore_cc(nid, adj, visited, cc, CCnum)
-                cc += 1
-    return (cc-1)
+    return DISJOINT_SET.from_adj(adj, edges, count_capacity, T_zone, only_count_activated_agent, edge_mask).num_sets
 
 
 # Graph traversal
@@ -138,7 +228,7 @@ def get_path(prev, last_nid, is_reversing_path=True):
 
 
 
-def dijkstras(adj, edges, T_zone_start, start_id, end_id, top_priority_for_activated_agent=False, agent_id=None):
+def dijkstras(adj, edges, T_zone_start, start_id, end_id, top_priority_for_activated_agent=False, agent_id=None, reservation_table=None):
     """
     This method ues dijkstra alogorithm to find out the best path
     or find out that there is no path at all.
@@ -156,6 +246,8 @@ def dijkstras(adj, edges, T_zone_start, start_id, end_id, top_priority_for_activ
         - end_id
         - top_priority_for_activated_agent
         - agent_id (default: None): If agent_id is given, ignore this agent in this edge.
+        - reservation_table (default: None): maReservation.RESERVATION_TABLE, if given, the nodes reserved by other agents
+                                             at the arrival time zone are not entered.
 
     outputs
         - path/None: a sequence (list) of node_id from start_id to end_id
@@ -220,15 +312,13 @@ def dijkstras(adj, edges, T_zone_start, start_id, end_id, top_priority_for_activ
                     weight_uv = edges[eid].duration[id_opt_target] # Minimize the total duration with specified id_opt_target
                 #
                 if dist[nid_v] > (dist[nid_u] + weight_uv):
+                    T_v_tmp = edges[eid].get_T_zone_end_from_start(T_zone_nodes[nid_u])
+                    if (not reservation_table is None) and (not reservation_table.is_node_free(nid_v, T_v_tmp, agent_id)):
+                        # The node is reserved by other agents at that time
+                        continue
                     dist[nid_v] = (dist[nid_u] + weight_uv)
-                    T_zone_nodes[nid_v] = edges[eid].get_T_zone_end_from_start(T_zone_nodes[nid_u]) # Update time_zone of the node
+                    T_zone_nodes[nid_v] = T_v_tmp # Update time_zone of the node
                     prev[nid_v] = nid_u
-                    """
-                    print("update (u, v) = (%d, %d)" % (nid_u, nid_v))
-                    print("dist = " + str(dist))
-                    print("prev = " + str(prev))
-                    print("\n")
-                    """
                     heap.put_nowait( (dist[nid_v], nid_v) )
             #
         # end for
@@ -245,32 +335,29 @@ def dijkstras(adj, edges, T_zone_start, start_id, end_id, top_priority_for_activ
     except:
         delta_T_max = None
     #
-    print("\n")
-    print("INFO: Dijkstra finished")
-    print("INFO: Distance from start_id <%d> to end_id <%d> = %s" % (start_id, end_id, (str(delta_T_max) if not delta_T_max is None else "None" ) ) )
-    print("dist = " + str(dist))
-    print("prev = " + str(prev))
-    print("T_zone_nodes[end_id] = " + str(T_zone_nodes[end_id]))
+    logger.info("Dijkstra finished")
+    logger.info("Distance from start_id <%d> to end_id <%d> = %s", start_id, end_id, (delta_T_max if not delta_T_max is None else "None" ))
+    logger.debug("dist = %s", dist)
+    logger.debug("prev = %s", prev)
+    logger.debug("T_zone_nodes[end_id] = %s", T_zone_nodes[end_id])
     #
 
     # Generate the path
     if (dist[end_id] is None) or (dist[end_id] == max_value):
         # The end_id is not reachable from start_id
         # in the sense of "valid" edge traversal
-        print('INFO: The end_id is not reachable from start_id in the sense of "valid" edge traversal.')
+        logger.info('The end_id is not reachable from start_id in the sense of "valid" edge traversal.')
         return None
 
     # If the goal is reachable
     path = get_path(prev, end_id, is_reversing_path=True)
     if path[0] != start_id:
-        print("ERROR: path[0] != start_id, something wrong in dijkstra.")
+        logger.error("path[0] != start_id, something wrong in dijkstra.")
     else:
         # print("INFO: The path generated correctly in dijkstra.")
         pass
 
-    # test
-    print("path = " + str(path) )
-    print("\n")
+    logger.debug("path = %s", path)
     #
     return path
 #--------------------------------#
@@ -283,6 +370,8 @@ def generate_reverse_graph(adj):
     outputs
         - adj_reversed: a reversed version of adj (All directed edges will be reversed.)
     """
+    if isinstance(adj, csr.CSR_GRAPH):
+        return adj.get_reversed()
     adj_reversed = [[] for _ in range(len(adj))]
     for nid_u in range(len(adj)):
         for nid_v, eid_uv in adj[nid_u]:
@@ -290,7 +379,7 @@ def generate_reverse_graph(adj):
     #
     return adj_reversed
 
-def dijkstras_backtrack(adj_in, edges, T_zone_end, start_id, end_id, top_priority_for_activated_agent=False, agent_id=None):
+def dijkstras_backtrack(adj_in, edges, T_zone_end, start_id, end_id, top_priority_for_activated_agent=False, agent_id=None, adj_reversed=None, reservation_table=None):
     """
     This method ues dijkstra alogorithm to find out the best path
     or find out that there is no path at all.
@@ -308,13 +397,17 @@ def dijkstras_backtrack(adj_in, edges, T_zone_end, start_id, end_id, top_priorit
         - end_id
         - top_priority_for_activated_agent
         - agent_id (default: None): If agent_id is given, ignore this agent in this edge.
+        - adj_reversed (default: None): The reversed graph of adj if it's maintained by the caller,
+                                        "None" means generating it with generate_reverse_graph().
+        - reservation_table (default: None): maReservation.RESERVATION_TABLE, if given, the nodes reserved by other agents
+                                             at the arrival time zone are not entered.
 
     outputs
         - path/None: a sequence (list) of node_id from start_id to end_id
                      or "None" means no valid path
     """
     # Get a reversed graph
-    adj = generate_reverse_graph(adj_in)
+    adj = generate_reverse_graph(adj_in) if adj_reversed is None else adj_reversed
 
     # Decide that if we only see the activated agent!!
     only_count_activated_agent = top_priority_for_activated_agent
@@ -379,15 +472,12 @@ def dijkstras_backtrack(adj_in, edges, T_zone_end, start_id, end_id, top_priorit
                     weight_uv = edges[eid].duration[id_opt_target] # Minimize the total duration with specified id_opt_target
                 #
                 if dist[nid_v] > (dist[nid_u] + weight_uv):
+                    if (not reservation_table is None) and (not reservation_table.is_node_free(nid_v, T_v_tmp, agent_id)):
+                        # The node is reserved by other agents at that time
+                        continue
                     dist[nid_v] = (dist[nid_u] + weight_uv)
                     T_zone_nodes[nid_v] = T_v_tmp # Update time_zone of the node
                     prev[nid_v] = nid_u
-                    """
-                    print("update (u, v) = (%d, %d)" % (nid_u, nid_v))
-                    print("dist = " + str(dist))
-                    print("prev = " + str(prev))
-                    print("\n")
-                    """
                     heap.put_nowait( (dist[nid_v], nid_v) )
             #
         # end for
@@ -405,33 +495,848 @@ def dijkstras_backtrack(adj_in, edges, T_zone_end, start_id, end_id, top_priorit
     except:
         delta_T_max = None
     #
-    print("\n")
-    print("INFO: Dijkstra (backtrack) finished")
-    print("INFO: Distance from start_id <%d> to end_id <%d> = %s" % (start_id, end_id, (str(delta_T_max) if not delta_T_max is None else "None" ) ) )
-    print("dist = " + str(dist))
-    print("prev = " + str(prev))
-    print("T_zone_nodes[start_id] = " + str(T_zone_nodes[start_id]))
+    logger.info("Dijkstra (backtrack) finished")
+    logger.info("Distance from start_id <%d> to end_id <%d> = %s", start_id, end_id, (delta_T_max if not delta_T_max is None else "None" ))
+    logger.debug("dist = %s", dist)
+    logger.debug("prev = %s", prev)
+    logger.debug("T_zone_nodes[start_id] = %s", T_zone_nodes[start_id])
     #
 
     # Generate the path
     if (dist[start_id] is None) or (dist[start_id] == max_value):
         # The end_id is not reachable from start_id
         # in the sense of "valid" edge traversal
-        print('INFO: The start_id is not reachable from end_id in the sense of "valid" edge backward traversal.')
+        logger.info('The start_id is not reachable from end_id in the sense of "valid" edge backward traversal.')
         return None
 
     # If the goal is reachable
     path = get_path(prev, start_id, is_reversing_path=False)
     # No need to reverse the path
     if path[-1] != end_id:
-        print("ERROR: path[-1] != end_id, something wrong in dijkstra.")
+        logger.error("path[-1] != end_id, something wrong in dijkstra.")
     else:
         # print("INFO: The path generated correctly in dijkstra.")
         pass
 
-    # test
-    print("path = " + str(path) )
-    print("\n")
+    logger.debug("path = %s", path)
     #
     return path
 #--------------------------------------#
+
+
+# heapq-based search engine
+#--------------------------------------#
+def _dijkstras_heapq_kernel(adj, edges, T_zone_source, source_id, target_id=None, only_count_activated_agent=False, agent_id=None, is_backtrack=False, heuristic=None, reservation_table=None, touched_edge_set=None):
+    """
+    The kernel of the heapq-based dijkstra (and A*).
+    Only the source node is pushed into the heap at the beginning,
+    the out-dated entries are skipped when popped (lazy deletion),
+    and the search stops as soon as the target_id is settled.
+
+    inputs
+        - adj: adjacent graph (the reversed one if is_backtrack), or its csr.CSR_GRAPH view
+        - edges
+        - T_zone_source = (T_min, T_max) at source_id
+        - source_id
+        - target_id (default: None): "None" means searching the whole graph
+        - only_count_activated_agent
+        - agent_id (default: None): If agent_id is given, ignore this agent in this edge.
+        - is_backtrack (default: False): If True, traverse the edges inversely (from end to start)
+        - heuristic (default: None): a list of lower bounds of the remaining duration_max
+                                     from each node to target_id, "None" means dijkstra (all zeros).
+                                     It should be consistent, e.g. the static shortest distance.
+        - reservation_table (default: None): maReservation.RESERVATION_TABLE, if given, the nodes reserved by other agents
+                                             at the arrival time zone are not entered.
+        - touched_edge_set (default: None): If a set is given, the edge_id of all the edges whose states
+                                            were checked are added into it, i.e. the result depends only on them.
+
+    outputs
+        - (dist, prev, T_zone_nodes)
+    """
+    max_value = float('inf')
+    num_nodes = len(adj)
+    # The weights are read from the contiguous array of a CSR view
+    if isinstance(adj, csr.CSR_GRAPH):
+        offsets, targets, edge_ids, duration_max = adj.offsets, adj.targets, adj.edge_ids, adj.duration_max
+    else:
+        offsets, targets, edge_ids, duration_max = None, None, None, None
+
+    # Initialize the dist and prev
+    dist = [max_value] * num_nodes
+    prev = [None] * num_nodes
+    T_zone_nodes = [(max_value, max_value)] * num_nodes
+    settled = [False] * num_nodes
+    #
+    dist[source_id] = 0
+    T_zone_nodes[source_id] = T_zone_source
+    heap = [(0, source_id)]
+
+    # Iteration
+    while heap:
+        # With a consistent heuristic, the first popped entry of a node carries its final dist.
+        nid_u = heapq.heappop(heap)[1]
+        if settled[nid_u]:
+            # Out-dated entry
+            continue
+        settled[nid_u] = True
+        if nid_u == target_id:
+            break
+        dist_u = dist[nid_u]
+        T_zone_u = T_zone_nodes[nid_u]
+        if offsets is None:
+            neighbor_list = adj[nid_u]
+        else:
+            # Read the CSR arrays in place
+            begin, end = offsets[nid_u], offsets[nid_u + 1]
+            neighbor_list = zip(targets[begin:end], edge_ids[begin:end])
+        for nid_v, eid in neighbor_list:
+            if settled[nid_v]:
+                continue
+            # Relax, minimize the total duration_max
+            if duration_max is None:
+                dist_v = dist_u + edges[eid].duration[1]
+            else:
+                dist_v = dist_u + duration_max[eid]
+            if not dist_v < dist[nid_v]:
+                continue
+            if heuristic is None:
+                f_v = dist_v
+            else:
+                f_v = dist_v + heuristic[nid_v]
+                if f_v == max_value:
+                    # The target is not reachable from nid_v at all
+                    continue
+            # Check if the edge is "valid"
+            edge = edges[eid]
+            if not touched_edge_set is None:
+                touched_edge_set.add(eid)
+            if is_backtrack:
+                if not edge.is_possible_to_pass_backtrack(T_zone_u, only_count_activated_agent, agent_id):
+                    continue
+                T_zone_v = edge.get_T_zone_start_from_end(T_zone_u)
+                if T_zone_v[1] < T_zone_v[0]:
+                    # This edge is closed, unable to be backtracked
+                    continue
+            else:
+                if not edge.is_possible_to_pass(T_zone_u, only_count_activated_agent, agent_id):
+                    continue
+                T_zone_v = edge.get_T_zone_end_from_start(T_zone_u)
+            if (not reservation_table is None) and (not reservation_table.is_node_free(nid_v, T_zone_v, agent_id)):
+                # The node is reserved by other agents at that time
+                continue
+            dist[nid_v] = dist_v
+            T_zone_nodes[nid_v] = T_zone_v
+            prev[nid_v] = nid_u
+            heapq.heappush(heap, (f_v, nid_v))
+    # end while
+    return (dist, prev, T_zone_nodes)
+
+def _get_path_from_search(dist, prev, start_id, end_id, is_backtrack, engine_name):
+    """
+    This utility function generate the path from the result of the kernel.
+    outputs
+        - path/None
+    """
+    last_nid = start_id if is_backtrack else end_id
+    logger.info("%s finished", engine_name)
+    logger.info("Distance from start_id <%d> to end_id <%d> = %s", start_id, end_id, dist[last_nid])
+    if dist[last_nid] == float('inf'):
+        # The end_id is not reachable from start_id
+        # in the sense of "valid" edge traversal
+        if is_backtrack:
+            logger.info('The start_id is not reachable from end_id in the sense of "valid" edge backward traversal.')
+        else:
+            logger.info('The end_id is not reachable from start_id in the sense of "valid" edge traversal.')
+        return None
+    # If the goal is reachable, no need to reverse the path for backtracking
+    path = get_path(prev, last_nid, is_reversing_path=(not is_backtrack))
+    if is_backtrack and path[-1] != end_id:
+        logger.error("path[-1] != end_id, something wrong in dijkstra.")
+    elif (not is_backtrack) and path[0] != start_id:
+        logger.error("path[0] != start_id, something wrong in dijkstra.")
+    logger.debug("path = %s", path)
+    return path
+
+def dijkstras_heapq(adj, edges, T_zone_start, start_id, end_id, top_priority_for_activated_agent=False, agent_id=None, reservation_table=None, touched_edge_set=None):
+    """
+    The same as dijkstras(), but implemented with heapq, lazy deletion and early exit.
+
+    inputs
+        - adj: adjacent graph
+        - T_zone_start = (T_min, T_max)
+        - start_id
+        - end_id
+        - top_priority_for_activated_agent
+        - agent_id (default: None): If agent_id is given, ignore this agent in this edge.
+        - reservation_table (default: None): maReservation.RESERVATION_TABLE, if given, the nodes reserved by other agents
+                                             at the arrival time zone are not entered.
+        - touched_edge_set (default: None): If a set is given, the edges whose states were checked are added into it.
+
+    outputs
+        - path/None: a sequence (list) of node_id from start_id to end_id
+                     or "None" means no valid path
+    """
+    dist, prev, T_zone_nodes = _dijkstras_heapq_kernel(adj, edges, T_zone_start, start_id, end_id, top_priority_for_activated_agent, agent_id, is_backtrack=False, reservation_table=reservation_table, touched_edge_set=touched_edge_set)
+    return _get_path_from_search(dist, prev, start_id, end_id, False, "Dijkstra (heapq)")
+
+def dijkstras_backtrack_heapq(adj_in, edges, T_zone_end, start_id, end_id, top_priority_for_activated_agent=False, agent_id=None, adj_reversed=None, reservation_table=None, touched_edge_set=None):
+    """
+    The same as dijkstras_backtrack(), but implemented with heapq, lazy deletion and early exit.
+
+    inputs
+        - adj: original adjacent graph
+        - T_zone_end = (T_min, T_max)
+        - start_id
+        - end_id
+        - top_priority_for_activated_agent
+        - agent_id (default: None): If agent_id is given, ignore this agent in this edge.
+        - adj_reversed (default: None): The reversed graph of adj if it's maintained by the caller,
+                                        "None" means generating it with generate_reverse_graph().
+        - reservation_table (default: None): maReservation.RESERVATION_TABLE, if given, the nodes reserved by other agents
+                                             at the arrival time zone are not entered.
+        - touched_edge_set (default: None): If a set is given, the edges whose states were checked are added into it.
+
+    outputs
+        - path/None: a sequence (list) of node_id from start_id to end_id
+                     or "None" means no valid path
+    """
+    # Get a reversed graph
+    adj = generate_reverse_graph(adj_in) if adj_reversed is None else adj_reversed
+    dist, prev, T_zone_nodes = _dijkstras_heapq_kernel(adj, edges, T_zone_end, end_id, start_id, top_priority_for_activated_agent, agent_id, is_backtrack=True, reservation_table=reservation_table, touched_edge_set=touched_edge_set)
+    return _get_path_from_search(dist, prev, start_id, end_id, True, "Dijkstra (heapq, backtrack)")
+
+class SEARCH_RESULT(object):
+    """
+    The reusable result of a single-source search.
+    - source_id: start_id (or end_id if is_backtrack)
+    - T_zone_source: the T_zone at source_id
+    - is_backtrack (bool): If the search traversed the edges inversely
+    - dist: dist[node_id] is the total duration_max between source_id and node_id, float('inf') means not reachable
+    - prev: parent list, for generating the paths
+    - T_zone_nodes: T_zone_nodes[node_id] is the (T_min, T_max) at node_id
+    """
+    def __init__(self, source_id, T_zone_source, dist, prev, T_zone_nodes, is_backtrack=False):
+        self.source_id = source_id
+        self.T_zone_source = T_zone_source
+        self.dist = dist
+        self.prev = prev
+        self.T_zone_nodes = T_zone_nodes
+        self.is_backtrack = is_backtrack
+
+    def is_reachable(self, node_id):
+        return (self.dist[node_id] != float('inf'))
+
+    def get_distance(self, node_id):
+        """
+        The total duration_max between source_id and node_id, float('inf') means not reachable.
+        """
+        return self.dist[node_id]
+
+    def get_T_zone(self, node_id):
+        """
+        The T_zone at node_id, "None" means not reachable.
+        """
+        if not self.is_reachable(node_id):
+            return None
+        return self.T_zone_nodes[node_id]
+
+    def get_path(self, node_id):
+        """
+        The path from source_id to node_id (or from node_id to source_id if is_backtrack),
+        "None" means not reachable.
+        """
+        if not self.is_reachable(node_id):
+            return None
+        return get_path(self.prev, node_id, is_reversing_path=(not self.is_backtrack))
+
+def dijkstras_single_source(adj, edges, T_zone_start, start_id, top_priority_for_activated_agent=False, agent_id=None, reservation_table=None):
+    """
+    One-to-many search: the same optimization problem as dijkstras(),
+    but the whole graph is searched, so the paths to all the nodes come out of one pass.
+
+    inputs
+        - adj: adjacent graph
+        - T_zone_start = (T_min, T_max)
+        - start_id
+        - top_priority_for_activated_agent
+        - agent_id (default: None): If agent_id is given, ignore this agent in this edge.
+        - reservation_table (default: None): maReservation.RESERVATION_TABLE, if given, the nodes reserved by other agents
+                                             at the arrival time zone are not entered.
+
+    outputs
+        - SEARCH_RESULT
+    """
+    dist, prev, T_zone_nodes = _dijkstras_heapq_kernel(adj, edges, T_zone_start, start_id, None, top_priority_for_activated_agent, agent_id, is_backtrack=False, reservation_table=reservation_table)
+    return SEARCH_RESULT(start_id, T_zone_start, dist, prev, T_zone_nodes, is_backtrack=False)
+#--------------------------------------#
+
+# Distance tables
+#--------------------------------------#
+# The graph shared with the worker processes of distance_matrix()
+_worker_graph = None
+
+def _init_distance_matrix_worker(adj, edges):
+    global _worker_graph
+    _worker_graph = (adj, edges)
+
+def _distance_matrix_row(args):
+    """
+    Calculate one row of distance_matrix() in a worker process.
+    """
+    T_zone_start, start_id, target_list, top_priority_for_activated_agent, agent_id = args
+    adj, edges = _worker_graph
+    return _get_distance_row(dijkstras_single_source(adj, edges, T_zone_start, start_id, top_priority_for_activated_agent, agent_id), target_list)
+
+def _get_distance_row(search_result, target_list):
+    return ([search_result.get_distance(nid) for nid in target_list], [search_result.get_T_zone(nid) for nid in target_list])
+
+def distance_matrix(adj, edges, source_list, target_list, top_priority_for_activated_agent=False, agent_id=None, num_workers=None):
+    """
+    Many-to-many table: one single-source search per source, none per pair.
+
+    inputs
+        - adj: adjacent graph
+        - source_list: a list of (T_zone_start, start_id)
+        - target_list: a list of node_id
+        - top_priority_for_activated_agent
+        - agent_id (default: None): If agent_id is given, ignore this agent in this edge.
+        - num_workers (default: None): If larger than 1, the rows are calculated by a pool of processes
+
+    outputs
+        - dist_matrix: dist_matrix[i][j] is the total duration_max from source i to target j,
+                       float('inf') means not reachable
+        - T_zone_matrix: T_zone_matrix[i][j] is the T_zone at target j from source i, "None" means not reachable
+    """
+    if num_workers is None or num_workers <= 1 or len(source_list) <= 1:
+        row_list = [_get_distance_row(dijkstras_single_source(adj, edges, T_zone_start, start_id, top_priority_for_activated_agent, agent_id), target_list) for T_zone_start, start_id in source_list]
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(num_workers, _init_distance_matrix_worker, (adj, edges))
+        try:
+            row_list = pool.map(_distance_matrix_row, [(T_zone_start, start_id, target_list, top_priority_for_activated_agent, agent_id) for T_zone_start, start_id in source_list])
+        finally:
+            pool.close()
+            pool.join()
+    dist_matrix = [row[0] for row in row_list]
+    T_zone_matrix = [row[1] for row in row_list]
+    return (dist_matrix, T_zone_matrix)
+#--------------------------------------#
+
+# A* search
+#--------------------------------------#
+def dijkstras_static(adj, edges, source_id):
+    """
+    The shortest duration_max from source_id to every node,
+    considering only the topology (no capacity, no time zone).
+
+    Since the capacity constraints only remove edges, this is a lower bound
+    (and a consistent heuristic) for the searches with capacity.
+    Pass the reversed adjacent graph to get the distances "to" source_id.
+
+    outputs
+        - dist: a list of distances, float('inf') means not reachable
+    """
+    max_value = float('inf')
+    dist = [max_value] * len(adj)
+    dist[source_id] = 0
+    heap = [(0, source_id)]
+    if isinstance(adj, csr.CSR_GRAPH):
+        # Read the CSR arrays in place
+        offsets, targets, edge_ids, weight_list = adj.offsets, adj.targets, adj.edge_ids, adj.duration_max
+        while heap:
+            dist_u, nid_u = heapq.heappop(heap)
+            if dist_u != dist[nid_u]:
+                # Out-dated entry
+                continue
+            for k in range(offsets[nid_u], offsets[nid_u + 1]):
+                nid_v = targets[k]
+                dist_v = dist_u + weight_list[edge_ids[k]]
+                if dist_v < dist[nid_v]:
+                    dist[nid_v] = dist_v
+                    heapq.heappush(heap, (dist_v, nid_v))
+        return dist
+    weight_list = [edge.duration[1] for edge in edges]
+    while heap:
+        dist_u, nid_u = heapq.heappop(heap)
+        if dist_u != dist[nid_u]:
+            # Out-dated entry
+            continue
+        for nid_v, eid in adj[nid_u]:
+            dist_v = dist_u + weight_list[eid]
+            if dist_v < dist[nid_v]:
+                dist[nid_v] = dist_v
+                heapq.heappush(heap, (dist_v, nid_v))
+    return dist
+
+def astar(adj, edges, T_zone_start, start_id, end_id, top_priority_for_activated_agent=False, agent_id=None, heuristic=None, adj_reversed=None, reservation_table=None, touched_edge_set=None):
+    """
+    A* search toward end_id, the result is the same as dijkstras()
+    but much less nodes are settled.
+
+    inputs
+        - adj: adjacent graph
+        - T_zone_start = (T_min, T_max)
+        - start_id
+        - end_id
+        - top_priority_for_activated_agent
+        - agent_id (default: None): If agent_id is given, ignore this agent in this edge.
+        - heuristic (default: None): lower bounds of the remaining duration_max to end_id of each node,
+                                     "None" means calculating it by dijkstras_static() on the reversed graph.
+        - adj_reversed (default: None): The reversed graph of adj if it's maintained by the caller,
+                                        "None" means generating it with generate_reverse_graph().
+        - reservation_table (default: None): maReservation.RESERVATION_TABLE, if given, the nodes reserved by other agents
+                                             at the arrival time zone are not entered.
+        - touched_edge_set (default: None): If a set is given, the edges whose states were checked are added into it.
+
+    outputs
+        - path/None: a sequence (list) of node_id from start_id to end_id
+                     or "None" means no valid path
+    """
+    if heuristic is None:
+        if adj_reversed is None:
+            adj_reversed = generate_reverse_graph(adj)
+        heuristic = dijkstras_static(adj_reversed, edges, end_id)
+    dist, prev, T_zone_nodes = _dijkstras_heapq_kernel(adj, edges, T_zone_start, start_id, end_id, top_priority_for_activated_agent, agent_id, is_backtrack=False, heuristic=heuristic, reservation_table=reservation_table, touched_edge_set=touched_edge_set)
+    return _get_path_from_search(dist, prev, start_id, end_id, False, "A*")
+
+def astar_backtrack(adj_in, edges, T_zone_end, start_id, end_id, top_priority_for_activated_agent=False, agent_id=None, heuristic=None, adj_reversed=None, reservation_table=None, touched_edge_set=None):
+    """
+    A* search backward from end_id toward start_id, the result is the same as dijkstras_backtrack().
+
+    inputs
+        - adj: original adjacent graph
+        - T_zone_end = (T_min, T_max)
+        - start_id
+        - end_id
+        - top_priority_for_activated_agent
+        - agent_id (default: None): If agent_id is given, ignore this agent in this edge.
+        - heuristic (default: None): lower bounds of the duration_max from start_id to each node,
+                                     "None" means calculating it by dijkstras_static() on the original graph.
+        - adj_reversed (default: None): The reversed graph of adj if it's maintained by the caller,
+                                        "None" means generating it with generate_reverse_graph().
+        - reservation_table (default: None): maReservation.RESERVATION_TABLE, if given, the nodes reserved by other agents
+                                             at the arrival time zone are not entered.
+        - touched_edge_set (default: None): If a set is given, the edges whose states were checked are added into it.
+
+    outputs
+        - path/None: a sequence (list) of node_id from start_id to end_id
+                     or "None" means no valid path
+    """
+    if heuristic is None:
+        heuristic = dijkstras_static(adj_in, edges, start_id)
+    adj = generate_reverse_graph(adj_in) if adj_reversed is None else adj_reversed
+    dist, prev, T_zone_nodes = _dijkstras_heapq_kernel(adj, edges, T_zone_end, end_id, start_id, top_priority_for_activated_agent, agent_id, is_backtrack=True, heuristic=heuristic, reservation_table=reservation_table, touched_edge_set=touched_edge_set)
+    return _get_path_from_search(dist, prev, start_id, end_id, True, "A* (backtrack)")
+#--------------------------------------#
+
+# Cooperative search in (node, time) space
+#--------------------------------------#
+def _is_constrained(constraint_dict, kind, resource_id, T_zone):
+    """
+    If a constraint of whca_star() on the resource intersects T_zone.
+    """
+    for T_zone_c in constraint_dict.get((kind, resource_id), ()):
+        if T_zone_c[0] <= T_zone[1] and T_zone[0] <= T_zone_c[1]:
+            return True
+    return False
+
+def _whca_star_window(adj, edges, T_zone_source, source_id, end_id, g_source, g_limit, heuristic, only_count_activated_agent=False, agent_id=None, reservation_table=None, wait_step=1, max_num_expansions=None, used_edge_dict=None, constraint_dict=None):
+    """
+    One window of whca_star(): A* over the states (node_id, g), where g is the elapsed duration_max
+    (including the waits) since the start of whca_star(). From each state, the agent either passes
+    a "valid" edge or waits at the node for wait_step.
+    An edge may be passed again (e.g. stepping aside into a bay and back), but the booking reserves one T_zone
+    per edge covering all the passes (see GEOMETRY_TASK_GRAPH._plan_agent_by_path()), so the merged T_zone
+    is checked instead. Each state carries the edges passed on the way to it (the first path found to the state).
+    The window ends as soon as end_id or a state with g >= g_limit is settled.
+
+    inputs
+        - used_edge_dict (default: None): {edge_id:T_min, ...} the edges passed before this window,
+                                          with the start of the first pass
+        - constraint_dict (default: None): see whca_star()
+
+    outputs
+        - (state_list, is_reaching_end)/None: state_list is a list of (node_id, g, T_zone, is_wait, edge_id)
+                                             from the source to the last settled state (edge_id is "None" for the waits and the source),
+                                             "None" means the agent is blocked in this window
+    """
+    max_value = float('inf')
+    source_key = (source_id, g_source)
+    T_zone_dict = {source_key:T_zone_source} # The T_zone of the found states
+    parent_dict = {source_key:None} # Elements are {key:(parent_key, is_wait, edge_id), ...}
+    # The edges passed on the way to each state, shared with the parent unless a new edge is passed
+    used_dict = {source_key:(dict() if used_edge_dict is None else dict(used_edge_dict))}
+    closed = set()
+    seq = 0 # For breaking ties in FIFO order
+    heap = [(g_source + heuristic[source_id], -g_source, seq, source_key)]
+    num_expansions = 0
+    while heap:
+        # Among the same f, the deeper one first
+        key_u = heapq.heappop(heap)[3]
+        if key_u in closed:
+            continue
+        closed.add(key_u)
+        nid_u, g_u = key_u
+        if nid_u == end_id or g_u >= g_limit:
+            # Generate the states from the source
+            state_list = []
+            key = key_u
+            while not key is None:
+                parent = parent_dict[key]
+                state_list.append( (key[0], key[1], T_zone_dict[key], (False if parent is None else parent[1]), (None if parent is None else parent[2])) )
+                key = None if parent is None else parent[0]
+            state_list.reverse()
+            return (state_list, (nid_u == end_id))
+        num_expansions += 1
+        if (not max_num_expansions is None) and num_expansions > max_num_expansions:
+            logger.warning('The number of expansions exceeds %d in a window of whca_star().', max_num_expansions)
+            return None
+        T_zone_u = T_zone_dict[key_u]
+        used_edge_dict_u = used_dict[key_u]
+        # Pass an edge
+        for nid_v, eid in adj[nid_u]:
+            edge = edges[eid]
+            g_v = g_u + edge.duration[1]
+            key_v = (nid_v, g_v)
+            if key_v in T_zone_dict:
+                # The same state, no better g
+                continue
+            if heuristic[nid_v] == max_value:
+                continue
+            T_zone_occ = edge.get_T_zone_occ_from_start(T_zone_u)
+            if eid in used_edge_dict_u:
+                # Passed already, occupied from the first pass
+                T_zone_occ = (used_edge_dict_u[eid], T_zone_occ[1])
+                if not edge.is_available_for_T_zone(T_zone_occ, only_count_activated_agent, agent_id):
+                    continue
+            elif not edge.is_possible_to_pass(T_zone_u, only_count_activated_agent, agent_id):
+                continue
+            if constraint_dict and _is_constrained(constraint_dict, rs.RESOURCE_EDGE, eid, T_zone_occ):
+                continue
+            T_zone_v = edge.get_T_zone_end_from_start(T_zone_u)
+            if (not reservation_table is None) and (not reservation_table.is_node_free(nid_v, T_zone_v, agent_id)):
+                continue
+            if constraint_dict and _is_constrained(constraint_dict, rs.RESOURCE_NODE, nid_v, T_zone_v):
+                continue
+            T_zone_dict[key_v] = T_zone_v
+            parent_dict[key_v] = (key_u, False, eid)
+            if eid in used_edge_dict_u:
+                used_dict[key_v] = used_edge_dict_u
+            else:
+                used_dict[key_v] = dict(used_edge_dict_u)
+                used_dict[key_v][eid] = T_zone_occ[0]
+            seq += 1
+            heapq.heappush(heap, (g_v + heuristic[nid_v], -g_v, seq, key_v))
+        # Wait at the node
+        g_v = g_u + wait_step
+        key_v = (nid_u, g_v)
+        if key_v in T_zone_dict:
+            continue
+        if (not reservation_table is None) and (not reservation_table.is_node_free(nid_u, (T_zone_u[0], T_zone_u[1] + wait_step), agent_id)):
+            continue
+        if constraint_dict and _is_constrained(constraint_dict, rs.RESOURCE_NODE, nid_u, (T_zone_u[0], T_zone_u[1] + wait_step)):
+            continue
+        T_zone_dict[key_v] = (T_zone_u[0] + wait_step, T_zone_u[1] + wait_step)
+        parent_dict[key_v] = (key_u, True, None)
+        used_dict[key_v] = used_edge_dict_u
+        seq += 1
+        heapq.heappush(heap, (g_v + heuristic[nid_u], -g_v, seq, key_v))
+    # end while
+    return None
+
+def whca_star(adj, edges, T_zone_start, start_id, end_id, top_priority_for_activated_agent=False, agent_id=None, heuristic=None, adj_reversed=None, reservation_table=None, window=10, wait_step=1, max_num_windows=32, max_num_expansions=None, constraint_dict=None):
+    """
+    Windowed cooperative A* (WHCA*): search in (node, time) space with wait moves.
+    The reservations (the edge capacities and the node reservations) are respected
+    in a window of "window" duration at a time, guided by the static lower bounds beyond the window;
+    the windows are rolled from the end of the previous one until end_id is reached.
+    Used one agent at a time in priority order (see GEOMETRY_TASK_GRAPH.book_paths_prioritized()),
+    each agent sees the reservations of the agents planned before.
+    An edge passed more than once is checked over the T_zone covering all the passes (see _whca_star_window()).
+
+    inputs
+        - adj: adjacent graph
+        - T_zone_start = (T_min, T_max)
+        - start_id
+        - end_id
+        - top_priority_for_activated_agent
+        - agent_id (default: None): If agent_id is given, ignore this agent in this edge.
+        - heuristic (default: None): lower bounds of the remaining duration_max to end_id of each node,
+                                     "None" means calculating it by dijkstras_static() on the reversed graph.
+        - adj_reversed (default: None): The reversed graph of adj if it's maintained by the caller,
+                                        "None" means generating it with generate_reverse_graph().
+        - reservation_table (default: None): maReservation.RESERVATION_TABLE, if given, the nodes reserved by other agents
+                                             are neither entered nor waited at.
+        - window (default: 10): the duration of a window
+        - wait_step (default: 1): the duration of a wait move
+        - max_num_windows (default: 32): give up if end_id is not reached within this number of windows
+        - max_num_expansions (default: None): give up if a window expands more states than this, "None" means no limit
+        - constraint_dict (default: None): {(kind, resource_id):[T_zone, ...], ...}, kind is maReservation.RESOURCE_EDGE/RESOURCE_NODE,
+                                           the resources closed to this agent within the T_zones (e.g. the constraints of CBS),
+                                           checked aside without touching the edges or the reservation table
+
+    outputs
+        - (path, wait_list)/None: path is a sequence (list) of node_id from start_id to end_id,
+                                  wait_list[k] is the time waited at path[k] before leaving it,
+                                  "None" means no valid path
+    """
+    if not (window > 0 and wait_step > 0):
+        logger.error('The window (%s) and the wait_step (%s) should be positive.', window, wait_step)
+        return None
+    if heuristic is None:
+        if adj_reversed is None:
+            adj_reversed = generate_reverse_graph(adj)
+        heuristic = dijkstras_static(adj_reversed, edges, end_id)
+    if heuristic[start_id] == float('inf'):
+        logger.info('The end_id is not reachable from start_id in the sense of topology.')
+        return None
+    path = [start_id]
+    wait_list = [0]
+    used_edge_dict = dict() # {edge_id:T_min of the first pass, ...}
+    nid_u, g_u, T_zone_u = start_id, 0, T_zone_start
+    for _ in range(max_num_windows):
+        result = _whca_star_window(adj, edges, T_zone_u, nid_u, end_id, g_u, g_u + window, heuristic,
+                                   top_priority_for_activated_agent, agent_id, reservation_table, wait_step, max_num_expansions, used_edge_dict, constraint_dict)
+        if result is None:
+            logger.info('The agent is blocked at node_id <%d> with g = %s in whca_star().', nid_u, g_u)
+            return None
+        state_list, is_reaching_end = result
+        T_zone_prev = T_zone_u
+        for nid_v, g_v, T_zone_v, is_wait, eid in state_list[1:]:
+            if is_wait:
+                wait_list[-1] += wait_step
+            else:
+                path.append(nid_v)
+                wait_list.append(0)
+                if not eid in used_edge_dict:
+                    used_edge_dict[eid] = edges[eid].get_T_zone_occ_from_start(T_zone_prev)[0]
+            T_zone_prev = T_zone_v
+        nid_u, g_u, T_zone_u = state_list[-1][:3]
+        if is_reaching_end:
+            logger.info("WHCA* finished")
+            logger.info("Distance from start_id <%d> to end_id <%d> = %s (waited %s)", start_id, end_id, g_u, sum(wait_list))
+            logger.debug("path = %s, wait_list = %s", path, wait_list)
+            return (path, wait_list)
+    logger.info('The end_id is not reached within %d windows in whca_star().', max_num_windows)
+    return None
+#--------------------------------------#
+
+# Incremental search (LPA*)
+#--------------------------------------#
+class INCREMENTAL_SEARCH(object):
+    """
+    Lifelong planning A* from start_id to end_id, for the requests waiting for a path.
+    The search states are kept, and only the vertices affected by the edges whose states changed
+    are repaired at the next get_path(). The T_zone of a node follows its parent (the best predecessor),
+    so the validity of an edge is checked with the T_zone of its tail, the same as the other engines.
+
+    States
+        - g: g[node_id], the settled total duration_max from start_id
+        - rhs: rhs[node_id], the one-step look-ahead of g
+        - parent: parent[node_id] = (node_id, edge_id) giving rhs
+        - T_zone_nodes, T_zone_rhs: the T_zone that goes with g and rhs
+        - changed_edge_set: the edges changed since the last repair, see on_edge_state_changed()
+        - is_invalidated: True if the topology changed, the states are re-built by reset()
+    """
+    def __init__(self, adj, adj_reversed, edges, T_zone_start, start_id, end_id, only_count_activated_agent=False, agent_id=None, heuristic=None, reservation_table=None):
+        """
+        inputs
+            - adj, adj_reversed: the adjacent graph and its reversed graph (kept by reference)
+            - edges
+            - T_zone_start = (T_min, T_max)
+            - start_id
+            - end_id
+            - only_count_activated_agent
+            - agent_id (default: None): If agent_id is given, ignore this agent in this edge.
+            - heuristic (default: None): a consistent lower bound of the remaining duration_max to end_id, "None" means all zeros
+            - reservation_table (default: None): maReservation.RESERVATION_TABLE, see astar()
+        """
+        self.adj = adj
+        self.adj_reversed = adj_reversed
+        self.edges = edges
+        self.T_zone_start = T_zone_start
+        self.start_id = start_id
+        self.end_id = end_id
+        self.only_count_activated_agent = only_count_activated_agent
+        self.agent_id = agent_id
+        self.reservation_table = reservation_table
+        self.num_expansions = 0 # The total number of the popped vertices, for statistics
+        self.reset(heuristic)
+
+    def reset(self, heuristic=None):
+        """
+        Discard the search states, e.g. after the topology changed.
+        """
+        max_value = float('inf')
+        num_nodes = len(self.adj)
+        self.heuristic = [0] * num_nodes if heuristic is None else heuristic
+        self.g = [max_value] * num_nodes
+        self.rhs = [max_value] * num_nodes
+        self.parent = [None] * num_nodes
+        self.T_zone_nodes = [None] * num_nodes
+        self.T_zone_rhs = [None] * num_nodes
+        self._heap = []
+        self._queue_key = dict() # The current key of each vertex in the queue, {node_id:key, ...}
+        self.changed_edge_set = set()
+        self.is_invalidated = False
+        #
+        self.rhs[self.start_id] = 0
+        self.T_zone_rhs[self.start_id] = self.T_zone_start
+        self._push(self.start_id)
+
+    def invalidate(self):
+        """
+        Mark the search states as out-dated (the topology changed), reset() should be called before the next get_path().
+        """
+        self.is_invalidated = True
+
+    def on_edge_state_changed(self, edge, event, agent_id, task_id):
+        """
+        The state listener, see ed.EDGE.add_state_listener() and GEOMETRY_TASK_GRAPH.add_state_listener().
+        """
+        self.changed_edge_set.add(edge.edge_id)
+
+    def _get_key(self, node_id):
+        g_min = min(self.g[node_id], self.rhs[node_id])
+        return (g_min + self.heuristic[node_id], g_min)
+
+    def _push(self, node_id):
+        key = self._get_key(node_id)
+        self._queue_key[node_id] = key
+        heapq.heappush(self._heap, (key, node_id))
+
+    def _is_consistent(self, node_id):
+        return (self.g[node_id] == self.rhs[node_id] and self.T_zone_nodes[node_id] == self.T_zone_rhs[node_id])
+
+    def _is_parent_of(self, node_id, nid_u):
+        """
+        If node_id is an ancestor of nid_u through the zero-duration edges.
+        Such a predecessor gives the same rhs as the current g of node_id, so the cycle of parents
+        it would make never looks inconsistent and is never repaired.
+        """
+        edges = self.edges
+        parent = self.parent
+        nid = nid_u
+        for _ in range(len(parent)):
+            if nid == node_id:
+                return True
+            parent_u = parent[nid]
+            if parent_u is None or edges[parent_u[1]].duration[1] != 0:
+                return False
+            nid = parent_u[0]
+        return False
+
+    def _update_vertex(self, node_id):
+        """
+        Re-calculate the rhs of a vertex from its predecessors, and queue it if inconsistent.
+        A consistent vertex is queued too if its parent changed, so that its successors
+        skipped by _is_parent_of() are re-calculated.
+        """
+        is_parent_changed = False
+        if node_id != self.start_id:
+            edges = self.edges
+            g = self.g
+            rhs_v = float('inf')
+            T_zone_v = None
+            parent_v = None
+            for nid_u, eid in self.adj_reversed[node_id]:
+                dist_v = g[nid_u] + edges[eid].duration[1]
+                if not dist_v < rhs_v:
+                    continue
+                edge = edges[eid]
+                T_zone_u = self.T_zone_nodes[nid_u]
+                if not edge.is_possible_to_pass(T_zone_u, self.only_count_activated_agent, self.agent_id):
+                    continue
+                T_zone_tmp = edge.get_T_zone_end_from_start(T_zone_u)
+                if (not self.reservation_table is None) and (not self.reservation_table.is_node_free(node_id, T_zone_tmp, self.agent_id)):
+                    continue
+                if edge.duration[1] == 0 and self._is_parent_of(node_id, nid_u):
+                    continue
+                rhs_v, T_zone_v, parent_v = dist_v, T_zone_tmp, (nid_u, eid)
+            self.rhs[node_id] = rhs_v
+            self.T_zone_rhs[node_id] = T_zone_v
+            is_parent_changed = (parent_v != self.parent[node_id])
+            self.parent[node_id] = parent_v
+        if self._is_consistent(node_id) and not is_parent_changed:
+            self._queue_key.pop(node_id, None)
+        else:
+            self._push(node_id)
+
+    def compute_shortest_path(self):
+        """
+        Repair the vertices affected by the changed edges, until end_id is consistent.
+        outputs
+            - the number of the popped vertices
+        """
+        for eid in self.changed_edge_set:
+            self._update_vertex(self.edges[eid].from_node_id)
+            self._update_vertex(self.edges[eid].to_node_id)
+        self.changed_edge_set = set()
+        end_id = self.end_id
+        heap = self._heap
+        num_expansions = 0
+        while heap:
+            key, nid_u = heap[0]
+            if self._queue_key.get(nid_u, None) != key:
+                # Out-dated entry
+                heapq.heappop(heap)
+                continue
+            if not (key <= self._get_key(end_id) or not self._is_consistent(end_id)):
+                # The ties are repaired too, the ancestors through the zero-duration edges have the same key
+                break
+            heapq.heappop(heap)
+            del self._queue_key[nid_u]
+            num_expansions += 1
+            if self.g[nid_u] >= self.rhs[nid_u]:
+                # Over-consistent (or the T_zone changed), settle it
+                self.g[nid_u] = self.rhs[nid_u]
+                self.T_zone_nodes[nid_u] = self.T_zone_rhs[nid_u]
+                for nid_v, eid in self.adj[nid_u]:
+                    self._update_vertex(nid_v)
+            else:
+                # Under-consistent, re-open it
+                self.g[nid_u] = float('inf')
+                self.T_zone_nodes[nid_u] = None
+                self._update_vertex(nid_u)
+                for nid_v, eid in self.adj[nid_u]:
+                    self._update_vertex(nid_v)
+        self.num_expansions += num_expansions
+        return num_expansions
+
+    def get_distance(self):
+        """
+        The total duration_max from start_id to end_id, float('inf') means not reachable.
+        """
+        self.compute_shortest_path()
+        return self.g[self.end_id]
+
+    def get_path(self):
+        """
+        outputs
+            - path/None: a sequence (list) of node_id from start_id to end_id
+                         or "None" means no valid path
+        """
+        if self.get_distance() == float('inf'):
+            return None
+        path = [self.end_id]
+        while path[-1] != self.start_id:
+            if self.parent[path[-1]] is None or len(path) > len(self.adj):
+                logger.error("Broken parents from end_id <%d>, something wrong in INCREMENTAL_SEARCH.", self.end_id)
+                return None
+            path.append(self.parent[path[-1]][0])
+        path.reverse()
+        return path
+#--------------------------------------#
+
+# Search engines that can be selected by GEOMETRY_TASK_GRAPH
+#--------------------------------------#
+SEARCH_ENGINE_ASTAR = 'astar' # astar(), astar_backtrack()
+SEARCH_ENGINE_HEAPQ = 'heapq' # dijkstras_heapq(), dijkstras_backtrack_heapq()
+SEARCH_ENGINE_PRIORITY_QUEUE = 'priority_queue' # dijkstras(), dijkstras_backtrack(), the original one
+# Elements are {engine_name:(forward_search, backward_search), ...}
+SEARCH_ENGINE_DICT = {
+    SEARCH_ENGINE_ASTAR: (astar, astar_backtrack),
+    SEARCH_ENGINE_HEAPQ: (dijkstras_heapq, dijkstras_backtrack_heapq),
+    SEARCH_ENGINE_PRIORITY_QUEUE: (dijkstras, dijkstras_backtrack),
+}
+#--------------------------------------#
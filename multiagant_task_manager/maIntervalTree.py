@@ -0,0 +1,254 @@
+"""
+Interval index
+This module provides the interval tree used by EDGE for indexing
+the occupied time periods (T_zone) of the tasks on an edge.
+
+All the intervals are closed sets, i.e. the coincident boundary points
+are considered to be intersected.
+"""
+import array
+import bisect
+import maAgent as ag
+
+
+# The node of the interval tree
+#-------------------------------#
+class INTERVAL_NODE(object):
+    """
+    - T_min, T_max: the closed interval stored in this node
+    - key: the identifier of the interval, e.g. (agent_id, task_id)
+    - seq (int): insertion sequence number, for breaking ties of T_min
+    - priority (int): priority of the treap, scattered from seq by Fibonacci hashing
+                      (not kept, one INTERVAL_NODE is created for every reservation on every edge)
+    - max_T_max: the maximum T_max in the sub-tree rooted at this node
+    """
+    __slots__ = ('T_min', 'T_max', 'key', 'seq', 'max_T_max', 'left', 'right')
+
+    def __init__(self, T_min, T_max, key, seq):
+        self.T_min = T_min
+        self.T_max = T_max
+        self.key = key
+        self.seq = seq
+        self.max_T_max = T_max
+        self.left = None
+        self.right = None
+
+    @property
+    def priority(self):
+        return ((self.seq * 2654435769) & 0xffffffff)
+
+    def _update(self):
+        """
+        Re-calculate the max_T_max from its children.
+        """
+        max_T_max = self.T_max
+        if self.left is not None and self.left.max_T_max > max_T_max:
+            max_T_max = self.left.max_T_max
+        if self.right is not None and self.right.max_T_max > max_T_max:
+            max_T_max = self.right.max_T_max
+        self.max_T_max = max_T_max
+#-------------------------------#
+
+
+# The interval tree
+#-------------------------------#
+class INTERVAL_TREE(object):
+    """
+    A dynamic interval tree (a treap ordered by T_min and augmented with max_T_max)
+    plus two sorted endpoint lists.
+
+    - query(T_zone): list all the keys whose interval intersects T_zone, O(log n + k)
+    - count(T_zone): number of intervals intersecting T_zone, O(log n)
+    - insert()/remove(): O(log n) expected for the tree
+    """
+    def __init__(self):
+        """
+        """
+        self.root = None
+        self.node_dict = dict() # Elements are {key:INTERVAL_NODE(), ...}
+        self._seq = 0
+        # Sorted endpoints, for counting without visiting the intervals (unboxed floats)
+        self._T_min_list = array.array('d')
+        self._T_max_list = array.array('d')
+
+    def __len__(self):
+        return len(self.node_dict)
+
+    def __contains__(self, key):
+        return (key in self.node_dict)
+
+    @staticmethod
+    def _normalize(T_zone):
+        """
+        Convert the T_zone into a (T_min, T_max) pair, 'None' means infinity.
+        """
+        T_min, T_max = T_zone
+        if T_max is None:
+            T_max = ag.INF
+        return (T_min, T_max)
+
+    def insert(self, T_zone, key):
+        """
+        Insert an interval with its key.
+        inputs
+            - T_zone: a tuple of (min_pass_stamp, max_pass_stamp)
+            - key: a hashable identifier, unique in this tree
+        outputs
+            - True/False
+        """
+        if key in self.node_dict:
+            return False
+        T_min, T_max = self._normalize(T_zone)
+        node = INTERVAL_NODE(T_min, T_max, key, self._seq)
+        self._seq += 1
+        self.node_dict[key] = node
+        self.root = self._insert(self.root, node)
+        bisect.insort(self._T_min_list, T_min)
+        bisect.insort(self._T_max_list, T_max)
+        return True
+
+    def remove(self, key):
+        """
+        Remove the interval with the given key.
+        outputs
+            - True/False
+        """
+        node = self.node_dict.pop(key, None)
+        if node is None:
+            return False
+        self.root = self._remove(self.root, node)
+        del self._T_min_list[bisect.bisect_left(self._T_min_list, node.T_min)]
+        del self._T_max_list[bisect.bisect_left(self._T_max_list, node.T_max)]
+        return True
+
+    def get_T_zone(self, key):
+        """
+        Get the interval stored with the key, "None" if the key does not exist.
+        """
+        node = self.node_dict.get(key, None)
+        if node is None:
+            return None
+        return (node.T_min, node.T_max)
+
+    def count(self, T_zone):
+        """
+        Count the number of intervals that intersect with T_zone.
+        intersected <--> (T_min <= T_zone[1]) and (T_max >= T_zone[0])
+        """
+        T_a, T_b = self._normalize(T_zone)
+        if T_b < T_a:
+            return 0
+        # The two excluded sets are disjoint since T_min <= T_max for every interval
+        num_after = len(self._T_min_list) - bisect.bisect_right(self._T_min_list, T_b)
+        num_before = bisect.bisect_left(self._T_max_list, T_a)
+        return (len(self._T_min_list) - num_after - num_before)
+
+    def _query_nodes(self, T_zone):
+        """
+        Find all the nodes whose intervals intersect with T_zone.
+        Only the nodes reached from the root are read, so a search may run while a booking
+        writes another interval (see GEOMETRY_TASK_GRAPH.book_a_path_concurrent()).
+        """
+        T_a, T_b = self._normalize(T_zone)
+        node_list = []
+        if T_b < T_a:
+            return node_list
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None or node.max_T_max < T_a:
+                # Nothing in this sub-tree reaches T_a
+                continue
+            stack.append(node.left)
+            if node.T_min > T_b:
+                # The right sub-tree begins even later
+                continue
+            if node.T_max >= T_a:
+                node_list.append(node)
+            stack.append(node.right)
+        return node_list
+
+    def query(self, T_zone):
+        """
+        Find all the keys of the intervals that intersect with T_zone.
+        outputs
+            - key_list
+        """
+        return [node.key for node in self._query_nodes(T_zone)]
+
+    def query_intervals(self, T_zone):
+        """
+        Find all the intervals that intersect with T_zone.
+        outputs
+            - list of (T_min, T_max, key)
+        """
+        return [(node.T_min, node.T_max, node.key) for node in self._query_nodes(T_zone)]
+
+    # Treap operations
+    #-------------------------------#
+    @staticmethod
+    def _less(node_a, node_b):
+        return (node_a.T_min, node_a.seq) < (node_b.T_min, node_b.seq)
+
+    def _insert(self, root, node):
+        if root is None:
+            return node
+        if self._less(node, root):
+            root.left = self._insert(root.left, node)
+            if root.left.priority > root.priority:
+                root = self._rotate_right(root)
+        else:
+            root.right = self._insert(root.right, node)
+            if root.right.priority > root.priority:
+                root = self._rotate_left(root)
+        root._update()
+        return root
+
+    def _remove(self, root, node):
+        if root is None:
+            return None
+        if root is node:
+            return self._merge(root.left, root.right)
+        if self._less(node, root):
+            root.left = self._remove(root.left, node)
+        else:
+            root.right = self._remove(root.right, node)
+        root._update()
+        return root
+
+    def _merge(self, left, right):
+        """
+        Merge two treaps, all the nodes in left are less than the ones in right.
+        """
+        if left is None:
+            return right
+        if right is None:
+            return left
+        if left.priority > right.priority:
+            left.right = self._merge(left.right, right)
+            left._update()
+            return left
+        else:
+            right.left = self._merge(left, right.left)
+            right._update()
+            return right
+
+    @staticmethod
+    def _rotate_right(node):
+        pivot = node.left
+        node.left = pivot.right
+        pivot.right = node
+        node._update()
+        pivot._update()
+        return pivot
+
+    @staticmethod
+    def _rotate_left(node):
+        pivot = node.right
+        node.right = pivot.left
+        pivot.left = node
+        node._update()
+        pivot._update()
+        return pivot
+    #-------------------------------#
+#-------------------------------#
@@ -0,0 +1,333 @@
+"""
+Landmarks (ALT)
+This module provides the landmark table for the goal-directed searches
+(A*, Landmarks and Triangle inequality) in maGraphEngines.
+
+The table stores the static (no capacity) shortest duration_max from/to
+K landmarks as compact arrays. By triangle inequality, for any nodes x, y and landmark L
+    d(x,y) >= d(L,y) - d(L,x)
+    d(x,y) >= d(x,L) - d(y,L)
+Since the capacity constraints only remove edges, the bounds stay valid for the searches with capacity.
+"""
+import array
+import heapq
+import random
+import maLogging as lg
+
+logger = lg.get_logger(__name__)
+
+# Landmark selection methods
+#-------------------------------#
+# Greedily pick the node farthest from the landmarks already picked
+LANDMARK_SELECTION_FARTHEST = 'farthest'
+# Pick the leaf of the shortest path tree branch that is worst covered by the landmarks already picked
+LANDMARK_SELECTION_AVOID = 'avoid'
+#-------------------------------#
+
+# Relative error of the distances stored in single-precision ('f') arrays
+_FLOAT32_EPSILON = 1.2e-7
+
+
+def _static_search(adj, edges, source_id, dist=None, is_returning_prev=False):
+    """
+    The static (no capacity) dijkstra on duration_max.
+    If dist is given, only decrease the distances in it starting from source_id,
+    which is used for repairing the table incrementally.
+    outputs
+        - dist, or (dist, prev) if is_returning_prev
+    """
+    max_value = float('inf')
+    if dist is None:
+        dist = [max_value] * len(adj)
+        dist[source_id] = 0
+    prev = [None] * len(adj) if is_returning_prev else None
+    heap = [(dist[source_id], source_id)]
+    while heap:
+        dist_u, nid_u = heapq.heappop(heap)
+        if dist_u > dist[nid_u]:
+            # Out-dated entry
+            continue
+        for nid_v, eid in adj[nid_u]:
+            dist_v = dist_u + edges[eid].duration[1]
+            if dist_v < dist[nid_v]:
+                dist[nid_v] = dist_v
+                if is_returning_prev:
+                    prev[nid_v] = nid_u
+                # Push the stored value, which might be rounded by the array
+                heapq.heappush(heap, (dist[nid_v], nid_v))
+    if is_returning_prev:
+        return (dist, prev)
+    return dist
+
+
+# The heuristic for the searches in maGraphEngines
+#-------------------------------#
+class LANDMARK_HEURISTIC(object):
+    """
+    A list-like object, heuristic[node_id] is the landmark lower bound of
+        - the duration_max from node_id to target_id (forward search), or
+        - the duration_max from target_id to node_id (backward search, is_backtrack=True)
+    The bounds are calculated on demand, so only the visited nodes cost anything.
+    """
+    def __init__(self, landmark_table, target_id, is_backtrack=False):
+        self.landmark_table = landmark_table
+        self.target_id = target_id
+        self.is_backtrack = is_backtrack
+
+    def __len__(self):
+        return self.landmark_table.num_nodes
+
+    def __getitem__(self, node_id):
+        if self.is_backtrack:
+            return self.landmark_table.get_lower_bound(self.target_id, node_id)
+        return self.landmark_table.get_lower_bound(node_id, self.target_id)
+#-------------------------------#
+
+
+# The landmark table
+#-------------------------------#
+class LANDMARK_TABLE(object):
+    """
+    Properties
+        - num_landmarks (int): The maximum number of landmarks
+        - selection: LANDMARK_SELECTION_FARTHEST or LANDMARK_SELECTION_AVOID
+        - typecode: The typecode of the distance arrays,
+                    'd' (8 bytes per node per direction) or 'f' (4 bytes, bounds are loosened by the rounding error)
+
+    States
+        - landmark_list: node_id of the landmarks
+        - dist_from_list: dist_from_list[k][node_id] = d(landmark_k, node_id)
+        - dist_to_list: dist_to_list[k][node_id] = d(node_id, landmark_k)
+    """
+    def __init__(self, num_landmarks=8, selection=LANDMARK_SELECTION_FARTHEST, typecode='d', seed=None):
+        """
+        inputs
+            - num_landmarks     (default: 8)
+            - selection         (default: LANDMARK_SELECTION_FARTHEST)
+            - typecode          (default: 'd')
+            - seed              (default: None): seed of the random root of the selection
+        """
+        if not selection in (LANDMARK_SELECTION_FARTHEST, LANDMARK_SELECTION_AVOID):
+            logger.warning('Unknown landmark selection <%s>, use <%s> instead.', selection, LANDMARK_SELECTION_FARTHEST)
+            selection = LANDMARK_SELECTION_FARTHEST
+        if not typecode in ('d', 'f'):
+            logger.warning("Unknown typecode <%s>, use 'd' instead.", typecode)
+            typecode = 'd'
+        self.num_landmarks = int(num_landmarks)
+        self.selection = selection
+        self.typecode = typecode
+        self._random = random.Random(seed)
+        #
+        self.num_nodes = 0
+        self.landmark_list = []
+        self.dist_from_list = []
+        self.dist_to_list = []
+        # Reversed adjacent graph for the distances "to" the landmarks
+        self.adj_reversed = []
+        self._is_owning_adj_reversed = True # False if it's shared by (and maintained by) the graph
+
+    def get_memory_size(self):
+        """
+        The number of bytes of the distance arrays.
+        """
+        return sum(dist.itemsize * len(dist) for dist in (self.dist_from_list + self.dist_to_list))
+
+    def build(self, adj, edges, adj_reversed=None):
+        """
+        (Re-)select the landmarks and calculate the distance tables.
+        inputs
+            - adj: adjacent graph
+            - edges
+            - adj_reversed (default: None): The reversed graph of adj maintained by the caller,
+                                            "None" means that the table maintains its own copy.
+        outputs
+            - True/False
+        """
+        self.num_nodes = len(adj)
+        self.landmark_list = []
+        self.dist_from_list = []
+        self.dist_to_list = []
+        if adj_reversed is None:
+            self._is_owning_adj_reversed = True
+            self.adj_reversed = [[] for _ in range(self.num_nodes)]
+            for nid_u in range(self.num_nodes):
+                for nid_v, eid in adj[nid_u]:
+                    self.adj_reversed[nid_v].append( (nid_u, eid) )
+        else:
+            self._is_owning_adj_reversed = False
+            self.adj_reversed = adj_reversed
+        if self.num_nodes == 0:
+            return True
+        #
+        num_landmarks = min(self.num_landmarks, self.num_nodes)
+        while len(self.landmark_list) < num_landmarks:
+            if self.selection == LANDMARK_SELECTION_AVOID:
+                landmark_id = self._select_avoid(adj, edges)
+            else:
+                landmark_id = self._select_farthest(adj, edges)
+            if landmark_id is None:
+                break
+            self._add_landmark(adj, edges, landmark_id)
+        logger.info('Landmark table built with landmarks %s, %d bytes.', self.landmark_list, self.get_memory_size())
+        return True
+
+    def _add_landmark(self, adj, edges, landmark_id):
+        self.landmark_list.append(landmark_id)
+        self.dist_from_list.append( array.array(self.typecode, _static_search(adj, edges, landmark_id)) )
+        self.dist_to_list.append( array.array(self.typecode, _static_search(self.adj_reversed, edges, landmark_id)) )
+
+    def _select_farthest(self, adj, edges):
+        """
+        The node farthest from all the landmarks already picked,
+        where the nodes not reachable from any landmark come first.
+        """
+        if len(self.landmark_list) == 0:
+            # Start from the farthest node of a random root
+            root_id = self._random.randrange(self.num_nodes)
+            dist_list = [_static_search(adj, edges, root_id)]
+        else:
+            dist_list = self.dist_from_list
+        best_id = None
+        best_value = -1
+        for nid in range(self.num_nodes):
+            if nid in self.landmark_list:
+                continue
+            value = min(dist[nid] for dist in dist_list)
+            if value > best_value:
+                best_id = nid
+                best_value = value
+        return best_id
+
+    def _select_avoid(self, adj, edges):
+        """
+        The "avoid" method (Goldberg and Werneck):
+        Grow the shortest path tree of a random root, weight each node by how badly
+        its distance from the root is bounded by the current landmarks,
+        and go down along the heaviest branch without landmarks until reaching a leaf.
+        """
+        root_id = self._random.randrange(self.num_nodes)
+        dist, prev = _static_search(adj, edges, root_id, is_returning_prev=True)
+        # Weight and children in the tree
+        weight = [0] * self.num_nodes
+        children = [[] for _ in range(self.num_nodes)]
+        for nid in range(self.num_nodes):
+            if dist[nid] == float('inf'):
+                continue
+            weight[nid] = dist[nid] - self.get_lower_bound(root_id, nid) if self.landmark_list else dist[nid]
+            if not prev[nid] is None:
+                children[prev[nid]].append(nid)
+        # Top-down order of the tree
+        order = [root_id]
+        for nid in order:
+            order.extend(children[nid])
+        # Size of the sub-trees without landmarks, from leaves to the root
+        size = list(weight)
+        has_landmark = [False] * self.num_nodes
+        for nid in self.landmark_list:
+            has_landmark[nid] = True
+        for nid in reversed(order):
+            if has_landmark[nid]:
+                size[nid] = 0
+            if not prev[nid] is None:
+                size[prev[nid]] += size[nid]
+                has_landmark[prev[nid]] = has_landmark[prev[nid]] or has_landmark[nid]
+        # Follow the heaviest branch
+        nid = root_id
+        if size[nid] <= 0:
+            # Everything reachable from the root is covered, fall back
+            return self._select_farthest(adj, edges)
+        while True:
+            candidate_list = [child for child in children[nid] if size[child] > 0]
+            if len(candidate_list) == 0:
+                break
+            nid = max(candidate_list, key=lambda child: size[child])
+        if nid in self.landmark_list:
+            return self._select_farthest(adj, edges)
+        return nid
+
+    def get_lower_bound(self, from_id, to_id):
+        """
+        Lower bound of the duration_max from from_id to to_id.
+        float('inf') means to_id is not reachable from from_id.
+        """
+        max_value = float('inf')
+        lower_bound = 0
+        for k in range(len(self.landmark_list)):
+            dist_from = self.dist_from_list[k]
+            dist_to = self.dist_to_list[k]
+            # d(x,y) >= d(L,y) - d(L,x)
+            d_a = dist_from[to_id]
+            d_b = dist_from[from_id]
+            if d_b != max_value:
+                if d_a == max_value:
+                    return max_value
+                bound = d_a - d_b
+                if self.typecode == 'f':
+                    bound -= (d_a + d_b) * _FLOAT32_EPSILON
+                if bound > lower_bound:
+                    lower_bound = bound
+            # d(x,y) >= d(x,L) - d(y,L)
+            d_a = dist_to[from_id]
+            d_b = dist_to[to_id]
+            if d_b != max_value:
+                if d_a == max_value:
+                    return max_value
+                bound = d_a - d_b
+                if self.typecode == 'f':
+                    bound -= (d_a + d_b) * _FLOAT32_EPSILON
+                if bound > lower_bound:
+                    lower_bound = bound
+        return lower_bound
+
+    def get_heuristic(self, target_id, is_backtrack=False):
+        """
+        Get the heuristic toward target_id for the searches in maGraphEngines.
+        outputs
+            - LANDMARK_HEURISTIC
+        """
+        return LANDMARK_HEURISTIC(self, target_id, is_backtrack)
+
+    # Incremental repair
+    #-------------------------------#
+    def add_node(self):
+        """
+        A node is appended to the graph, it is not reachable from/to anything yet.
+        """
+        self.num_nodes += 1
+        if self._is_owning_adj_reversed:
+            self.adj_reversed.append([])
+        for dist in (self.dist_from_list + self.dist_to_list):
+            dist.append(float('inf'))
+
+    def add_edge(self, adj, edges, edge_id):
+        """
+        An edge is appended to the graph (and adj, as well as the shared adj_reversed, already contains it).
+        The distances can only decrease, so only the affected nodes are updated.
+        inputs
+            - adj: adjacent graph
+            - edges
+            - edge_id
+        """
+        edge = edges[edge_id]
+        pair_list = [(edge.from_node_id, edge.to_node_id)]
+        if edge.is_bidirectional:
+            pair_list.append( (edge.to_node_id, edge.from_node_id) )
+        if self._is_owning_adj_reversed:
+            for nid_u, nid_v in pair_list:
+                self.adj_reversed[nid_v].append( (nid_u, edge_id) )
+        #
+        weight = edge.duration[1]
+        for k in range(len(self.landmark_list)):
+            dist_from = self.dist_from_list[k]
+            dist_to = self.dist_to_list[k]
+            for nid_u, nid_v in pair_list:
+                # d(L,v) through u --> v
+                if dist_from[nid_u] + weight < dist_from[nid_v]:
+                    dist_from[nid_v] = dist_from[nid_u] + weight
+                    _static_search(adj, edges, nid_v, dist=dist_from)
+                # d(u,L) through u --> v
+                if dist_to[nid_v] + weight < dist_to[nid_u]:
+                    dist_to[nid_u] = dist_to[nid_v] + weight
+                    _static_search(self.adj_reversed, edges, nid_u, dist=dist_to)
+    #-------------------------------#
+#-------------------------------#
@@ -0,0 +1,44 @@
+"""
+Logging
+All the modules of the task manager log through the child loggers of LOGGER_NAME,
+so that the verbosity of the whole package can be controlled at one place.
+
+Nothing is emitted unless the application configures logging (e.g. logging.basicConfig())
+and the verbosity allows it. The messages are formatted lazily, i.e. only when emitted.
+"""
+import logging
+
+# The name of the root logger of this package
+LOGGER_NAME = 'multiagant_task_manager'
+
+_package_logger = logging.getLogger(LOGGER_NAME)
+# Stay silent if the application does not configure any handler
+_package_logger.addHandler(logging.NullHandler())
+
+
+def get_logger(module_name):
+    """
+    Get the logger of a module in this package.
+    inputs
+        - module_name
+    outputs
+        - logger
+    """
+    return logging.getLogger(LOGGER_NAME + '.' + module_name)
+
+def set_verbosity(level):
+    """
+    Set the verbosity of the whole package, for all the graphs in the process.
+    inputs
+        - level: logging.DEBUG/INFO/WARNING/ERROR/CRITICAL (or the name of the level)
+                 "None" means following the application's root logger
+    """
+    if level is None:
+        level = logging.NOTSET
+    _package_logger.setLevel(level)
+
+def get_verbosity():
+    """
+    Get the effective verbosity of the whole package.
+    """
+    return _package_logger.getEffectiveLevel()
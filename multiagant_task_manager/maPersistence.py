@@ -0,0 +1,392 @@
+"""
+Persistence
+This module saves GEOMETRY_TASK_GRAPH into a binary file and loads it back,
+see GEOMETRY_TASK_GRAPH.save() and GEOMETRY_TASK_GRAPH.load().
+
+The file layout
+    - MAGIC (8 bytes), the length of the meta (8 bytes, little-endian)
+    - meta: a pickled dict of the names of the nodes, the settings of the graph,
+            the tables of the (non-int) agent_id and task_id,
+            and the header of the arrays (see maSnapshot.get_layout())
+    - the arrays (aligned at 8 bytes): the CSR arrays of adj_graph and adj_graph_reversed,
+      the edge properties, and the tasks of the edges and the node reservations,
+      grouped by edge_id with CSR-like offsets
+
+The file is loaded by mmap, and nothing is built per edge at loading:
+    - edge_list is LAZY_EDGE_LIST, an EDGE is built (with its tasks) when it is first accessed
+    - adj_graph and adj_graph_reversed are LAZY_ADJ_LIST, a row is built when it is first accessed
+    - edge_id_dict is EDGE_ID_MAP, looking up the CSR rows
+    - the CSR views (get_csr_graph()) read the file in place
+
+Not saved: the state listeners, the landmarks, the tracked connectivity,
+the columnar store, the pending requests and the caches.
+Note: The meta is pickled, only load the files from trusted sources.
+"""
+import array
+import mmap
+import pickle
+import struct
+import threading
+import maAgent as ag
+import maEdge as ed
+import maCSR as csr
+import maReservation as rs
+import maSnapshot as sn
+import maLogging as lg
+
+logger = lg.get_logger(__name__)
+
+MAGIC = b'MATGRAPH'
+FORMAT_VERSION = 1
+_PREFIX_SIZE = len(MAGIC) + 8
+
+
+# Lazy containers over the loaded arrays
+#-------------------------------#
+class LAZY_EDGE_LIST(object):
+    """
+    The edge_list of a loaded graph, an EDGE is built from the arrays when it is first accessed.
+    The edges added after loading are appended as usual.
+    """
+    def __init__(self, graph, view_dict, table_dict):
+        self.graph = graph
+        self.view_dict = view_dict
+        self.table_dict = table_dict
+        self._edge_list = [None] * len(view_dict['from_node_id'])
+        self._lock = threading.Lock() # The searches may run in parallel, see book_a_path_concurrent()
+
+    def __len__(self):
+        return len(self._edge_list)
+
+    def __getitem__(self, edge_id):
+        edge = self._edge_list[edge_id]
+        if edge is None:
+            with self._lock:
+                edge = self._edge_list[edge_id]
+                if edge is None:
+                    edge = self._build_edge(edge_id if edge_id >= 0 else (edge_id + len(self._edge_list)))
+                    self._edge_list[edge_id] = edge
+        return edge
+
+    def __iter__(self):
+        for edge_id in range(len(self._edge_list)):
+            yield self[edge_id]
+
+    def __reduce__(self):
+        # Pickled as a plain list, e.g. for the worker processes
+        return (list, (list(self),))
+
+    def append(self, edge):
+        self._edge_list.append(edge)
+
+    def get_num_built_edges(self):
+        return sum(1 for edge in self._edge_list if not edge is None)
+
+    def _build_edge(self, edge_id):
+        view_dict = self.view_dict
+        agent_id_table = self.table_dict['agent_id']
+        task_id_table = self.table_dict['task_id']
+        duration_max = view_dict['duration_max'][edge_id]
+        edge = ed.EDGE(edge_id, view_dict['from_node_id'][edge_id], view_dict['to_node_id'][edge_id], view_dict['is_bidirectional'][edge_id],
+                       view_dict['capacity'][edge_id], (view_dict['duration_min'][edge_id], (None if duration_max == ag.INF else duration_max)),
+                       (ed.CAPACITY_MODE_PROFILE if view_dict['is_profile_mode'][edge_id] else ed.CAPACITY_MODE_INTERVAL))
+        # No listener yet, so the graph is not notified
+        for row in range(view_dict['task_offsets'][edge_id], view_dict['task_offsets'][edge_id + 1]):
+            T_max = view_dict['task_T_max'][row]
+            edge._put_agent_unchecked(agent_id_table[view_dict['task_agent_code'][row]], task_id_table[view_dict['task_task_code'][row]],
+                                      bool(view_dict['task_is_activated'][row]), (view_dict['task_T_min'][row], (None if T_max == ag.INF else T_max)))
+        edge.version = 0
+        edge.add_state_listener(self.graph._on_edge_state_changed)
+        return edge
+
+class LAZY_ADJ_LIST(object):
+    """
+    The adj_graph (or adj_graph_reversed) of a loaded graph, a row (list of (node_id, edge_id))
+    is built from the CSR arrays when it is first accessed, and then it's a normal list.
+    """
+    def __init__(self, offsets, targets, edge_ids):
+        self.offsets = offsets
+        self.targets = targets
+        self.edge_ids = edge_ids
+        self._row_list = [None] * (len(offsets) - 1)
+
+    def __len__(self):
+        return len(self._row_list)
+
+    def __getitem__(self, node_id):
+        row = self._row_list[node_id]
+        if row is None:
+            if node_id < 0:
+                node_id += len(self._row_list)
+            begin, end = self.offsets[node_id], self.offsets[node_id + 1]
+            row = list(zip(self.targets[begin:end], self.edge_ids[begin:end]))
+            self._row_list[node_id] = row
+        return row
+
+    def __iter__(self):
+        for node_id in range(len(self._row_list)):
+            yield self[node_id]
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+    def append(self, row):
+        self._row_list.append(row)
+
+class EDGE_ID_MAP(object):
+    """
+    The edge_id_dict of a loaded graph, {(from_node_id, to_node_id):edge_id, ...}.
+    The loaded edges are looked up in the rows of the CSR arrays of adj_graph,
+    and the edges added after loading are kept in a dict.
+    """
+    def __init__(self, offsets, targets, edge_ids):
+        self.offsets = offsets
+        self.targets = targets
+        self.edge_ids = edge_ids
+        self.num_nodes = len(offsets) - 1
+        self._added_dict = dict()
+
+    def __len__(self):
+        return len(self.targets) + len(self._added_dict)
+
+    def get(self, key, default=None):
+        edge_id = self._added_dict.get(key, None)
+        if not edge_id is None:
+            return edge_id
+        from_node_id, to_node_id = key
+        if 0 <= from_node_id < self.num_nodes:
+            for k in range(self.offsets[from_node_id], self.offsets[from_node_id + 1]):
+                if self.targets[k] == to_node_id:
+                    return self.edge_ids[k]
+        return default
+
+    def __contains__(self, key):
+        return (not self.get(key, None) is None)
+
+    def __getitem__(self, key):
+        edge_id = self.get(key, None)
+        if edge_id is None:
+            raise KeyError(key)
+        return edge_id
+
+    def __setitem__(self, key, edge_id):
+        self._added_dict[key] = edge_id
+#-------------------------------#
+
+
+# Saving
+#-------------------------------#
+def _get_code(value, table, code_dict):
+    """
+    The index of a value in table, appended if new.
+    """
+    code = code_dict.get(value, None)
+    if code is None:
+        code = len(table)
+        code_dict[value] = code
+        table.append(value)
+    return code
+
+def _pack_graph(graph):
+    """
+    outputs
+        - (array_dict, table_dict)
+    """
+    # Topology
+    array_dict = sn.pack_topology(graph)[0]
+    reversed_view = csr.CSR_GRAPH.from_adj(graph.adj_graph_reversed, [])
+    array_dict['reversed_offsets'] = reversed_view.offsets
+    array_dict['reversed_targets'] = reversed_view.targets
+    array_dict['reversed_edge_ids'] = reversed_view.edge_ids
+    array_dict['is_bidirectional'] = array.array('b', [(1 if edge.is_bidirectional else 0) for edge in graph.edge_list])
+    # Tasks
+    table_dict = {'agent_id':[], 'task_id':[]}
+    agent_code_dict, task_code_dict = dict(), dict()
+    task_offsets = array.array('l', [0])
+    task_agent_code = array.array('l')
+    task_task_code = array.array('l')
+    task_T_min = array.array('d')
+    task_T_max = array.array('d')
+    task_is_activated = array.array('b')
+    for edge in graph.edge_list:
+        for agent_id, _agent in edge.agent_dict.items():
+            agent_code = _get_code(agent_id, table_dict['agent_id'], agent_code_dict)
+            for task_id, _task in _agent.task_dict.items():
+                T_zone = edge.get_task_T_zone(agent_id, task_id)
+                task_agent_code.append(agent_code)
+                task_task_code.append(_get_code(task_id, table_dict['task_id'], task_code_dict))
+                task_T_min.append(T_zone[0])
+                task_T_max.append(T_zone[1])
+                task_is_activated.append(1 if _task.is_activated else 0)
+        task_offsets.append(len(task_agent_code))
+    array_dict.update({
+        'task_offsets':task_offsets, 'task_agent_code':task_agent_code, 'task_task_code':task_task_code,
+        'task_T_min':task_T_min, 'task_T_max':task_T_max, 'task_is_activated':task_is_activated,
+    })
+    # Node reservations (the ones of the edges are re-built from the tasks)
+    node_id_list = array.array('l')
+    node_agent_code = array.array('l')
+    node_task_code = array.array('l')
+    node_T_min = array.array('d')
+    node_T_max = array.array('d')
+    if not graph.reservation_table is None:
+        for key_record_dict in graph.reservation_table.record_dict.values():
+            for resource, (agent_id, task_id, T_min, T_max) in key_record_dict.values():
+                if resource[0] != rs.RESOURCE_NODE:
+                    continue
+                node_id_list.append(resource[1])
+                node_agent_code.append(_get_code(agent_id, table_dict['agent_id'], agent_code_dict))
+                node_task_code.append(_get_code(task_id, table_dict['task_id'], task_code_dict))
+                node_T_min.append(T_min)
+                node_T_max.append(T_max)
+    array_dict.update({
+        'node_id':node_id_list, 'node_agent_code':node_agent_code, 'node_task_code':node_task_code,
+        'node_T_min':node_T_min, 'node_T_max':node_T_max,
+    })
+    return (array_dict, table_dict)
+
+def save_graph(graph, file_path):
+    """
+    Save the topology, the names of the nodes, the edge properties, the reservations and the settings of a graph.
+    inputs
+        - graph: GEOMETRY_TASK_GRAPH
+        - file_path
+    outputs
+        - True/False
+    """
+    array_dict, table_dict = _pack_graph(graph)
+    header, size = sn.get_layout(array_dict)
+    table = graph.reservation_table
+    meta = {
+        'format_version':FORMAT_VERSION,
+        'itemsize_dict':dict((typecode, array.array(typecode).itemsize) for typecode in set(data.typecode for data in array_dict.values())),
+        'header':header,
+        'num_nodes':graph.num_nodes,
+        'num_edges':graph.num_edges,
+        'node_id_name_list':graph.node_id_name_list,
+        'table_dict':table_dict,
+        'capacity_mode':graph.capacity_mode,
+        'search_engine':graph.search_engine,
+        'is_using_csr':graph.is_using_csr,
+        'path_cache_size':graph.path_cache_size,
+        'lower_bound_cache_size':graph.lower_bound_cache_size,
+        'node_reservation':(None if table is None else (table.bucket_size, table.node_capacity)),
+    }
+    meta_bytes = pickle.dumps(meta, 2)
+    data_offset = _PREFIX_SIZE + len(meta_bytes)
+    data_offset += (-data_offset) % 8
+    buf = bytearray(max(size, 1))
+    sn.write_arrays(buf, header, array_dict)
+    try:
+        with open(file_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(meta_bytes)))
+            f.write(meta_bytes)
+            f.write(b'\0' * (data_offset - _PREFIX_SIZE - len(meta_bytes)))
+            f.write(buf)
+    except (IOError, OSError) as e:
+        logger.error('Failed to save the graph to <%s>: %s', file_path, e)
+        return False
+    logger.info('The graph with %d nodes and %d edges is saved to <%s>.', graph.num_nodes, graph.num_edges, file_path)
+    return True
+#-------------------------------#
+
+
+# Loading
+#-------------------------------#
+def _read_file(file_path):
+    """
+    outputs
+        - (meta, view_dict)/None
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError) as e:
+        logger.error('Failed to open <%s>: %s', file_path, e)
+        return None
+    if len(mm) < _PREFIX_SIZE or mm[:len(MAGIC)] != MAGIC:
+        logger.error('<%s> is not a graph file.', file_path)
+        return None
+    meta_size = struct.unpack('<Q', mm[len(MAGIC):_PREFIX_SIZE])[0]
+    meta = pickle.loads(mm[_PREFIX_SIZE:(_PREFIX_SIZE + meta_size)])
+    if meta['format_version'] != FORMAT_VERSION:
+        logger.error('Unsupported format version <%s> of <%s>.', meta['format_version'], file_path)
+        return None
+    for typecode, itemsize in meta['itemsize_dict'].items():
+        if array.array(typecode).itemsize != itemsize:
+            logger.error('<%s> was saved on a platform with %d-byte \'%s\' arrays.', file_path, itemsize, typecode)
+            return None
+    data_offset = _PREFIX_SIZE + meta_size
+    data_offset += (-data_offset) % 8
+    try:
+        buf = memoryview(mm)[data_offset:]
+    except TypeError:
+        # Python 2, mmap does not export the buffer
+        buf = mm[data_offset:]
+    # The views keep the mmap open
+    view_dict = sn.read_arrays(buf, meta['header'])[0]
+    return (meta, view_dict)
+
+def load_graph(graph, file_path):
+    """
+    Load a file saved by save_graph() into an empty graph.
+    inputs
+        - graph: GEOMETRY_TASK_GRAPH, without nodes
+        - file_path
+    outputs
+        - True/False
+    """
+    if graph.num_nodes > 0:
+        logger.error('The graph is not empty, <%s> is not loaded.', file_path)
+        return False
+    result = _read_file(file_path)
+    if result is None:
+        return False
+    meta, view_dict = result
+    table_dict = meta['table_dict']
+    # Topology
+    graph.num_nodes = meta['num_nodes']
+    graph.num_edges = meta['num_edges']
+    graph.node_id_name_list = meta['node_id_name_list']
+    graph.node_name_id_dict = dict(zip(graph.node_id_name_list, range(graph.num_nodes)))
+    graph.adj_graph = LAZY_ADJ_LIST(view_dict['offsets'], view_dict['targets'], view_dict['edge_ids'])
+    graph.adj_graph_reversed = LAZY_ADJ_LIST(view_dict['reversed_offsets'], view_dict['reversed_targets'], view_dict['reversed_edge_ids'])
+    graph.edge_id_dict = EDGE_ID_MAP(view_dict['offsets'], view_dict['targets'], view_dict['edge_ids'])
+    graph.edge_list = LAZY_EDGE_LIST(graph, view_dict, table_dict)
+    # Settings
+    graph.capacity_mode = meta['capacity_mode']
+    graph.search_engine = meta['search_engine']
+    graph.is_using_csr = meta['is_using_csr']
+    graph.path_cache_size = meta['path_cache_size']
+    graph.lower_bound_cache_size = meta['lower_bound_cache_size']
+    # The CSR views read the file in place
+    edge_property_list = [view_dict[name] for name in ('from_node_id', 'to_node_id', 'duration_min', 'duration_max', 'capacity')]
+    graph._csr_graph_dict[False] = csr.CSR_GRAPH(view_dict['offsets'], view_dict['targets'], view_dict['edge_ids'], *edge_property_list)
+    graph._csr_graph_dict[True] = csr.CSR_GRAPH(view_dict['reversed_offsets'], view_dict['reversed_targets'], view_dict['reversed_edge_ids'], *edge_property_list, is_reversed=True)
+    # The index of the reservations of the agents, without building the edges
+    agent_id_table, task_id_table = table_dict['agent_id'], table_dict['task_id']
+    task_offsets, task_T_min, task_T_max = view_dict['task_offsets'], view_dict['task_T_min'], view_dict['task_T_max']
+    task_record_list = []
+    for edge_id in range(graph.num_edges):
+        for row in range(task_offsets[edge_id], task_offsets[edge_id + 1]):
+            agent_id = agent_id_table[view_dict['task_agent_code'][row]]
+            task_id = task_id_table[view_dict['task_task_code'][row]]
+            T_max = task_T_max[row]
+            T_zone = (int(task_T_min[row]), (T_max if T_max == ag.INF else int(T_max)))
+            graph.agent_reservation_dict.setdefault(agent_id, dict()).setdefault(task_id, dict())[edge_id] = None
+            task_record_list.append( (edge_id, T_zone, agent_id, task_id) )
+    # Node reservations
+    if not meta['node_reservation'] is None:
+        bucket_size, node_capacity = meta['node_reservation']
+        table = rs.RESERVATION_TABLE(bucket_size, node_capacity)
+        for edge_id, T_zone, agent_id, task_id in task_record_list:
+            table.reserve_edge(edge_id, T_zone, agent_id, task_id)
+        for row in range(len(view_dict['node_id'])):
+            table.reserve_node(view_dict['node_id'][row], (view_dict['node_T_min'][row], view_dict['node_T_max'][row]),
+                               agent_id_table[view_dict['node_agent_code'][row]], task_id_table[view_dict['node_task_code'][row]])
+        graph.reservation_table = table
+    graph._on_topology_changed()
+    logger.info('The graph with %d nodes and %d edges is loaded from <%s>.', graph.num_nodes, graph.num_edges, file_path)
+    return True
+#-------------------------------#
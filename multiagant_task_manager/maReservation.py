@@ -0,0 +1,218 @@
+"""
+Space-time reservations
+This module provides the reservation table of GEOMETRY_TASK_GRAPH,
+which records when each node and each edge is reserved by which agent/task.
+
+The time axis is cut into buckets of bucket_size, and the reservations
+are hashed by (resource, bucket), so looking up the reservations of a node
+(or an edge) in a bucket is O(1). The reservations without an end
+(T_max is "None"/infinity) are kept aside per resource.
+
+All the intervals are closed sets, the same as in the interval index of EDGE (see maIntervalTree).
+"""
+import math
+import maAgent as ag
+import maLogging as lg
+
+logger = lg.get_logger(__name__)
+
+
+# Kinds of resources
+RESOURCE_NODE = 'node'
+RESOURCE_EDGE = 'edge'
+
+
+# The reservation table
+#-------------------------------#
+class RESERVATION_TABLE(object):
+    """
+    Properties
+        - bucket_size: the length of time of a bucket
+        - node_capacity: the number of agents allowed at a node at the same time
+
+    States
+        - bucket_dict: {resource:{bucket:{record_id:record, ...}, ...}, ...}
+        - unbounded_dict: {resource:{record_id:record, ...}, ...}, the reservations without an end
+        - record_dict: {(agent_id, task_id):{record_id:(resource, record), ...}, ...}
+        where resource = (RESOURCE_NODE, node_id) or (RESOURCE_EDGE, edge_id)
+        and record = (agent_id, task_id, T_min, T_max)
+    """
+    def __init__(self, bucket_size=1.0, node_capacity=1):
+        """
+        inputs
+            - bucket_size (default: 1.0): the length of time of a bucket,
+                                          about the typical duration of an edge is a good choice
+            - node_capacity (default: 1)
+        """
+        self.bucket_size = bucket_size
+        self.node_capacity = node_capacity
+        #
+        self.bucket_dict = dict()
+        self.unbounded_dict = dict()
+        self.record_dict = dict()
+        self._record_id = 0
+
+    def __len__(self):
+        return sum(len(_records) for _records in self.record_dict.values())
+
+    def _get_bucket(self, T):
+        return int(math.floor(T / float(self.bucket_size)))
+
+    @staticmethod
+    def _normalize(T_zone):
+        """
+        Convert the T_zone into a (T_min, T_max) pair, 'None' means infinity.
+        """
+        T_min, T_max = T_zone
+        if T_max is None:
+            T_max = ag.INF
+        return (T_min, T_max)
+
+    # Reservations
+    #-------------------------------#
+    def reserve(self, resource, T_zone, agent_id, task_id):
+        """
+        Reserve a resource within T_zone for the task of an agent,
+        no conflict is checked here (see is_free()).
+        inputs
+            - resource: (RESOURCE_NODE, node_id) or (RESOURCE_EDGE, edge_id)
+            - T_zone = (T_min, T_max)
+            - agent_id
+            - task_id
+        outputs
+            - True/False
+        """
+        T_min, T_max = self._normalize(T_zone)
+        if T_max < T_min:
+            logger.error('Invalid T_zone=%s for reserving %s.', T_zone, resource)
+            return False
+        record_id = self._record_id
+        self._record_id += 1
+        record = (agent_id, task_id, T_min, T_max)
+        if T_max == ag.INF:
+            self.unbounded_dict.setdefault(resource, dict())[record_id] = record
+        else:
+            resource_bucket_dict = self.bucket_dict.setdefault(resource, dict())
+            for bucket in range(self._get_bucket(T_min), self._get_bucket(T_max) + 1):
+                resource_bucket_dict.setdefault(bucket, dict())[record_id] = record
+        self.record_dict.setdefault((agent_id, task_id), dict())[record_id] = (resource, record)
+        return True
+
+    def reserve_node(self, node_id, T_zone, agent_id, task_id):
+        return self.reserve((RESOURCE_NODE, node_id), T_zone, agent_id, task_id)
+
+    def reserve_edge(self, edge_id, T_zone, agent_id, task_id):
+        return self.reserve((RESOURCE_EDGE, edge_id), T_zone, agent_id, task_id)
+
+    def _remove_record(self, record_id, resource, record):
+        T_min, T_max = record[2], record[3]
+        if T_max == ag.INF:
+            resource_record_dict = self.unbounded_dict[resource]
+            del resource_record_dict[record_id]
+            if not resource_record_dict:
+                del self.unbounded_dict[resource]
+            return
+        resource_bucket_dict = self.bucket_dict[resource]
+        for bucket in range(self._get_bucket(T_min), self._get_bucket(T_max) + 1):
+            del resource_bucket_dict[bucket][record_id]
+            if not resource_bucket_dict[bucket]:
+                del resource_bucket_dict[bucket]
+        if not resource_bucket_dict:
+            del self.bucket_dict[resource]
+
+    def _get_key_list(self, agent_id, task_id=None):
+        """
+        The (agent_id, task_id) keys that an operation with (possibly "None") task_id applies to.
+        """
+        if task_id is None:
+            return [key for key in self.record_dict if key[0] == agent_id]
+        return [(agent_id, task_id)] if (agent_id, task_id) in self.record_dict else []
+
+    def release(self, agent_id, task_id=None, resource=None, resource_kind=None):
+        """
+        Remove the reservations of an agent with specified/non-specified task_id
+        on the specified resource (or on all the resources if resource is "None"),
+        optionally only on the resources of a kind (RESOURCE_NODE or RESOURCE_EDGE).
+        outputs
+            - resource_list: the resources (kind, resource_id) of the removed reservations, one entry per reservation
+        """
+        resource_list = []
+        for key in self._get_key_list(agent_id, task_id):
+            key_record_dict = self.record_dict[key]
+            for record_id in list(key_record_dict):
+                _resource, record = key_record_dict[record_id]
+                if ((resource is None) or (_resource == resource)) and ((resource_kind is None) or (_resource[0] == resource_kind)):
+                    self._remove_record(record_id, _resource, record)
+                    del key_record_dict[record_id]
+                    resource_list.append(_resource)
+            if not key_record_dict:
+                del self.record_dict[key]
+        return resource_list
+
+    def release_node(self, node_id, agent_id, task_id=None):
+        return self.release(agent_id, task_id, (RESOURCE_NODE, node_id))
+
+    def release_edge(self, edge_id, agent_id, task_id=None):
+        return self.release(agent_id, task_id, (RESOURCE_EDGE, edge_id))
+    #-------------------------------#
+
+    # Queries
+    #-------------------------------#
+    def get_reservations(self, resource, T_zone):
+        """
+        Find all the reservations of a resource that intersect with T_zone.
+        Only the buckets covered by T_zone (or the occupied buckets of the resource,
+        whichever are fewer) are visited.
+        outputs
+            - a list of (agent_id, task_id, T_min, T_max)
+        """
+        T_a, T_b = self._normalize(T_zone)
+        record_list = []
+        if T_b < T_a:
+            return record_list
+        found_dict = dict()
+        resource_bucket_dict = self.bucket_dict.get(resource, None)
+        if resource_bucket_dict:
+            if T_b == ag.INF or (self._get_bucket(T_b) - self._get_bucket(T_a) + 1) > len(resource_bucket_dict):
+                bucket_list = list(resource_bucket_dict)
+            else:
+                bucket_list = range(self._get_bucket(T_a), self._get_bucket(T_b) + 1)
+            bucket_a, bucket_b = self._get_bucket(T_a), (self._get_bucket(T_b) if T_b != ag.INF else None)
+            for bucket in bucket_list:
+                if bucket < bucket_a or (bucket_b is not None and bucket > bucket_b):
+                    continue
+                # Copied, a booking may write the table while a search reads it (see GEOMETRY_TASK_GRAPH.book_a_path_concurrent())
+                for record_id, record in list(resource_bucket_dict.get(bucket, dict()).items()):
+                    if record[2] <= T_b and record[3] >= T_a:
+                        found_dict[record_id] = record
+        for record_id, record in list(self.unbounded_dict.get(resource, dict()).items()):
+            if record[2] <= T_b:
+                found_dict[record_id] = record
+        for record_id in sorted(found_dict):
+            record_list.append(found_dict[record_id])
+        return record_list
+
+    def get_agent_list(self, resource, T_zone, agent_id=None):
+        """
+        The distinct agents (excluding agent_id if given) that reserve the resource within T_zone.
+        """
+        agent_list = []
+        for record in self.get_reservations(resource, T_zone):
+            if record[0] != agent_id and not record[0] in agent_list:
+                agent_list.append(record[0])
+        return agent_list
+
+    def is_free(self, resource, T_zone, agent_id=None, capacity=1):
+        """
+        If less than "capacity" agents (excluding agent_id if given) reserve the resource within T_zone.
+        """
+        return (len(self.get_agent_list(resource, T_zone, agent_id)) < capacity)
+
+    def is_node_free(self, node_id, T_zone, agent_id=None):
+        """
+        If the node is not reserved by other agents within T_zone,
+        used by the search engines while relaxing the edges.
+        """
+        return self.is_free((RESOURCE_NODE, node_id), T_zone, agent_id, self.node_capacity)
+    #-------------------------------#
+#-------------------------------#
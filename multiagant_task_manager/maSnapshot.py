@@ -0,0 +1,515 @@
+"""
+Graph snapshots
+This module provides an immutable snapshot of GEOMETRY_TASK_GRAPH laid out as
+flat arrays in one buffer, and the read-only views for searching on it:
+
+    - The topology: the CSR arrays of maCSR plus the static edge properties.
+    - The reservations: the tasks of each edge and the node reservations,
+      grouped by edge_id/node_id (CSR-like offsets).
+
+The views (SNAPSHOT_GRAPH) read the buffer in place (memoryview, zero-copy)
+and build a read-only SNAPSHOT_EDGE only when an edge is visited, so the
+engines in maGraphEngines run on a snapshot the same as on the graph.
+
+SHARED_SNAPSHOT_POOL publishes the snapshot into multiprocessing.shared_memory
+(Python 3.8+) and runs the searches in worker processes, while the parent
+commits the bookings. After commits, only the reservations are published
+again (a new generation); the topology is kept as long as it is unchanged.
+"""
+import array
+import multiprocessing
+import maCSR as csr
+import maEdge as ed
+import maIntervalTree as it
+import maGraphEngines as ge
+import maLogging as lg
+
+try:
+    from multiprocessing import shared_memory # Python 3.8+
+except ImportError:
+    shared_memory = None
+
+logger = lg.get_logger(__name__)
+
+# The offset of every array in the buffer is a multiple of this
+_ALIGNMENT = 8
+# The agent_id that are not int are encoded below this
+_AGENT_CODE_BASE = -(2 ** 62)
+
+
+# Packing
+#-------------------------------#
+def pack_topology(graph):
+    """
+    The topology arrays of a graph.
+    outputs
+        - (array_dict, meta): {name:array.array(), ...}, {'num_nodes':..., 'num_edges':...}
+    """
+    view = csr.CSR_GRAPH.from_adj(graph.adj_graph, graph.edge_list)
+    array_dict = {
+        'offsets':view.offsets, 'targets':view.targets, 'edge_ids':view.edge_ids,
+        'from_node_id':view.from_node_id, 'to_node_id':view.to_node_id,
+        'duration_min':view.duration_min, 'duration_max':view.duration_max, 'capacity':view.capacity,
+        'is_profile_mode':array.array('b', [(1 if edge.capacity_mode == ed.CAPACITY_MODE_PROFILE else 0) for edge in graph.edge_list]),
+    }
+    meta = {'num_nodes':view.num_nodes, 'num_edges':view.num_edges}
+    return (array_dict, meta)
+
+def _encode_agent_id(agent_id, code_dict):
+    if isinstance(agent_id, int) and agent_id > _AGENT_CODE_BASE:
+        return agent_id
+    if not agent_id in code_dict:
+        code_dict[agent_id] = _AGENT_CODE_BASE - len(code_dict)
+    return code_dict[agent_id]
+
+def pack_reservations(graph):
+    """
+    The reservation arrays of a graph, grouped by edge_id (and node_id for the node reservations).
+    outputs
+        - (array_dict, meta)
+    """
+    code_dict = dict()
+    task_offsets = array.array('l', [0])
+    task_agent_id = array.array('l')
+    task_T_min = array.array('d')
+    task_T_max = array.array('d')
+    task_is_activated = array.array('b')
+    for edge in graph.edge_list:
+        for key, node in edge.task_index.node_dict.items():
+            task_agent_id.append(_encode_agent_id(key[0], code_dict))
+            task_T_min.append(node.T_min)
+            task_T_max.append(node.T_max)
+            task_is_activated.append(1 if key in edge.activated_task_index else 0)
+        task_offsets.append(len(task_agent_id))
+    # The node reservations
+    table = graph.reservation_table
+    node_record_list = [[] for _ in range(graph.num_nodes)]
+    if not table is None:
+        for key_record_dict in table.record_dict.values():
+            for resource, record in key_record_dict.values():
+                if resource[0] == 'node':
+                    node_record_list[resource[1]].append(record)
+    node_offsets = array.array('l', [0])
+    node_agent_id = array.array('l')
+    node_T_min = array.array('d')
+    node_T_max = array.array('d')
+    for record_list in node_record_list:
+        for agent_id, task_id, T_min, T_max in record_list:
+            node_agent_id.append(_encode_agent_id(agent_id, code_dict))
+            node_T_min.append(T_min)
+            node_T_max.append(T_max)
+        node_offsets.append(len(node_agent_id))
+    array_dict = {
+        'task_offsets':task_offsets, 'task_agent_id':task_agent_id, 'task_T_min':task_T_min, 'task_T_max':task_T_max, 'task_is_activated':task_is_activated,
+        'node_offsets':node_offsets, 'node_agent_id':node_agent_id, 'node_T_min':node_T_min, 'node_T_max':node_T_max,
+    }
+    meta = {
+        'has_node_reservation':(not table is None),
+        'node_capacity':(table.node_capacity if not table is None else 1),
+        'state_version':graph.state_version,
+    }
+    return (array_dict, meta)
+
+def get_layout(array_dict):
+    """
+    Where each array is put in the buffer.
+    outputs
+        - (header, size): header is a list of (name, typecode, offset, length)
+    """
+    header = []
+    offset = 0
+    for name in sorted(array_dict):
+        data = array_dict[name]
+        header.append( (name, data.typecode, offset, len(data)) )
+        offset += data.itemsize * len(data)
+        offset += (-offset) % _ALIGNMENT
+    return (header, offset)
+
+def write_arrays(buf, header, array_dict):
+    """
+    Copy the arrays into a writable buffer (e.g. SharedMemory.buf or an mmap) by the layout of get_layout().
+    """
+    for name, typecode, offset, length in header:
+        data = array_dict[name]
+        data_bytes = data.tobytes() if hasattr(data, 'tobytes') else data.tostring()
+        buf[offset:(offset + len(data_bytes))] = data_bytes
+
+def read_arrays(buf, header):
+    """
+    The zero-copy views of the arrays in a buffer written by write_arrays()
+    (copies in Python 2, where memoryview.cast() is not available).
+    outputs
+        - (view_dict, view_list): {name:memoryview, ...} and all the memoryviews to be released
+                                  before the buffer is closed (see SNAPSHOT_GRAPH.release())
+    """
+    view_dict = dict()
+    view_list = []
+    buf_view = memoryview(buf)
+    view_list.append(buf_view)
+    for name, typecode, offset, length in header:
+        itemsize = array.array(typecode).itemsize
+        raw_view = buf_view[offset:(offset + itemsize * length)]
+        view_list.append(raw_view)
+        if hasattr(raw_view, 'cast'):
+            view_dict[name] = raw_view.cast(typecode)
+            view_list.append(view_dict[name])
+        else:
+            # Python 2, copied
+            view_dict[name] = array.array(typecode)
+            view_dict[name].fromstring(raw_view.tobytes())
+    return (view_dict, view_list)
+#-------------------------------#
+
+
+# Read-only views
+#-------------------------------#
+class SNAPSHOT_INDEX(object):
+    """
+    The interface of it.INTERVAL_TREE used by EDGE, over some rows of the snapshot arrays
+    (the intervals are scanned, since an edge holds a few of them).
+    The key of a row is (agent_id, row).
+    """
+    _normalize = staticmethod(it.INTERVAL_TREE._normalize)
+
+    def __init__(self, row_list, agent_id, T_min, T_max):
+        self.row_list = row_list
+        self.agent_id = agent_id
+        self.T_min = T_min
+        self.T_max = T_max
+
+    def __len__(self):
+        return len(self.row_list)
+
+    def query_intervals(self, T_zone):
+        T_a, T_b = self._normalize(T_zone)
+        if T_b < T_a:
+            return []
+        T_min, T_max = self.T_min, self.T_max
+        agent_id = self.agent_id
+        return [(T_min[row], T_max[row], (agent_id[row], row)) for row in self.row_list if T_min[row] <= T_b and T_max[row] >= T_a]
+
+    def query(self, T_zone):
+        return [key for T_min, T_max, key in self.query_intervals(T_zone)]
+
+    def count(self, T_zone):
+        return len(self.query_intervals(T_zone))
+
+class SNAPSHOT_EDGE(ed.EDGE):
+    """
+    A read-only EDGE over the snapshot arrays, for the searches only
+    (the capacity checks and the T_zone propagation of EDGE are inherited,
+    the methods changing the states must not be called).
+    """
+    def __init__(self, edge_id, from_node_id, to_node_id, duration, capacity, capacity_mode, task_index, activated_task_index):
+        self.edge_id = edge_id
+        self.from_node_id = from_node_id
+        self.to_node_id = to_node_id
+        self.duration = duration
+        self.capacity = capacity
+        self.capacity_mode = capacity_mode
+        self.task_index = task_index
+        self.activated_task_index = activated_task_index
+
+class SNAPSHOT_EDGE_LIST(object):
+    """
+    The edge list of a snapshot, a SNAPSHOT_EDGE is built when it is first visited.
+    """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._edge_dict = dict()
+
+    def __len__(self):
+        return self.snapshot.num_edges
+
+    def __getitem__(self, edge_id):
+        edge = self._edge_dict.get(edge_id, None)
+        if edge is None:
+            edge = self.snapshot._build_edge(edge_id)
+            self._edge_dict[edge_id] = edge
+        return edge
+
+    def __iter__(self):
+        for edge_id in range(len(self)):
+            yield self[edge_id]
+
+class SNAPSHOT_NODE_TABLE(object):
+    """
+    The interface of maReservation.RESERVATION_TABLE used by the searches, over the snapshot arrays.
+    """
+    def __init__(self, view_dict, node_capacity):
+        self.view_dict = view_dict
+        self.node_capacity = node_capacity
+
+    def is_node_free(self, node_id, T_zone, agent_id=None):
+        T_a, T_b = it.INTERVAL_TREE._normalize(T_zone)
+        if T_b < T_a:
+            return True
+        view_dict = self.view_dict
+        node_agent_id, T_min, T_max = view_dict['node_agent_id'], view_dict['node_T_min'], view_dict['node_T_max']
+        agent_set = set()
+        for row in range(view_dict['node_offsets'][node_id], view_dict['node_offsets'][node_id + 1]):
+            if T_min[row] <= T_b and T_max[row] >= T_a and node_agent_id[row] != agent_id:
+                agent_set.add(node_agent_id[row])
+        return (len(agent_set) < self.node_capacity)
+
+class SNAPSHOT_GRAPH(object):
+    """
+    The searchable view of a snapshot.
+        - adj: csr.CSR_GRAPH over the topology arrays
+        - edges: SNAPSHOT_EDGE_LIST
+        - reservation_table: SNAPSHOT_NODE_TABLE, or "None" if the nodes are not reserved
+    """
+    def __init__(self, topology_view_dict, topology_meta, reservation_view_dict, reservation_meta):
+        view_dict = topology_view_dict
+        self.num_nodes = topology_meta['num_nodes']
+        self.num_edges = topology_meta['num_edges']
+        self.topology_view_dict = topology_view_dict
+        self.adj = csr.CSR_GRAPH(view_dict['offsets'], view_dict['targets'], view_dict['edge_ids'],
+                                 view_dict['from_node_id'], view_dict['to_node_id'],
+                                 view_dict['duration_min'], view_dict['duration_max'], view_dict['capacity'])
+        self._adj_reversed = None
+        self._lower_bound_dict = dict() # {target_id:[...], ...}, the topology does not change
+        self.set_reservations(reservation_view_dict, reservation_meta)
+
+    def set_reservations(self, reservation_view_dict, reservation_meta):
+        """
+        Switch to another generation of the reservations of the same topology.
+        """
+        self.reservation_view_dict = reservation_view_dict
+        self.reservation_meta = reservation_meta
+        self.edges = SNAPSHOT_EDGE_LIST(self)
+        if reservation_meta['has_node_reservation']:
+            self.reservation_table = SNAPSHOT_NODE_TABLE(reservation_view_dict, reservation_meta['node_capacity'])
+        else:
+            self.reservation_table = None
+
+    def get_adj_reversed(self):
+        if self._adj_reversed is None:
+            self._adj_reversed = self.adj.get_reversed()
+        return self._adj_reversed
+
+    def _build_edge(self, edge_id):
+        topology = self.topology_view_dict
+        view_dict = self.reservation_view_dict
+        duration_max = topology['duration_max'][edge_id]
+        duration = (int(topology['duration_min'][edge_id]), (int(duration_max) if duration_max != float('inf') else duration_max))
+        row_list = list(range(view_dict['task_offsets'][edge_id], view_dict['task_offsets'][edge_id + 1]))
+        activated_row_list = [row for row in row_list if view_dict['task_is_activated'][row]]
+        return SNAPSHOT_EDGE(edge_id, topology['from_node_id'][edge_id], topology['to_node_id'][edge_id], duration, topology['capacity'][edge_id],
+                             (ed.CAPACITY_MODE_PROFILE if topology['is_profile_mode'][edge_id] else ed.CAPACITY_MODE_INTERVAL),
+                             SNAPSHOT_INDEX(row_list, view_dict['task_agent_id'], view_dict['task_T_min'], view_dict['task_T_max']),
+                             SNAPSHOT_INDEX(activated_row_list, view_dict['task_agent_id'], view_dict['task_T_min'], view_dict['task_T_max']))
+
+    def search(self, T_zone_start, start_id, end_id, agent_id=None, search_engine=ge.SEARCH_ENGINE_ASTAR):
+        """
+        The same as GEOMETRY_TASK_GRAPH._search_path() (forward, not top_priority_for_activated_agent),
+        where A* uses the static lower bounds, and ge.SEARCH_ENGINE_PRIORITY_QUEUE is replaced by ge.SEARCH_ENGINE_HEAPQ.
+        outputs
+            - path/None
+        """
+        if search_engine == ge.SEARCH_ENGINE_ASTAR:
+            if not end_id in self._lower_bound_dict:
+                self._lower_bound_dict[end_id] = ge.dijkstras_static(self.get_adj_reversed(), self.edges, end_id)
+            return ge.astar(self.adj, self.edges, T_zone_start, start_id, end_id, False, agent_id, self._lower_bound_dict[end_id], reservation_table=self.reservation_table)
+        return ge.dijkstras_heapq(self.adj, self.edges, T_zone_start, start_id, end_id, False, agent_id, reservation_table=self.reservation_table)
+#-------------------------------#
+
+
+# Searching in worker processes on the shared memory
+#-------------------------------#
+_worker_state = {'topology':None, 'reservation':None, 'snapshot':None}
+
+def _attach_shared_memory(name):
+    """
+    Attach an existing block without letting this process unlink it at exit.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python 3.13+
+    except TypeError:
+        # The workers share the resource tracker of the parent, which unlinks the blocks
+        return shared_memory.SharedMemory(name=name)
+
+def _release_worker_block(block):
+    if block is None:
+        return
+    shm, view_list = block[1], block[2]
+    for view in reversed(view_list):
+        view.release()
+    shm.close()
+
+def _get_worker_snapshot(topology_header, reservation_header):
+    """
+    The SNAPSHOT_GRAPH of a generation in a worker, re-attaching only the blocks that changed.
+    """
+    state = _worker_state
+    topology_name, reservation_name = topology_header[0], reservation_header[0]
+    is_topology_changed = (state['topology'] is None or state['topology'][0] != topology_name)
+    is_reservation_changed = (state['reservation'] is None or state['reservation'][0] != reservation_name)
+    if is_topology_changed or is_reservation_changed:
+        # Drop the views before closing the blocks
+        state['snapshot'] = None
+        if is_reservation_changed:
+            _release_worker_block(state['reservation'])
+            shm = _attach_shared_memory(reservation_name)
+            view_dict, view_list = read_arrays(shm.buf, reservation_header[1])
+            state['reservation'] = (reservation_name, shm, view_list, view_dict)
+        if is_topology_changed:
+            _release_worker_block(state['topology'])
+            shm = _attach_shared_memory(topology_name)
+            view_dict, view_list = read_arrays(shm.buf, topology_header[1])
+            state['topology'] = (topology_name, shm, view_list, view_dict)
+            state['topology_snapshot'] = SNAPSHOT_GRAPH(view_dict, topology_header[2], state['reservation'][3], reservation_header[2])
+        else:
+            state['topology_snapshot'].set_reservations(state['reservation'][3], reservation_header[2])
+        state['snapshot'] = state['topology_snapshot']
+    return state['snapshot']
+
+def _search_in_worker(args):
+    topology_header, reservation_header, search_engine, query_list = args
+    snapshot = _get_worker_snapshot(topology_header, reservation_header)
+    return [snapshot.search(T_zone_start, start_id, end_id, agent_id, search_engine) for T_zone_start, start_id, end_id, agent_id in query_list]
+
+class SHARED_SNAPSHOT_POOL(object):
+    """
+    Parallel searches over a snapshot of a graph in multiprocessing.shared_memory.
+
+    Properties
+        - graph: GEOMETRY_TASK_GRAPH
+        - num_workers
+
+    States
+        - generation: increased every time the reservations are published
+        - topology_block, reservation_block: (SharedMemory, header, meta) of the published snapshot
+        - topology_key: the topology of the published block, re-published only if changed
+    """
+    def __init__(self, graph, num_workers=None):
+        """
+        inputs
+            - graph: GEOMETRY_TASK_GRAPH
+            - num_workers (default: None): "None" means the number of CPUs
+        """
+        self.graph = graph
+        self.num_workers = num_workers
+        #
+        self.generation = 0
+        self.topology_block = None
+        self.reservation_block = None
+        self.topology_key = None
+        self._pool = None
+        if shared_memory is None:
+            logger.error('multiprocessing.shared_memory (Python 3.8+) is not available, the searches run in this process.')
+
+    def _create_block(self, array_dict, meta):
+        header, size = get_layout(array_dict)
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        write_arrays(shm.buf, header, array_dict)
+        return (shm, header, meta)
+
+    @staticmethod
+    def _unlink_block(block):
+        if block is None:
+            return
+        block[0].close()
+        block[0].unlink()
+
+    def publish(self):
+        """
+        Publish the current states as a new generation.
+        The topology is published again only if the nodes, edges, or the capacity mode changed.
+        outputs
+            - the generation
+        """
+        if shared_memory is None:
+            return self.generation
+        graph = self.graph
+        topology_key = (graph.num_nodes, graph.num_edges, graph.capacity_mode)
+        if topology_key != self.topology_key:
+            block = self._create_block(*pack_topology(graph))
+            self._unlink_block(self.topology_block)
+            self.topology_block = block
+            self.topology_key = topology_key
+        # The workers holding the old generation keep their mappings until they switch
+        block = self._create_block(*pack_reservations(graph))
+        self._unlink_block(self.reservation_block)
+        self.reservation_block = block
+        self.generation += 1
+        logger.info('The snapshot generation %d is published.', self.generation)
+        return self.generation
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.num_workers)
+        return self._pool
+
+    def search_paths(self, query_list):
+        """
+        Search in parallel on the snapshot, which is published again first if the graph changed since the last one.
+        inputs
+            - query_list: a list of (T_zone_start, start_id, end_id, agent_id)
+        outputs
+            - a list of path/None, in the same order as query_list
+        """
+        graph = self.graph
+        if shared_memory is None:
+            return [graph._search_path(T_zone_start, start_id, end_id, False, agent_id) for T_zone_start, start_id, end_id, agent_id in query_list]
+        if self.reservation_block is None or self.reservation_block[2]['state_version'] != graph.state_version or self.topology_key != (graph.num_nodes, graph.num_edges, graph.capacity_mode):
+            self.publish()
+        topology_header = (self.topology_block[0].name, self.topology_block[1], self.topology_block[2])
+        reservation_header = (self.reservation_block[0].name, self.reservation_block[1], self.reservation_block[2])
+        pool = self._get_pool()
+        num_chunks = max(1, min(len(query_list), 4 * (self.num_workers or multiprocessing.cpu_count())))
+        chunk_list = [query_list[k::num_chunks] for k in range(num_chunks)]
+        result_chunk_list = pool.map(_search_in_worker, [(topology_header, reservation_header, graph.search_engine, chunk) for chunk in chunk_list])
+        path_list = [None] * len(query_list)
+        for k, result_chunk in enumerate(result_chunk_list):
+            path_list[k::num_chunks] = result_chunk
+        return path_list
+
+    def book_paths(self, request_list):
+        """
+        Search for all the requests in parallel on the snapshot, then commit in this process in the given order.
+        A path invalidated by an earlier commit is searched again on the graph.
+        inputs
+            - request_list: a list of (T_zone_start, start_id, end_id, agent_id, task_id)
+        outputs
+            - result_list: see GEOMETRY_TASK_GRAPH.book_paths(), the priorities are not supported
+        """
+        graph = self.graph
+        path_list = self.search_paths([request[:4] for request in request_list])
+        result_list = []
+        for (T_zone_start, start_id, end_id, agent_id, task_id), path in zip(request_list, path_list):
+            result = {'path':None, 'is_booked':False, 'reason':'no_path'}
+            result_list.append(result)
+            if path is None:
+                continue
+            if (not graph.reservation_table is None) and (not graph.reservation_table.is_node_free(start_id, T_zone_start, agent_id)):
+                # The start node is reserved by other agents
+                continue
+            if not graph._add_agent_by_path(path, T_zone_start, agent_id, task_id, False):
+                # Out-dated by the earlier commits, search again on the graph
+                path = graph._search_path(T_zone_start, start_id, end_id, False, agent_id)
+                if path is None:
+                    continue
+                result['path'] = path
+                if not graph._add_agent_by_path(path, T_zone_start, agent_id, task_id, False):
+                    result['reason'] = 'booking_failed'
+                    continue
+            result.update({'path':path, 'is_booked':True, 'reason':None})
+        logger.info('%d of %d requests are booked.', sum(1 for result in result_list if result['is_booked']), len(request_list))
+        return result_list
+
+    def close(self):
+        """
+        Stop the workers and free the shared memory.
+        """
+        if not self._pool is None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self._unlink_block(self.reservation_block)
+        self._unlink_block(self.topology_block)
+        self.reservation_block = None
+        self.topology_block = None
+        self.topology_key = None
+        return True
+#-------------------------------#
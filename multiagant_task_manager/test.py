@@ -1,6 +1,9 @@
+import logging
 import geometryTaskGraph as gtg
 import maGraphEngines as ge
 
+logging.basicConfig(format='%(levelname)s: %(message)s')
+gtg.GEOMETRY_TASK_GRAPH.set_verbosity(logging.DEBUG) # Process-wide
 graph = gtg.GEOMETRY_TASK_GRAPH()
 
 graph.add_one_node_by_name('A')
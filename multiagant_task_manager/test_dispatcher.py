@@ -0,0 +1,50 @@
+"""
+Tests of the asynchronous dispatcher (Python 3.5+ only, see maDispatcher).
+
+Run with "python -m pytest" or "python test_dispatcher.py" in this folder.
+"""
+import asyncio
+import unittest
+import maDispatcher as dp
+from test_engines import make_random_graph
+
+
+class TEST_DISPATCHER(unittest.TestCase):
+    def _run_batch(self, graph, request_list):
+        # Submit all the requests within the same tick
+        async def main():
+            dispatcher = dp.DISPATCHER(graph, tick=0.05)
+            await dispatcher.start()
+            future_list = [await dispatcher.submit(kind, args) for kind, args in request_list]
+            result_list = [await future for future in future_list]
+            await dispatcher.stop()
+            self.assertEqual(dispatcher.num_batches, 1)
+            return result_list
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(main())
+        finally:
+            loop.close()
+
+    def test_same_agent_keeps_submission_order(self):
+        graph = make_random_graph(10, 30, 0, num_tasks=0)
+        # Cancel after book, the reservation is not leaked
+        result_list = self._run_batch(graph, [(dp.REQUEST_BOOK, ((0, 0), 0, 5, 7, 1)), (dp.REQUEST_CANCEL, (7, None))])
+        self.assertTrue(all(result['is_done'] for result in result_list))
+        self.assertEqual(graph.get_agent_reservations(7), [])
+        # Book after cancel, the booking stays
+        result_list = self._run_batch(graph, [(dp.REQUEST_CANCEL, (8, None)), (dp.REQUEST_BOOK, ((0, 0), 0, 5, 8, 1))])
+        self.assertTrue(result_list[1]['is_done'])
+        self.assertEqual(len(graph.get_agent_reservations(8)), len(result_list[1]['path']) - 1)
+
+    def test_round_list(self):
+        request_list = [(dp.REQUEST_BOOK, ((0, 0), 0, 1, 7, 1), 0),
+                        (dp.REQUEST_CANCEL, (8, None), 1),
+                        (dp.REQUEST_CANCEL, (7, None), 2),
+                        (dp.REQUEST_BOOK, ((0, 0), 0, 1, 8, 1), 3)]
+        # The cancellation of agent 8 is still hoisted before the booking of agent 7
+        self.assertEqual(dp.DISPATCHER._get_round_list(request_list), [[0, 1, 3], [2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+"""
+Randomized tests of the search engines against the reference dijkstras_heapq(),
+and of the traversal kernels against a plain BFS.
+
+Run with "python -m pytest" or "python test_engines.py" in this folder.
+"""
+import collections
+import multiprocessing
+import random
+import unittest
+import geometryTaskGraph as gtg
+import maGraphEngines as ge
+
+
+def make_random_graph(num_nodes, num_edges, seed, num_tasks=20, is_fixed_duration=True, max_duration=4):
+    """
+    A random graph with some tasks booked on the edges.
+    With is_fixed_duration, duration = (d, d), so that the T_zone of a node is determined by its distance,
+    and all the engines agree on the reachability regardless of how the ties are broken.
+    """
+    rnd = random.Random(seed)
+    graph = gtg.GEOMETRY_TASK_GRAPH()
+    for nid in range(num_nodes):
+        graph.add_one_node_by_name('N%d' % nid)
+    for _ in range(num_edges):
+        from_node_id, to_node_id = rnd.randrange(num_nodes), rnd.randrange(num_nodes)
+        if from_node_id == to_node_id:
+            continue
+        dT_min = rnd.randint(0, max_duration)
+        dT_max = dT_min if is_fixed_duration else (dT_min + rnd.randint(0, 3))
+        graph.add_one_edge_by_node_id(from_node_id, to_node_id, (rnd.random() < 0.7), rnd.randint(1, 2), (dT_min, dT_max))
+    for task_id in range(num_tasks):
+        if not graph.edge_list:
+            break
+        edge = rnd.choice(graph.edge_list)
+        T_min = rnd.randint(0, 40)
+        T_zone = (T_min, T_min + rnd.randint(0, 10))
+        if edge.is_available_for_T_zone(T_zone):
+            edge.put_agent(rnd.randint(100, 105), task_id, (rnd.random() < 0.5), T_zone)
+    return graph
+
+def get_path_cost(graph, path):
+    if path is None:
+        return None
+    return sum(graph.edge_list[eid].duration[1] for eid in graph._get_edge_list_from_path(path))
+
+def get_reachable_set_by_bfs(adj, source_id, is_undirected=False):
+    neighbor_list = [[to_nid for to_nid, eid in adj[nid]] for nid in range(len(adj))]
+    if is_undirected:
+        for nid in range(len(adj)):
+            for to_nid, eid in adj[nid]:
+                neighbor_list[to_nid].append(nid)
+    visited = set([source_id])
+    queue = collections.deque([source_id])
+    while queue:
+        nid = queue.popleft()
+        for to_nid in neighbor_list[nid]:
+            if not to_nid in visited:
+                visited.add(to_nid)
+                queue.append(to_nid)
+    return visited
+
+
+class TEST_TRAVERSAL(unittest.TestCase):
+    def test_reachability_on_long_chain(self):
+        # Deeper than the recursion limit
+        graph = gtg.GEOMETRY_TASK_GRAPH()
+        num_nodes = 5000
+        for nid in range(num_nodes):
+            graph.add_one_node_by_name(nid)
+        for nid in range(num_nodes - 1):
+            graph.add_one_edge_by_node_id(nid, nid + 1, False, 1, (1, 1))
+        self.assertTrue(ge.reachability(0, num_nodes - 1, graph.adj_graph, graph.edge_list, True))
+        self.assertFalse(ge.reachability(num_nodes - 1, 0, graph.adj_graph, graph.edge_list, True))
+        self.assertEqual(ge.number_of_connected_components(graph.adj_graph, graph.edge_list, True), 1)
+
+    def test_reachability_matches_bfs(self):
+        for seed in range(30):
+            graph = make_random_graph(25, 40, seed, num_tasks=0)
+            for x in range(25):
+                reachable_set = get_reachable_set_by_bfs(graph.adj_graph, x)
+                for y in range(25):
+                    self.assertEqual(ge.reachability(x, y, graph.adj_graph, graph.edge_list, False), (y in reachable_set), (seed, x, y))
+
+    def test_components_are_weakly_connected(self):
+        # A->B<-C is one component, although C is not reachable from A
+        graph = gtg.GEOMETRY_TASK_GRAPH()
+        for name in 'ABCD':
+            graph.add_one_node_by_name(name)
+        graph.add_one_edge_by_node_name('A', 'B', False)
+        graph.add_one_edge_by_node_name('C', 'B', False)
+        self.assertEqual(ge.number_of_connected_components(graph.adj_graph, graph.edge_list, False), 2)
+        for seed in range(30):
+            graph = make_random_graph(25, 20, seed, num_tasks=0)
+            component_set = set()
+            for nid in range(25):
+                component_set.add(frozenset(get_reachable_set_by_bfs(graph.adj_graph, nid, is_undirected=True)))
+            self.assertEqual(ge.number_of_connected_components(graph.adj_graph, graph.edge_list, False), len(component_set), seed)
+
+
+class TEST_SEARCH_ENGINES(unittest.TestCase):
+    def test_engines_agree_with_dijkstras_heapq(self):
+        for seed in range(40):
+            graph = make_random_graph(20, 45, seed)
+            adj_csr = graph.get_csr_graph()
+            rnd = random.Random(seed)
+            for _ in range(15):
+                start_id, end_id = rnd.randrange(20), rnd.randrange(20)
+                T_min = rnd.randint(0, 40)
+                T_zone = (T_min, T_min + rnd.randint(0, 3))
+                path = ge.dijkstras_heapq(graph.adj_graph, graph.edge_list, T_zone, start_id, end_id)
+                cost = get_path_cost(graph, path)
+                if not path is None:
+                    self.assertTrue(graph.is_path_available(path, T_zone), (seed, path))
+                for path_i in [ge.dijkstras(graph.adj_graph, graph.edge_list, T_zone, start_id, end_id),
+                               ge.astar(graph.adj_graph, graph.edge_list, T_zone, start_id, end_id),
+                               ge.dijkstras_heapq(adj_csr, graph.edge_list, T_zone, start_id, end_id),
+                               ge.astar(adj_csr, graph.edge_list, T_zone, start_id, end_id),
+                               ge.dijkstras_single_source(graph.adj_graph, graph.edge_list, T_zone, start_id).get_path(end_id)]:
+                    self.assertEqual(get_path_cost(graph, path_i), cost, (seed, start_id, end_id, T_zone, path, path_i))
+
+    def test_static_lower_bounds(self):
+        for seed in range(20):
+            graph = make_random_graph(20, 45, seed, num_tasks=0)
+            for source_id in range(0, 20, 5):
+                dist = ge.dijkstras_static(graph.adj_graph, graph.edge_list, source_id)
+                self.assertEqual(ge.dijkstras_static(graph.get_csr_graph(), graph.edge_list, source_id), dist)
+                for end_id in range(20):
+                    cost = get_path_cost(graph, ge.dijkstras_heapq(graph.adj_graph, graph.edge_list, (0, 0), source_id, end_id))
+                    self.assertEqual(dist[end_id], (float('inf') if cost is None else cost))
+
+    def test_incremental_search_with_zero_durations(self):
+        # The (0, 0) edges give ties of g between a node and its ancestors
+        for seed in range(30):
+            graph = make_random_graph(20, 45, seed, num_tasks=0)
+            adj_reversed = ge.generate_reverse_graph(graph.adj_graph)
+            rnd = random.Random(seed)
+            search_list = []
+            for _ in range(8):
+                T_min = rnd.randint(0, 20)
+                search = ge.INCREMENTAL_SEARCH(graph.adj_graph, adj_reversed, graph.edge_list, (T_min, T_min), rnd.randrange(20), rnd.randrange(20))
+                for edge in graph.edge_list:
+                    edge.add_state_listener(search.on_edge_state_changed)
+                search_list.append(search)
+            booked_list = []
+            for agent_id in range(16):
+                if booked_list and rnd.random() < 0.4:
+                    graph._remove_agent_from_all_edges(booked_list.pop(rnd.randrange(len(booked_list))))
+                elif agent_id > 0:
+                    # Fill the edge up
+                    edge = rnd.choice(graph.edge_list)
+                    T_min = rnd.randint(0, 30)
+                    for k in range(edge.capacity):
+                        if edge.put_agent(100 * k + agent_id, 0, False, (T_min, T_min + rnd.randint(0, 6))):
+                            booked_list.append(100 * k + agent_id)
+                for search in search_list:
+                    path = ge.dijkstras_heapq(graph.adj_graph, graph.edge_list, search.T_zone_start, search.start_id, search.end_id)
+                    self.assertEqual(get_path_cost(graph, search.get_path()), get_path_cost(graph, path), (seed, agent_id, search.start_id, search.end_id))
+
+    @unittest.skipUnless(hasattr(multiprocessing, 'set_start_method'), 'The start methods need Python 3.4+')
+    def test_distance_matrix_on_spawned_workers(self):
+        # The edges are sent to the workers without the listeners of the graph (which hold its locks)
+        graph = make_random_graph(20, 45, 0)
+        source_list = [((T_min, T_min), T_min) for T_min in range(0, 20, 4)]
+        target_list = list(range(20))
+        expected = graph.query_distance_matrix(source_list, target_list)
+        start_method = multiprocessing.get_start_method()
+        multiprocessing.set_start_method('spawn', force=True)
+        try:
+            self.assertEqual(graph.query_distance_matrix(source_list, target_list, num_workers=2), expected)
+        finally:
+            multiprocessing.set_start_method(start_method, force=True)
+        self.assertTrue(all(edge.state_listener_list for edge in graph.edge_list))
+
+
+if __name__ == '__main__':
+    unittest.main()
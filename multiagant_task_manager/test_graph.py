@@ -0,0 +1,338 @@
+"""
+Randomized tests of GEOMETRY_TASK_GRAPH, the maintained structures are compared
+against re-computing from scratch after random bookings and cancellations.
+
+Run with "python -m pytest" or "python test_graph.py" in this folder.
+"""
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import unittest
+import geometryTaskGraph as gtg
+import maCBS as cbs
+import maColumnar as cl
+import maEdge as ed
+import maGraphEngines as ge
+import maReservation as rs
+import maSnapshot as sn
+from test_engines import make_random_graph
+
+
+def make_bay_graph():
+    """
+    A corridor 0-1-2 with a bay 3 off node 1, with the node reservation.
+    """
+    graph = gtg.GEOMETRY_TASK_GRAPH()
+    for nid in range(4):
+        graph.add_one_node_by_name(nid)
+    for from_node_id, to_node_id in [(0, 1), (1, 2), (1, 3)]:
+        graph.add_one_edge_by_node_id(from_node_id, to_node_id, True, 1, (1, 1))
+    graph.set_node_reservation(True)
+    return graph
+
+
+class TEST_CONNECTIVITY_TRACKER(unittest.TestCase):
+    def test_tracker_matches_traversal(self):
+        T_zone = (10, 20)
+        for seed in range(20):
+            graph = make_random_graph(25, 45, seed, num_tasks=0)
+            graph.track_connectivity(T_zone)
+            rnd = random.Random(seed)
+            booked_list = []
+            for agent_id in range(60):
+                if booked_list and rnd.random() < 0.3:
+                    graph._remove_agent_from_all_edges(booked_list.pop(rnd.randrange(len(booked_list))))
+                else:
+                    edge = rnd.choice(graph.edge_list)
+                    T_min = rnd.randint(0, 30)
+                    if edge.put_agent(agent_id, 0, False, (T_min, T_min + rnd.randint(0, 5))):
+                        booked_list.append(agent_id)
+                if agent_id % 5 == 0:
+                    graph.add_one_node_by_name('M%d' % agent_id)
+                    graph.add_one_edge_by_node_id(graph.num_nodes - 1, rnd.randrange(graph.num_nodes - 1), (rnd.random() < 0.5), 1, (1, 1))
+                tracker = graph.track_connectivity(T_zone)
+                self.assertEqual(tracker.number_of_connected_components(),
+                                 ge.number_of_connected_components(graph.adj_graph, graph.edge_list, True, T_zone), (seed, agent_id))
+                x, y = rnd.randrange(graph.num_nodes), rnd.randrange(graph.num_nodes)
+                self.assertEqual(graph.is_reachable(x, y, T_zone), ge.reachability(x, y, graph.adj_graph, graph.edge_list, True, T_zone), (seed, agent_id, x, y))
+
+
+class TEST_BOOKING(unittest.TestCase):
+    def test_prioritized_paths_are_bookable(self):
+        # A path passing an edge twice is booked with one T_zone covering both passes,
+        # which is what the search has to check
+        for seed in range(60):
+            graph = make_random_graph(15, 30, seed, num_tasks=30, is_fixed_duration=False)
+            if seed % 2 == 1:
+                graph.set_node_reservation(True)
+            rnd = random.Random(seed)
+            request_list = []
+            for k in range(12):
+                T_min = rnd.randint(0, 20)
+                request_list.append( ((T_min, T_min + 1), rnd.randrange(15), rnd.randrange(15), 200 + k, 0) )
+            for result in graph.book_paths_prioritized(request_list):
+                self.assertNotEqual(result['reason'], 'booking_failed', seed)
+            for edge in graph.edge_list:
+                self.assertTrue(edge.get_max_load_for_T_zone((0, None)) <= edge.capacity, seed)
+
+    def test_prioritized_path_steps_aside_into_a_bay(self):
+        # Agent 2 has to wait in the bay for agent 1 to pass
+        graph = make_bay_graph()
+        self.assertTrue(graph._add_agent_by_path([0, 1, 2], (0, 0), 1, 0, False, [2, 0, 0]))
+        result = graph.book_paths_prioritized([((0, 0), 2, 0, 2, 0)])[0]
+        self.assertTrue(result['is_booked'], result)
+        self.assertEqual(result['path'], [2, 1, 3, 1, 0])
+        for edge in graph.edge_list:
+            self.assertTrue(edge.get_max_load_for_T_zone((0, None)) <= edge.capacity)
+
+    def test_failed_commit_is_rolled_back(self):
+        # The third edge fails after the first two are written
+        graph = gtg.GEOMETRY_TASK_GRAPH()
+        for nid in range(4):
+            graph.add_one_node_by_name(nid)
+        for nid in range(3):
+            graph.add_one_edge_by_node_id(nid, nid + 1, True, 1, (1, 1))
+        graph.set_node_reservation(True)
+        self.assertTrue(graph.query_path_exist((0, 0), 0, 3))
+        edge = graph.edge_list[graph.edge_id_dict[(2, 3)]]
+        edge._put_agent_unchecked = lambda agent_id, task_id, is_activated=False, T_zone=(0,None): False
+        state_version = graph.state_version
+        self.assertFalse(graph._add_agent_by_path([0, 1, 2, 3], (0, 0), 1, 0, False))
+        del edge._put_agent_unchecked
+        for edge_i in graph.edge_list:
+            self.assertFalse(edge_i.is_agent_in_edge(1))
+        self.assertEqual(graph.get_agent_reservations(1), [])
+        self.assertEqual(len(graph.reservation_table), 0)
+        self.assertNotEqual(graph.state_version, state_version)
+        self.assertEqual(len(graph._path_cache), 0)
+        self.assertTrue(graph.book_a_path((0, 0), 0, 3, 1, 0))
+
+    def test_concurrent_bookings_never_overcommit(self):
+        # The commits run under the locks of their own edges/nodes only
+        switch_interval = sys.getswitchinterval() if hasattr(sys, 'getswitchinterval') else None
+        if not switch_interval is None:
+            sys.setswitchinterval(1e-5)
+        try:
+            for seed in range(4):
+                graph = make_random_graph(30, 80, seed, num_tasks=0)
+                if seed % 2 == 1:
+                    graph.set_capacity_mode(ed.CAPACITY_MODE_PROFILE)
+                if seed < 2:
+                    graph.set_node_reservation(True)
+                error_list = []
+                def book(worker_id):
+                    rnd = random.Random(seed * 100 + worker_id)
+                    try:
+                        for k in range(40):
+                            T_min = rnd.randint(0, 30)
+                            agent_id = 1000 * worker_id + k
+                            graph.book_a_path_concurrent((T_min, T_min + rnd.randint(0, 2)), rnd.randrange(30), rnd.randrange(30), agent_id, 0)
+                            if rnd.random() < 0.1:
+                                graph.remove_agent_concurrent(agent_id - rnd.randint(0, k))
+                    except Exception as e:
+                        error_list.append(e)
+                thread_list = [threading.Thread(target=book, args=(worker_id,)) for worker_id in range(6)]
+                for thread in thread_list:
+                    thread.start()
+                for thread in thread_list:
+                    thread.join()
+                self.assertEqual(error_list, [], seed)
+                for edge in graph.edge_list:
+                    self.assertTrue(edge.get_max_load_for_T_zone((0, None)) <= edge.capacity, (seed, edge.edge_id))
+                table = graph.reservation_table
+                if table is None:
+                    continue
+                for key_record_dict in table.record_dict.values():
+                    for resource, record in key_record_dict.values():
+                        if resource[0] == rs.RESOURCE_NODE:
+                            self.assertTrue(table.is_node_free(resource[1], (record[2], record[3]), record[0]), (seed, resource, record))
+        finally:
+            if not switch_interval is None:
+                sys.setswitchinterval(switch_interval)
+
+    def test_release_keeps_unrelated_cached_paths(self):
+        # Two separate chains, releasing the nodes of one keeps the cached paths of the other
+        graph = gtg.GEOMETRY_TASK_GRAPH()
+        for nid in range(8):
+            graph.add_one_node_by_name(nid)
+        for nid in [0, 1, 2, 4, 5, 6]:
+            graph.add_one_edge_by_node_id(nid, nid + 1, False, 1, (1, 1))
+        graph.set_node_reservation(True)
+        self.assertTrue(graph.book_a_path((0, 0), 0, 3, 1, 0))
+        self.assertFalse(graph.query_path_exist((1, 1), 1, 3))
+        self.assertTrue(graph.query_path_exist((0, 0), 4, 7))
+        self.assertEqual(len(graph._path_cache), 2)
+        graph.remove_agent_concurrent(1)
+        self.assertEqual(len(graph._path_cache), 1)
+        self.assertTrue(graph.query_path_exist((1, 1), 1, 3))
+
+    def test_agent_reservations_survive_save_and_load(self):
+        # The T_zones are kept only in the interval indexes of the edges
+        graph = make_random_graph(15, 30, 3, num_tasks=30, is_fixed_duration=False)
+        graph.set_node_reservation(True)
+        graph.book_paths_prioritized([((k, k + 1), k, 14 - k, 200 + k, 0) for k in range(6)])
+        agent_id_list = sorted(graph.agent_reservation_dict)
+        reservation_dict = dict((agent_id, graph.get_agent_reservations(agent_id)) for agent_id in agent_id_list)
+        for agent_id in agent_id_list:
+            for task_id, edge_id, T_zone in reservation_dict[agent_id]:
+                self.assertTrue(graph.edge_list[edge_id].is_agent_in_edge(agent_id))
+                _agent = graph.edge_list[edge_id].agent_dict[agent_id]
+                self.assertEqual(_agent.task_dict[task_id].T_zone, tuple(T_zone))
+                self.assertTrue(_agent.is_period_intersected((T_zone[1], T_zone[1] + 1)))
+                self.assertIn((agent_id, task_id) + tuple(T_zone), graph.reservation_table.get_reservations((rs.RESOURCE_EDGE, edge_id), T_zone))
+        file_path = os.path.join(tempfile.mkdtemp(), 'graph.bin')
+        self.assertTrue(graph.save(file_path))
+        graph_loaded = gtg.GEOMETRY_TASK_GRAPH()
+        self.assertTrue(graph_loaded.load(file_path))
+        for agent_id in agent_id_list:
+            self.assertEqual(graph_loaded.get_agent_reservations(agent_id), reservation_dict[agent_id])
+
+    def test_loaded_graph_builds_only_the_searched_edges(self):
+        graph = gtg.GEOMETRY_TASK_GRAPH()
+        width = 20
+        for nid in range(width * width):
+            graph.add_one_node_by_name(nid)
+        for row in range(width):
+            for col in range(width - 1):
+                graph.add_one_edge_by_node_id(row * width + col, row * width + col + 1, True, 1, (1, 1))
+                graph.add_one_edge_by_node_id(col * width + row, (col + 1) * width + row, True, 1, (1, 1))
+        file_path = os.path.join(tempfile.mkdtemp(), 'graph.bin')
+        self.assertTrue(graph.save(file_path))
+        graph_loaded = gtg.GEOMETRY_TASK_GRAPH()
+        self.assertTrue(graph_loaded.load(file_path))
+        # The static lower bounds of A* are read from the file
+        path = graph_loaded.book_a_path((0, 0), 0, width + 1, 1, 0)
+        self.assertEqual(len(path), 3)
+        self.assertTrue(graph_loaded.edge_list.get_num_built_edges() < graph_loaded.num_edges // 10)
+        self.assertEqual(graph_loaded.get_lower_bound_to_node(width + 1), graph.get_lower_bound_to_node(width + 1))
+
+
+class TEST_COLUMNAR_STORE(unittest.TestCase):
+    def check_remained_capacity_vector(self):
+        for seed in range(20):
+            graph = make_random_graph(20, 50, seed, num_tasks=0)
+            if seed % 2 == 1:
+                graph.set_capacity_mode(ed.CAPACITY_MODE_PROFILE)
+            graph.set_columnar_store(True)
+            rnd = random.Random(seed)
+            for step in range(60):
+                edge = rnd.choice(graph.edge_list)
+                if rnd.random() < 0.7:
+                    # The same agent may get overlapped tasks at an edge
+                    T_min = rnd.randint(0, 40)
+                    T_zone = (T_min, T_min + rnd.randint(0, 10)) if rnd.random() < 0.9 else (T_min, None)
+                    if edge.is_available_for_T_zone(T_zone):
+                        edge.put_agent(rnd.randint(100, 104), rnd.randint(0, 3), (rnd.random() < 0.5), T_zone)
+                elif edge.agent_dict:
+                    edge.remove_agent(rnd.choice(list(edge.agent_dict)))
+                T_min = rnd.randint(-5, 50)
+                T_zone = (T_min, rnd.choice([T_min + rnd.randint(0, 15), None, T_min - 1]))
+                only_count_activated_agent = (rnd.random() < 0.3)
+                agent_id = rnd.choice([None, 100, 103, 999])
+                remained = graph.get_edge_remained_capacity(T_zone, only_count_activated_agent, agent_id)
+                expected = [edge_i.get_remained_capacity_for_T_zone(T_zone, only_count_activated_agent, agent_id) for edge_i in graph.edge_list]
+                self.assertEqual([int(value) for value in remained], expected, (seed, step, T_zone, only_count_activated_agent, agent_id))
+
+    @unittest.skipIf(cl.np is None, 'numpy is not installed')
+    def test_remained_capacity_vector_with_numpy(self):
+        self.check_remained_capacity_vector()
+
+    def test_remained_capacity_vector_without_numpy(self):
+        np = cl.np
+        cl.np = None
+        try:
+            self.check_remained_capacity_vector()
+        finally:
+            cl.np = np
+
+
+class TEST_SHARED_SNAPSHOT(unittest.TestCase):
+    def make_graph(self, seed):
+        # The durations are distinct powers of 2, so that the earliest path is unique and all the engines agree
+        rnd = random.Random(seed)
+        graph = gtg.GEOMETRY_TASK_GRAPH()
+        for nid in range(15):
+            graph.add_one_node_by_name('N%d' % nid)
+        for k in range(40):
+            from_node_id, to_node_id = rnd.randrange(15), rnd.randrange(15)
+            if from_node_id != to_node_id:
+                graph.add_one_edge_by_node_id(from_node_id, to_node_id, (rnd.random() < 0.7), 1, (2**k, 2**k))
+        return graph
+
+    @unittest.skipIf(sn.shared_memory is None, 'multiprocessing.shared_memory is not available')
+    def test_book_paths_matches_the_graph(self):
+        for seed in range(5):
+            graph, graph_ref = self.make_graph(seed), self.make_graph(seed)
+            rnd = random.Random(seed)
+            request_list = [((0, 0), rnd.randrange(15), rnd.randrange(15), 100 + k, 0) for k in range(10)]
+            pool = sn.SHARED_SNAPSHOT_POOL(graph, 2)
+            try:
+                self.assertEqual(pool.book_paths(request_list[:5]), graph_ref.book_paths(request_list[:5]))
+                generation = pool.generation
+                # Published again for the commits above
+                self.assertEqual(pool.book_paths(request_list[5:]), graph_ref.book_paths(request_list[5:]))
+                self.assertGreater(pool.generation, generation)
+                generation = pool.generation
+                query_list = [(T_zone_start, start_id, end_id, 200) for T_zone_start, start_id, end_id, _, _ in request_list]
+                self.assertEqual(pool.search_paths(query_list), [graph_ref._search_path(T_zone_start, start_id, end_id, False, agent_id) for T_zone_start, start_id, end_id, agent_id in query_list])
+                self.assertGreater(pool.generation, generation)
+                # Nothing changed, not published again
+                generation = pool.generation
+                pool.search_paths(query_list)
+                self.assertEqual(pool.generation, generation)
+            finally:
+                pool.close()
+
+
+class TEST_CBS(unittest.TestCase):
+    def test_solver_leaves_graph_untouched(self):
+        # The constraints are checked aside, the edges and the reservation table are not modified
+        for seed in range(20):
+            graph = make_random_graph(15, 35, seed, num_tasks=10)
+            if seed % 2 == 1:
+                graph.set_node_reservation(True)
+            event_list = []
+            for edge in graph.edge_list:
+                edge.add_state_listener(lambda edge, event, agent_id, task_id: event_list.append(event))
+            state_version = graph.state_version
+            rnd = random.Random(seed)
+            request_dict = dict()
+            for k in range(6):
+                request_dict[k] = ((0, 0), rnd.randrange(15), rnd.randrange(15), 200 + k)
+            solver = cbs.CBS_SOLVER(graph, horizon=40, max_num_expansions=50)
+            status, solution_dict, conflict_list = solver.solve(request_dict)
+            self.assertEqual(event_list, [], seed)
+            self.assertEqual(graph.state_version, state_version, seed)
+            if status == cbs.CBS_STATUS_SOLVED:
+                self.assertEqual(solver.find_conflicts(request_dict, solution_dict), [], seed)
+
+    def test_solver_steps_aside_into_a_bay(self):
+        # A corridor 0-1-2 with a bay 3 off node 1, one of the agents has to wait in the bay
+        graph = make_bay_graph()
+        request_dict = {'A':((0, 0), 0, 2, 1), 'B':((0, 0), 2, 0, 2)}
+        solver = cbs.CBS_SOLVER(graph, 1.0, 20, 1, 2000)
+        status, solution_dict, conflict_list = solver.solve(request_dict)
+        self.assertEqual(status, cbs.CBS_STATUS_SOLVED)
+        self.assertEqual(solver.find_conflicts(request_dict, solution_dict), [])
+        result_list = graph.book_paths_cbs([((0, 0), 0, 2, 1, 0), ((0, 0), 2, 0, 2, 0)], 1.0, 20, 1, 2000)
+        self.assertEqual([result['is_booked'] for result in result_list], [True, True], result_list)
+
+    @unittest.skipUnless(hasattr(multiprocessing, 'set_start_method'), 'The start methods need Python 3.4+')
+    def test_solver_on_spawned_workers(self):
+        # The edges are sent to the workers without the listeners of the graph (which hold its locks)
+        graph = make_bay_graph()
+        request_dict = {'A':((0, 0), 0, 2, 1), 'B':((0, 0), 2, 0, 2)}
+        expected = cbs.CBS_SOLVER(graph, 1.0, 20, 1, 2000).solve(request_dict)
+        start_method = multiprocessing.get_start_method()
+        multiprocessing.set_start_method('spawn', force=True)
+        try:
+            self.assertEqual(cbs.CBS_SOLVER(graph, 1.0, 20, 1, 2000, num_workers=2).solve(request_dict), expected)
+        finally:
+            multiprocessing.set_start_method(start_method, force=True)
+
+
+if __name__ == '__main__':
+    unittest.main()